@@ -0,0 +1,126 @@
+from __future__ import annotations
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+from frame_cache import open_video
+from processing_steps import *
+from processing_steps.registry import preprocess_steps
+
+'''
+ ACTIVITY INDEX CALIBRATION: how well does the cheap ActivityIndex follow the optical flow numbers?
+ Runs the usual preprocessing once per frame, then both ActivityIndex and the optical flow path
+ (OpticalFlowCalculator + GraphData) on the result, with the same rolling window, and prints the
+ correlation between the two curves and how long each path took.
+
+    python activity_calibration.py data/11_18-Vid11.mov --frames 2000
+'''
+
+
+def _read_rows(path) -> dict:
+    """ {time: value} of a GraphData style file """
+    rows = {}
+    with open(path) as f:
+        for line in f:
+            t, value = line.split(',')
+            rows[round(float(t), 6)] = float(value)
+    return rows
+
+
+def _ranks(values):
+    ranks = np.empty(len(values))
+    ranks[np.argsort(values, kind='stable')] = np.arange(len(values))
+    return ranks
+
+
+def calibrate_activity(video_path, preprocessing=None, stride=10, max_frames=None, fps=30, window=20,
+                       outdir='data/activity_calibration', **activity_kwargs) -> dict:
+    """
+    Runs both paths on every stride-th frame (up to max_frames processed frames). activity_kwargs go to the
+    ActivityIndex objects (e.g. threshold=10, background=True). Both metrics ('fraction' and 'energy') are
+    checked. Returns {'fraction': pearson r, 'fraction_spearman': rank correlation, 'energy': ..., ...,
+    'activity_ms': time per frame of ActivityIndex, 'flow_ms': time per frame of the optical flow path}.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    files = {name: os.path.join(outdir, f'{name}.csv') for name in ('flow', 'fraction', 'energy')}
+    for path in files.values():
+        if os.path.exists(path):
+            os.remove(path)
+    preprocessing = preprocessing if preprocessing is not None else preprocess_steps()
+    # One ActivityIndex per metric, so each writes its own file
+    fraction = ActivityIndex(files['fraction'], fps, window, metric='fraction', **activity_kwargs)
+    energy = ActivityIndex(files['energy'], fps, window, metric='energy', **activity_kwargs)
+    # The rest of the standard pipeline (pipeline.json), writing to our own file with our window
+    flow = build_steps(set_kwargs(default_config(start='OpticalFlowCalculator'), 'GraphData',
+                                  outfile=files['flow'], fps=fps, windowSize=window))
+    activity_seconds = 0.0
+    flow_seconds = 0.0
+
+    cap = open_video(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+    frame_num = 0
+    frames = 0
+    while max_frames is None or frames < max_frames:
+        if not cap.grab():
+            break
+        if frame_num % stride != 0:
+            frame_num += 1
+            continue
+        ret, frame = cap.retrieve()
+        if not ret:
+            frame_num += 1
+            continue
+        context = {'original_frame': frame, 'current_frame': frame, 'frame_number': frame_num}
+        for step in preprocessing:
+            context = step.process(context)
+
+        start = time.perf_counter()
+        fraction.process(dict(context))
+        activity_seconds += time.perf_counter() - start
+        # (the energy one repeats the same work, so it isn't timed)
+        energy.process(dict(context))
+
+        start = time.perf_counter()
+        for step in flow:
+            context = step.process(context)
+        flow_seconds += time.perf_counter() - start
+        frames += 1
+        frame_num += 1
+    cap.release()
+
+    flow_rows = _read_rows(files['flow'])
+    report = {'frames': frames, 'activity_ms': 1000 * activity_seconds / max(frames, 1),
+              'flow_ms': 1000 * flow_seconds / max(frames, 1)}
+    report['speedup'] = flow_seconds / activity_seconds if activity_seconds > 0 else float('inf')
+    for name in ('fraction', 'energy'):
+        rows = _read_rows(files[name])
+        # GraphData skips frames that have no tracks, so the rows are matched up by time
+        times = sorted(set(rows) & set(flow_rows))
+        values = np.array([rows[t] for t in times])
+        flow_values = np.array([flow_rows[t] for t in times])
+        if len(times) < 3 or np.std(values) == 0 or np.std(flow_values) == 0:
+            report[name] = report[f'{name}_spearman'] = float('nan')
+            continue
+        report[name] = float(np.corrcoef(values, flow_values)[0, 1])
+        report[f'{name}_spearman'] = float(np.corrcoef(_ranks(values), _ranks(flow_values))[0, 1])
+
+    print(f"{frames} frames: ActivityIndex {report['activity_ms']:.2f} ms/frame, optical flow path "
+          f"{report['flow_ms']:.2f} ms/frame ({report['speedup']:.1f}x faster)")
+    for name in ('fraction', 'energy'):
+        print(f"    {name}: correlation with optical flow {report[name]:.3f} (rank correlation "
+              f"{report[f'{name}_spearman']:.3f})")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ActivityIndex with the optical flow numbers on a video.")
+    parser.add_argument('video', nargs='?', default='data/11_18-Vid11.mov')
+    parser.add_argument('--stride', type=int, default=10)
+    parser.add_argument('--frames', type=int, default=None, help="number of frames to process (default: all)")
+    parser.add_argument('--threshold', type=float, default=15)
+    parser.add_argument('--background', action='store_true', help="compare with a running average of the frames")
+    args = parser.parse_args()
+    calibrate_activity(args.video, stride=args.stride, max_frames=args.frames, threshold=args.threshold,
+                       background=args.background)
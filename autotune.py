@@ -0,0 +1,295 @@
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import os
+import time
+import numpy as np
+from seek_index import RandomAccessVideo
+
+'''
+ AUTO-TUNING: picks the frame stride, the analysis resolution and the OpticalFlowCalculator feature budget
+ (max_features, and feature_threshold if the config carries points over) instead of guessing them. Every combination is run on a few short
+ segments spread over the video, and compared with a high fidelity reference run (every frame, full
+ resolution, the biggest feature budget):
+    fps   -> video frames analysed per second (decoding included), so stride 10 counts the 9 skipped frames too
+    error -> how far the GraphData curve is from the reference: sum of |difference| / sum of |reference|,
+             with the trial curve interpolated at the reference's times (0.1 = 10% off on average)
+ The cheapest combination (highest fps) with fps >= target_fps and error <= max_error is written as a
+ pipeline config (same format as pipeline.json, with the stride in it), ready for run_main/batch.py:
+
+    python autotune.py data/11_18-Vid11.mov --config pipeline.json --target-fps 150 --max-error 0.15
+
+ So that curves from different strides can be compared, GraphData is switched to a time based window
+ (window_seconds, covering the same time as the config's windowSize at its stride) with per_frame=True,
+ in the trials and in the config that's written. A lower resolution is done with a Resize step at the
+ front, with the pixel positions/sizes of the steps after it (PIXEL_KWARGS) scaled to match.
+'''
+
+# Step arguments that are in pixels, and how to scale them: 'round' -> number (or list of numbers) times
+# the scale, 'odd' -> kernel sizes (kept odd and at least 1), 'scale' -> any float
+PIXEL_KWARGS = {
+    'CircleCrop': {'center': 'round', 'r': 'round'},
+    'CropLine': {'intercept': 'scale'},
+    'ApplyMaskDenoised': {'kernel_size': 'odd'},
+    'MedianFilter': {'kernel_size': 'odd'},
+}
+
+
+def _scale_value(value, how, scale):
+    if isinstance(value, (list, tuple)):
+        return [_scale_value(v, how, scale) for v in value]
+    if how == 'odd':
+        return max(1, int(value * scale) // 2 * 2 + 1)
+    if how == 'round':
+        return int(round(value * scale))
+    return value * scale
+
+
+def _scale_spec(spec, scale):
+    from processing_steps.registry import is_step_spec, split_spec
+    name, kwargs = split_spec(spec)
+    for key, value in kwargs.items():
+        if is_step_spec(value):
+            # e.g. the step inside a TiledStep
+            kwargs[key] = _scale_spec(value, scale)
+        elif key in PIXEL_KWARGS.get(name, {}):
+            kwargs[key] = _scale_value(value, PIXEL_KWARGS[name][key], scale)
+    return {'step': name, **kwargs}
+
+
+def tuned_config(config, scale=1.0, max_features=None, feature_threshold=None, graph=None) -> list:
+    """
+    A copy of config (a list of step configs) at another resolution and feature budget:
+    scale -> puts a Resize(scale) step in front and scales the pixel arguments (PIXEL_KWARGS) of every step
+    max_features, feature_threshold -> set on every OpticalFlowCalculator (left alone if None)
+    graph -> dict of arguments to set on every GraphData (e.g. a different outfile)
+    """
+    from processing_steps.registry import split_spec
+    steps = []
+    for spec in config:
+        if scale != 1:
+            spec = _scale_spec(spec, scale)
+        name, kwargs = split_spec(spec)
+        if name == 'OpticalFlowCalculator':
+            if max_features is not None:
+                kwargs['max_features'] = int(max_features)
+            if feature_threshold is not None:
+                kwargs['feature_threshold'] = int(feature_threshold)
+        if name == 'GraphData' and graph:
+            kwargs.update(graph)
+        steps.append({'step': name, **kwargs})
+    if scale != 1:
+        steps.insert(0, {'step': 'Resize', 'scale': scale})
+    return steps
+
+
+def _graph_settings(config, stride) -> dict:
+    """ The GraphData arguments every trial (and the tuned config) uses, so all the curves are comparable """
+    from processing_steps.registry import split_spec
+    graphs = [kwargs for name, kwargs in map(split_spec, config) if name == 'GraphData']
+    if not graphs:
+        raise ValueError("The config needs a GraphData step to compare the curves of.")
+    graph = graphs[0]
+    fps = graph.get('fps', 30)
+    window_seconds = graph.get('window_seconds') or graph.get('windowSize', 20) * stride / float(fps)
+    return {'fps': fps, 'windowSize': graph.get('windowSize', 20), 'window_seconds': round(window_seconds, 3),
+            'per_frame': True}
+
+
+def _read_curve(path):
+    if not os.path.exists(path):
+        return np.zeros((0, 2))
+    rows = [[float(value) for value in line.split(',')] for line in open(path) if line.strip()]
+    return np.array(rows).reshape(-1, 2)
+
+
+def run_trial(config, video: RandomAccessVideo, segments, stride: int, outfile: str) -> dict:
+    """
+    Runs config on every stride-th frame of each (first frame, last frame) segment, each segment with fresh
+    steps. Returns {'fps', 'seconds', 'curves' (one (time, value) array per segment)}.
+    """
+    from processing_steps import Pipeline, build_steps
+    config = tuned_config(config, graph={'outfile': outfile})
+    seconds = 0.0
+    video_frames = 0
+    curves = []
+    for first, last in segments:
+        if os.path.exists(outfile):
+            os.remove(outfile)
+        cv_pipeline = Pipeline(build_steps(config))
+        keep_original = cv_pipeline.needs('original_frame')
+        start = time.perf_counter()
+        for frame_num, frame in video.read_frames(range(first, last, stride)):
+            context = {'current_frame': frame, 'frame_number': frame_num}
+            if keep_original:
+                context['original_frame'] = frame.copy()
+            cv_pipeline.run(context)
+        # (read_frames only decodes up to the last frame it gives back, the real run would go on to `last`)
+        seconds += time.perf_counter() - start
+        cv_pipeline.close()
+        video_frames += last - first
+        curves.append(_read_curve(outfile))
+    return {'fps': video_frames / seconds if seconds > 0 else float('inf'), 'seconds': seconds, 'curves': curves}
+
+
+def curve_error(reference_curves, curves) -> float:
+    """ sum |trial - reference| / sum |reference| over all segments (trial interpolated at the reference times) """
+    difference = 0.0
+    total = 0.0
+    for reference, curve in zip(reference_curves, curves):
+        if len(reference) == 0:
+            continue
+        if len(curve) < 2:
+            return float('inf')
+        inside = (reference[:, 0] >= curve[0, 0]) & (reference[:, 0] <= curve[-1, 0])
+        if not inside.any():
+            return float('inf')
+        values = np.interp(reference[inside, 0], curve[:, 0], curve[:, 1])
+        difference += np.abs(values - reference[inside, 1]).sum()
+        total += np.abs(reference[inside, 1]).sum()
+    if total == 0:
+        return 0.0 if difference == 0 else float('inf')
+    return float(difference / total)
+
+
+def pick_segments(frame_count: int, segments: int, segment_frames: int) -> list:
+    """ (first, last) frame of `segments` equally spaced segments of segment_frames frames """
+    segment_frames = min(segment_frames, frame_count // segments)
+    if segment_frames < 1:
+        raise ValueError(f"The video is too short for {segments} segments.")
+    starts = np.linspace(0, frame_count - segment_frames, segments).astype(int)
+    return [(int(first), int(first) + segment_frames) for first in starts]
+
+
+def _dominated(candidate, others) -> bool:
+    """ Whether candidate (stride, scale, features) is at least as cheap as one of others in every setting """
+    stride, scale, features = candidate
+    return any(stride >= s and scale <= c and features <= f for s, c, f in others)
+
+
+def _costlier(candidate, others) -> bool:
+    """ Whether candidate is at least as expensive as one of others in every setting """
+    stride, scale, features = candidate
+    return any(stride <= s and scale >= c and features >= f for s, c, f in others)
+
+
+def write_config(path, stride, steps, tuning: dict):
+    """ Writes the config like pipeline.json (one step per line), with the tuning results alongside """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    lines = ',\n'.join(f'    {json.dumps(step)}' for step in steps)
+    with open(path, 'w') as f:
+        f.write(f'{{\n  "stride": {stride},\n  "steps": [\n{lines}\n  ],\n'
+                f'  "autotune": {json.dumps(tuning)}\n}}\n')
+
+
+def autotune(video_path, config_path='pipeline.json', out_path='pipeline_tuned.json', target_fps: float = 150,
+             max_error: float = 0.15, strides=(2, 5, 10, 15, 20, 30), scales=(1.0, 0.75, 0.5),
+             features=(500, 250, 100), reference_stride: int = 1, segments: int = 3, segment_seconds: float = 20,
+             workdir='data/autotune', verbose: bool = True) -> dict:
+    """
+    Tries every combination of strides x scales x features (max_features for OpticalFlowCalculator, with
+    feature_threshold scaled along with it if the config sets one) on `segments` segments of segment_seconds each, and writes the
+    cheapest one that meets target_fps and max_error to out_path (see the top of this file).
+    Combinations that are cheaper in every setting than one that was already too far off, or dearer in every
+    setting than one that was already too slow, are skipped without running them.
+    Returns {'best': the chosen trial (or None), 'trials': every trial that was run, 'reference': ...}.
+    """
+    from processing_steps import load_config
+    from processing_steps.registry import split_spec
+    with open(config_path) as f:
+        settings = json.load(f)
+    base_stride = settings.get('stride', 10) if isinstance(settings, dict) else 10
+    config = load_config(config_path)
+    graph = _graph_settings(config, base_stride)
+    flows = [kwargs for name, kwargs in map(split_spec, config) if name == 'OpticalFlowCalculator']
+    base_features = flows[0].get('max_features', 500) if flows else 500
+    # No feature_threshold means a new search every frame, which the trials keep (so they match the config's tracks)
+    threshold = flows[0].get('feature_threshold') if flows else None
+    threshold_ratio = None if threshold is None else threshold / base_features
+    os.makedirs(workdir, exist_ok=True)
+
+    video = RandomAccessVideo(video_path)
+    segment_frames = int(segment_seconds * (video.fps or graph['fps']))
+    if segment_frames / float(graph['fps']) <= graph['window_seconds']:
+        raise ValueError(f"Segments of {segment_seconds}s are too short for the {graph['window_seconds']:.1f}s "
+                         f"GraphData window, make segment_seconds longer.")
+    sample = pick_segments(video.frame_count, segments, segment_frames)
+    if verbose:
+        print(f"Segments (frames): {sample}, GraphData window {graph['window_seconds']:.2f}s")
+
+    def trial_config(scale, max_features):
+        threshold = None if threshold_ratio is None else max(1, round(max_features * threshold_ratio))
+        return tuned_config(config, scale, max_features, threshold, graph)
+
+    reference = run_trial(trial_config(1.0, max(features)), video, sample, reference_stride,
+                          os.path.join(workdir, 'reference.csv'))
+    if verbose:
+        print(f"Reference (stride {reference_stride}, full size, {max(features)} features): "
+              f"{reference['fps']:.1f} fps")
+
+    candidates = sorted(itertools.product(strides, scales, features), key=lambda c: (-c[0], c[1], c[2]))
+    too_far = []
+    too_slow = []
+    trials = []
+    for stride, scale, max_features in candidates:
+        if _dominated((stride, scale, max_features), too_far) or _costlier((stride, scale, max_features), too_slow):
+            continue
+        result = run_trial(trial_config(scale, max_features), video, sample, stride,
+                           os.path.join(workdir, 'trial.csv'))
+        error = curve_error(reference['curves'], result['curves'])
+        trial = {'stride': stride, 'scale': scale, 'max_features': max_features, 'fps': round(result['fps'], 2),
+                 'error': round(error, 4)}
+        trials.append(trial)
+        if error > max_error:
+            too_far.append((stride, scale, max_features))
+        if result['fps'] < target_fps:
+            too_slow.append((stride, scale, max_features))
+        if verbose:
+            ok = 'ok' if error <= max_error and result['fps'] >= target_fps else ''
+            print(f"stride {stride:3d}, scale {scale:.2f}, {max_features:4d} features: {result['fps']:8.1f} fps, "
+                  f"error {error:.3f} {ok}")
+    video.release()
+
+    passing = [trial for trial in trials if trial['error'] <= max_error and trial['fps'] >= target_fps]
+    best = max(passing, key=lambda trial: (trial['fps'], -trial['error'])) if passing else None
+    report = {'best': best, 'trials': trials, 'reference': {'stride': reference_stride, 'fps': reference['fps']}}
+    if best is None:
+        if verbose:
+            print(f"Nothing met {target_fps} fps with error <= {max_error}, no config written. Try a lower "
+                  f"target fps, a bigger max error, or more strides/scales.")
+        return report
+
+    # The tuned config writes to the same file as the original one
+    original_graph = [kwargs for name, kwargs in map(split_spec, config) if name == 'GraphData'][0]
+    steps = trial_config(best['scale'], best['max_features'])
+    steps = tuned_config(steps, graph={'outfile': original_graph.get('outfile', 'output.csv')})
+    write_config(out_path, best['stride'], steps, {
+        'video': os.path.basename(video_path), 'from': config_path, 'target_fps': target_fps,
+        'max_error': max_error, 'fps': best['fps'], 'error': best['error'],
+        'reference_fps': round(reference['fps'], 2), 'created': time.strftime('%Y-%m-%d %H:%M:%S')})
+    if verbose:
+        print(f"Best: stride {best['stride']}, scale {best['scale']}, {best['max_features']} features "
+              f"({best['fps']:.1f} fps, error {best['error']:.3f}), written to {out_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the cheapest stride/resolution/feature budget that is "
+                                                 "fast enough and close enough to a full quality run.")
+    parser.add_argument('video', nargs='?', default='data/11_18-Vid11.mov')
+    parser.add_argument('--config', default='pipeline.json', help="pipeline config to tune")
+    parser.add_argument('--out', default='pipeline_tuned.json', help="where to write the tuned config")
+    parser.add_argument('--target-fps', type=float, default=150, help="video frames analysed per second")
+    parser.add_argument('--max-error', type=float, default=0.15, help="allowed relative error of the curve")
+    parser.add_argument('--strides', type=int, nargs='+', default=[2, 5, 10, 15, 20, 30])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.75, 0.5])
+    parser.add_argument('--features', type=int, nargs='+', default=[500, 250, 100])
+    parser.add_argument('--reference-stride', type=int, default=1)
+    parser.add_argument('--segments', type=int, default=3)
+    parser.add_argument('--segment-seconds', type=float, default=20)
+    args = parser.parse_args()
+    autotune(args.video, args.config, args.out, args.target_fps, args.max_error, args.strides, args.scales,
+             args.features, args.reference_stride, args.segments, args.segment_seconds)
@@ -0,0 +1,265 @@
+from __future__ import annotations
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+'''
+ BATCH RUNS: runs the pipeline from a config file (see pipeline.json) on every video in a folder.
+
+    python batch.py data/videos --config pipeline.json --out data/batch --workers 4
+
+ Every video gets its own folder, <out>/<video file name>/ (e.g. data/batch/11_18-Vid11.mov/), with the files
+ that the config's steps write (any "outfile" argument is moved in there) and a done.json recording what was
+ run. Videos are run on a pool of processes, longest first so a long video doesn't start last and hold up
+ the end of the batch. A video is skipped if its done.json says it was already run with the same config on
+ the same (unchanged) video; use --force to redo everything. If one video fails (or even crashes its worker),
+ the rest still run, and the error ends up in the summary (and the full traceback in
+ <out>/<video file name>/error.txt).
+
+ <out>/summary.csv has one row per video (status, frames, seconds, and the mean/max of its GraphData output),
+ and <out>/combined.csv has every video's GraphData rows in one file, with the video name in front.
+'''
+
+VIDEO_EXTENSIONS = ('.mov', '.mp4', '.avi', '.mkv', '.fcache')
+
+
+def find_videos(folder: str, extensions=VIDEO_EXTENSIONS) -> list:
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.lower().endswith(extensions) and os.path.isfile(os.path.join(folder, name)))
+
+
+def _video_name(video_path: str) -> str:
+    # With the extension, so a.mov and a.mp4 in the same folder don't share (and overwrite) one output folder
+    return os.path.basename(video_path)
+
+
+def _video_signature(video_path: str) -> list:
+    stat = os.stat(video_path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def _config_hash(config, stride) -> str:
+    return hashlib.sha1(json.dumps([config, stride], sort_keys=True).encode()).hexdigest()
+
+
+def _estimated_length(video_path: str) -> float:
+    """ Number of frames in the video (from its header, nothing is decoded), or its file size if that fails """
+    import cv2
+    from frame_cache import open_video
+    cap = open_video(video_path)
+    count = cap.get(cv2.CAP_PROP_FRAME_COUNT) if cap.isOpened() else 0
+    cap.release()
+    return count if count > 0 else os.path.getsize(video_path) / 1e4
+
+
+def _move_outfiles(spec, folder: str):
+    """ The same step config, with every outfile argument (also in nested steps) pointed into folder """
+    if isinstance(spec, dict):
+        return {key: os.path.join(folder, os.path.basename(value)) if key == 'outfile' and isinstance(value, str)
+                else _move_outfiles(value, folder) for key, value in spec.items()}
+    if isinstance(spec, list):
+        return [_move_outfiles(item, folder) for item in spec]
+    return spec
+
+
+def _outfiles(spec) -> list:
+    if isinstance(spec, dict):
+        found = [value for key, value in spec.items() if key == 'outfile' and isinstance(value, str)]
+        return found + [path for value in spec.values() for path in _outfiles(value)]
+    if isinstance(spec, list):
+        return [path for item in spec for path in _outfiles(item)]
+    return []
+
+
+def _graph_outfiles(config) -> list:
+    """ The outfiles of every GraphData in the config, in any form load_config takes and inside other steps too """
+    from processing_steps.registry import is_step_spec, split_spec
+    found = []
+    for spec in config:
+        if isinstance(spec, str) or is_step_spec(spec):
+            name, kwargs = split_spec(spec)
+            if name == 'GraphData' and isinstance(kwargs.get('outfile'), str):
+                found.append(kwargs['outfile'])
+            # e.g. the step inside a TiledStep
+            found += _graph_outfiles([value for value in kwargs.values() if is_step_spec(value)])
+    return found
+
+
+def is_up_to_date(video_path: str, folder: str, config_hash: str) -> bool:
+    try:
+        with open(os.path.join(folder, 'done.json')) as f:
+            done = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return done.get('config') == config_hash and done.get('video') == _video_signature(video_path)
+
+
+def _init_worker(threads: int):
+    import cv2
+    # Each worker gets its share of the cores, instead of every worker's OpenCV trying to use all of them
+    cv2.setNumThreads(threads)
+
+
+def run_video(steps, video_path: str, stride: int) -> int:
+    """
+    Runs the steps on every stride-th frame of the video, and returns how many frames that was. Uses the same
+    frame loop as main.run_main (frame_loop.py), but not main itself, so a worker only imports the steps the
+    config uses (main imports every step, plus the realtime/metrics/seek index modules).
+    """
+    from frame_cache import open_video
+    from frame_loop import run_frames
+    from processing_steps import Pipeline
+    cv_pipeline = Pipeline(steps)
+    cap = open_video(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+    try:
+        run_frames(cv_pipeline, cap, stride)
+    finally:
+        cap.release()
+        cv_pipeline.close()
+    return cv_pipeline.frames_run
+
+
+def _run_job(video_path: str, config, stride: int, folder: str, config_hash: str) -> dict:
+    """ Runs one video (in a worker process). Errors are returned, not raised, so they end up in the summary. """
+    start = time.time()
+    try:
+        from processing_steps import build_steps
+        os.makedirs(folder, exist_ok=True)
+        # Outputs are appended to, so start from nothing (done.json last, it's only rewritten on success)
+        for path in _outfiles(config) + [os.path.join(folder, 'done.json')]:
+            if os.path.exists(path):
+                os.remove(path)
+        frames = run_video(build_steps(config), video_path, stride)
+        result = {'status': 'done', 'frames': frames, 'seconds': round(time.time() - start, 2)}
+        with open(os.path.join(folder, 'done.json'), 'w') as f:
+            json.dump(dict(result, video=_video_signature(video_path), config=config_hash), f)
+        return result
+    except Exception as e:
+        return {'status': 'failed', 'seconds': round(time.time() - start, 2), 'error': f"{type(e).__name__}: {e}",
+                'traceback': traceback.format_exc()}
+
+
+def _read_graph_csv(path: str) -> list:
+    """ (time, value) rows of a GraphData file """
+    rows = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                parts = line.split(',')
+                if len(parts) == 2:
+                    rows.append((float(parts[0]), float(parts[1])))
+    return rows
+
+
+def _write_summary(results: dict, outdir: str, graph_name):
+    with open(os.path.join(outdir, 'summary.csv'), 'w', newline='') as summary, \
+            open(os.path.join(outdir, 'combined.csv'), 'w', newline='') as combined:
+        summary_writer = csv.writer(summary)
+        combined_writer = csv.writer(combined)
+        summary_writer.writerow(['video', 'status', 'frames', 'seconds', 'rows', 'mean_movement', 'max_movement', 'error'])
+        combined_writer.writerow(['video', 'time', 'movement'])
+        for video_path, result in results.items():
+            name = os.path.basename(video_path)
+            rows = _read_graph_csv(os.path.join(outdir, _video_name(video_path), graph_name)) \
+                if graph_name and result['status'] != 'failed' else []
+            values = [value for _, value in rows]
+            summary_writer.writerow([name, result['status'], result.get('frames', ''), result.get('seconds', ''),
+                                     len(rows), sum(values) / len(values) if values else '',
+                                     max(values) if values else '', result.get('error', '')])
+            combined_writer.writerows([name, t, value] for t, value in rows)
+
+
+def _run_pool(jobs: list, workers: int, threads: int, stride: int, config_hash: str, results: dict) -> list:
+    """ Runs the jobs on one process pool, putting their results in results. Returns the jobs lost to a crash. """
+    crashed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = {pool.submit(_run_job, video_path, job_config, stride, job_folder, config_hash):
+                   (video_path, job_config, job_folder) for video_path, job_config, job_folder in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                crashed.append(job)
+                continue
+            results[job[0]] = result
+            if 'traceback' in result:
+                os.makedirs(job[2], exist_ok=True)
+                with open(os.path.join(job[2], 'error.txt'), 'w') as f:
+                    f.write(result.pop('traceback'))
+            print(f"{os.path.basename(job[0])}: {result['status']}"
+                  + (f" ({result['error']})" if 'error' in result else f" in {result['seconds']}s"))
+    return crashed
+
+
+def run_batch(folder: str, config_path: str = 'pipeline.json', outdir: str = 'data/batch', workers: int = None,
+              stride: int = None, force: bool = False, extensions=VIDEO_EXTENSIONS) -> dict:
+    """
+    Runs the pipeline in config_path on every video in folder (see the top of this file).
+    stride -> every stride-th frame, default is the "stride" in the config file (or 10)
+    Returns {video path: result dict} (status 'done', 'up to date' or 'failed').
+    """
+    from processing_steps import load_config
+    with open(config_path) as f:
+        settings = json.load(f)
+    if stride is None:
+        stride = settings.get('stride', 10) if isinstance(settings, dict) else 10
+    config = load_config(config_path)
+    config_hash = _config_hash(config, stride)
+    graph_files = [os.path.basename(path) for path in _graph_outfiles(config)]
+    graph_name = graph_files[0] if graph_files else None
+    if graph_name is None:
+        print(f"Warning: {config_path} has no GraphData step with an outfile, so summary.csv won't have any "
+              f"movement numbers and combined.csv will be empty")
+
+    os.makedirs(outdir, exist_ok=True)
+    results = {}
+    jobs = []
+    for video_path in find_videos(folder, extensions):
+        job_folder = os.path.join(outdir, _video_name(video_path))
+        if not force and is_up_to_date(video_path, job_folder, config_hash):
+            with open(os.path.join(job_folder, 'done.json')) as f:
+                done = json.load(f)
+            results[video_path] = {'status': 'up to date', 'frames': done.get('frames'), 'seconds': done.get('seconds')}
+        else:
+            results[video_path] = None
+            jobs.append((video_path, _move_outfiles(config, job_folder), job_folder))
+    print(f"{len(results)} videos, {len(jobs)} to run, {len(results) - len(jobs)} up to date")
+    jobs.sort(key=lambda job: _estimated_length(job[0]), reverse=True)
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # A worker that dies outright (e.g. a segfault in a decoder) breaks the whole pool, and every job that was
+    # still in it fails with it. Those jobs are run again one at a time, each in its own pool, so a crash
+    # can only take down the video that caused it.
+    crashed = _run_pool(jobs, workers, threads, stride, config_hash, results)
+    for job in crashed:
+        if _run_pool([job], 1, threads, stride, config_hash, results):
+            results[job[0]] = {'status': 'failed', 'error': 'worker process crashed'}
+            print(f"{os.path.basename(job[0])}: failed (worker process crashed)")
+
+    _write_summary(results, outdir, graph_name)
+    failed = [video for video, result in results.items() if result['status'] == 'failed']
+    if failed:
+        print(f"{len(failed)} failed: {', '.join(os.path.basename(video) for video in failed)}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline on every video in a folder.")
+    parser.add_argument('folder')
+    parser.add_argument('--config', default='pipeline.json', help="pipeline config (see pipeline.json)")
+    parser.add_argument('--out', default='data/batch', help="folder for the results")
+    parser.add_argument('--workers', type=int, default=None, help="number of processes (default: one per core)")
+    parser.add_argument('--stride', type=int, default=None, help="default: the stride in the config")
+    parser.add_argument('--force', action='store_true', help="rerun videos that are already up to date")
+    args = parser.parse_args()
+    run_batch(args.folder, args.config, args.out, args.workers, args.stride, args.force)
@@ -0,0 +1,103 @@
+from __future__ import annotations
+import argparse
+import time
+import cv2
+import numpy as np
+from processing_steps import *
+from processing_steps.feature_detectors import DETECTORS
+from processing_steps.registry import preprocess_steps
+from seek_index import RandomAccessVideo
+
+'''
+ FEATURE DETECTOR BENCHMARK: how fast each detector is on our footage, and how good its points are.
+ Random pairs of neighbouring frames are run through the usual preprocessing, then every detector finds
+ points in the first frame and LK tracks them into the second. For each detector (with and without grid
+ bucketing) it prints:
+    ms      -> average time of one detect call
+    points  -> average number of points found
+    cells   -> fraction of the 8x8 cells of the tank that got at least one point (how spread out they are)
+    tracked -> fraction of points that LK tracked into the next frame
+    fb err  -> median forward-backward error in pixels (track to the next frame and back, lower = more reliable)
+
+    python bench_detectors.py data/11_18-Vid11.mov --pairs 40
+'''
+
+
+def _prepare(steps, frame, frame_num):
+    context = {'original_frame': frame.copy(), 'current_frame': frame, 'frame_number': frame_num}
+    for step in steps:
+        context = step.process(context)
+    gray = context['current_frame']
+    mask = context.get('mask')
+    if mask is None or mask.shape != gray.shape:
+        mask = np.full(gray.shape, 255, np.uint8)
+    return gray, mask
+
+
+def _coverage(points, mask, grid=8):
+    """ Fraction of the grid cells (inside the mask's bounding box, and with some mask in them) that have a point """
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0 or h == 0:
+        return 0.0
+    cells = cv2.resize(mask[y:y + h, x:x + w], (grid, grid), interpolation=cv2.INTER_AREA) > 0
+    hit = np.zeros((grid, grid), bool)
+    if points is not None:
+        p = points.reshape(-1, 2)
+        col = np.clip(((p[:, 0] - x) * grid / w).astype(int), 0, grid - 1)
+        row = np.clip(((p[:, 1] - y) * grid / h).astype(int), 0, grid - 1)
+        hit[row, col] = True
+    return (hit & cells).sum() / max(1, cells.sum())
+
+
+def benchmark(video_path, pairs=40, gap=1, seed=0, grid=(8, 8), max_features=500):
+    lk_params = dict(winSize=(15, 15), maxLevel=2,
+                     criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+    video = RandomAccessVideo(video_path)
+    rng = np.random.default_rng(seed)
+    starts = rng.choice(max(1, video.frame_count - gap), size=min(pairs, max(1, video.frame_count - gap)), replace=False)
+    steps = preprocess_steps()
+    frames = {}
+    wanted = sorted(set(int(s) for s in starts) | set(int(s) + gap for s in starts))
+    for frame_num, frame in video.read_frames(wanted):
+        frames[frame_num] = _prepare(steps, frame, frame_num)
+    video.release()
+    samples = [(frames[s], frames[s + gap]) for s in map(int, starts) if s in frames and s + gap in frames]
+
+    detectors = {}
+    for method in DETECTORS:
+        try:
+            detectors[method] = FeatureDetector(method, max_features=max_features)
+            detectors[f'{method}+grid'] = FeatureDetector(method, max_features=max_features, grid=grid)
+        except ValueError as e:
+            print(f"Skipping {method}: {e}")
+
+    print(f"{len(samples)} frame pairs, up to {max_features} points")
+    print(f"{'detector':<18}{'ms':>8}{'points':>8}{'cells':>8}{'tracked':>9}{'fb err':>8}")
+    for name, detector in detectors.items():
+        times, counts, coverages, tracked, errors = [], [], [], [], []
+        for (gray, mask), (next_gray, _) in samples:
+            start = time.perf_counter()
+            points = detector.detect(gray, mask)
+            times.append(time.perf_counter() - start)
+            counts.append(0 if points is None else len(points))
+            coverages.append(_coverage(points, mask))
+            if points is None:
+                continue
+            forward, status, _ = cv2.calcOpticalFlowPyrLK(gray, next_gray, points, None, **lk_params)
+            back, status_back, _ = cv2.calcOpticalFlowPyrLK(next_gray, gray, forward, None, **lk_params)
+            good = (status.ravel() == 1) & (status_back.ravel() == 1)
+            tracked.append(good.mean())
+            if good.any():
+                errors.append(np.median(np.linalg.norm((back - points).reshape(-1, 2)[good], axis=1)))
+        print(f"{name:<18}{1000 * np.mean(times):>8.2f}{np.mean(counts):>8.0f}{np.mean(coverages):>8.2f}"
+              f"{np.mean(tracked) if tracked else 0:>9.2f}{np.median(errors) if errors else float('nan'):>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the feature detectors on a video.")
+    parser.add_argument('video', nargs='?', default='data/11_18-Vid11.mov')
+    parser.add_argument('--pairs', type=int, default=40, help="number of random frame pairs to test on")
+    parser.add_argument('--gap', type=int, default=1, help="frames between the two frames of a pair (the stride)")
+    parser.add_argument('--max-features', type=int, default=500)
+    args = parser.parse_args()
+    benchmark(args.video, args.pairs, args.gap, max_features=args.max_features)
@@ -1,7 +1,7 @@
 # importing the module
 from __future__ import annotations
 import time
-import pipeline
+import processing_steps as pipeline
 import cv2
 import os
 import circle_tc
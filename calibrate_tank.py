@@ -0,0 +1,49 @@
+from __future__ import annotations
+import argparse
+import os
+import cv2
+from processing_steps.tank_calibration import detect_tank_circle, save_calibration
+from seek_index import RandomAccessVideo
+
+'''
+ TANK CALIBRATION: finds the tank circle in a few random frames of a video and saves it for that camera,
+ so the pipeline can use CircleCrop(calibration="calibration/<camera>.json") instead of a hand-tuned circle.
+
+    python calibrate_tank.py data/11_18-Vid11.mov --camera tank1
+
+ Also saves calibration/<camera>.jpg, a frame with the circle drawn on it, to check that it found the right one.
+'''
+
+
+def calibrate(video_path: str, camera: str = 'default', samples: int = 8, scale: float = 0.25,
+              folder: str = 'calibration', seed=0) -> dict:
+    video = RandomAccessVideo(video_path)
+    frames = [frame for _, frame in video.sample(samples, seed=seed)]
+    video.release()
+    if not frames:
+        raise IOError(f"Could not read any frames from {video_path}")
+    result = detect_tank_circle(frames, scale=scale)
+    if result is None:
+        raise ValueError(f"No tank circle found in {video_path}")
+    center, r, contrast = result
+    h, w = frames[0].shape[:2]
+    path = os.path.join(folder, f'{camera}.json')
+    calibration = save_calibration(path, center, r, (w, h), contrast, source=os.path.basename(video_path))
+
+    preview = frames[0].copy()
+    cv2.circle(preview, center, r, (0, 0, 255), 3)
+    cv2.circle(preview, center, 5, (0, 0, 255), -1)
+    cv2.imwrite(os.path.join(folder, f'{camera}.jpg'), preview)
+    print(f"Tank at {center}, r {r} (rim contrast {contrast:.1f}), saved to {path}")
+    return calibration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the tank circle in a video and save it for the camera.")
+    parser.add_argument('video')
+    parser.add_argument('--camera', default='default', help="name of the camera (the file is calibration/<camera>.json)")
+    parser.add_argument('--samples', type=int, default=8, help="number of random frames to look at")
+    parser.add_argument('--scale', type=float, default=0.25, help="how much to shrink the frames for the search")
+    parser.add_argument('--folder', default='calibration')
+    args = parser.parse_args()
+    calibrate(args.video, args.camera, args.samples, args.scale, args.folder)
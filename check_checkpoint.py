@@ -0,0 +1,100 @@
+from __future__ import annotations
+import os
+import sys
+import tempfile
+
+'''
+ CHECKPOINT CHECK: makes sure a run that crashes and is resumed from its last checkpoint writes exactly the
+ same files (byte for byte) as a run that never stopped. A synthetic video (synthetic_video.py) is run
+ through GrayscaleConverter -> OpticalFlowCalculator -> GraphData + ActivityHeatmap, once straight through,
+ then again with a step that crashes at a given frame and a resume in a new pipeline, the same way
+ main.run_main(resume=True) does it. Crashes right after, and in between, checkpoints are both tried.
+
+    python check_checkpoint.py
+'''
+
+
+class CrashError(Exception):
+    pass
+
+
+def _steps(folder: str, crash_at=None) -> list:
+    from processing_steps import ActivityHeatmap, GraphData, GrayscaleConverter, OpticalFlowCalculator
+    from processing_steps.pipeline import ProcessingStep
+
+    class Crash(ProcessingStep):
+        inputs = ('frame_number',)
+        outputs = ()
+        is_sink = True
+
+        def process(self, context: dict) -> dict:
+            if context['frame_number'] == crash_at:
+                raise CrashError(f"crashed at frame {crash_at}")
+            return context
+
+    return [GrayscaleConverter(), OpticalFlowCalculator(0.2),
+            GraphData(os.path.join(folder, 'output.csv'), 30, 5),
+            ActivityHeatmap(os.path.join(folder, 'heatmap.bin'), grid=(4, 4), roi=(0, 0, 320, 240), flush_every=7),
+            Crash()]
+
+
+def _run(video_path: str, folder: str, stride: int, crash_at=None, checkpoint_every: int = 5, resume=False):
+    import cv2
+    from frame_loop import run_frames
+    from processing_steps import Pipeline
+    checkpoint = os.path.join(folder, 'run.ckpt')
+    cv_pipeline = Pipeline(_steps(folder, crash_at), checkpoint_path=checkpoint, checkpoint_every=checkpoint_every)
+    cap = cv2.VideoCapture(video_path)
+    frame_num = 0
+    if resume:
+        last_frame = cv_pipeline.load_checkpoint()
+        if last_frame is not None:
+            frame_num = last_frame + 1
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+    try:
+        run_frames(cv_pipeline, cap, stride, first_frame=frame_num)
+    finally:
+        cap.release()
+    # (not reached when it crashes, like a real crash)
+    cv_pipeline.close()
+
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def check_checkpoint() -> bool:
+    from synthetic_video import make_video
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        video_path = make_video(os.path.join(folder, 'synthetic.avi'), frames=120)
+        straight = os.path.join(folder, 'straight')
+        os.makedirs(straight)
+        _run(video_path, straight, 2)
+        expected = {name: _read(os.path.join(straight, name)) for name in ('output.csv', 'heatmap.bin')}
+
+        # With stride 2 and a checkpoint every 5 processed frames, frame 20 is the first one after a
+        # checkpoint (saved after frame 18), frame 46 is in between two (38 and 48)
+        for crash_at in (20, 46):
+            resumed = os.path.join(folder, f'crash_{crash_at}')
+            os.makedirs(resumed)
+            try:
+                _run(video_path, resumed, 2, crash_at=crash_at)
+                print(f"FAILED (crash at frame {crash_at}): the run didn't crash")
+                ok = False
+                continue
+            except CrashError:
+                pass
+            _run(video_path, resumed, 2, resume=True)
+            different = [name for name, data in expected.items() if _read(os.path.join(resumed, name)) != data]
+            if different:
+                ok = False
+                print(f"FAILED (crash at frame {crash_at}): {different} differ from the run that didn't stop")
+            else:
+                print(f"ok (crash at frame {crash_at}): resumed output is byte-identical")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_checkpoint() else 1)
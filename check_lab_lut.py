@@ -0,0 +1,56 @@
+from __future__ import annotations
+import sys
+import cv2
+import numpy as np
+
+'''
+ LAB LUT CHECK: makes sure LabColorSegmentationMask(fast=True) gives exactly the same mask as the
+ cvtColor + inRange path. Every one of the 2^24 BGR colors is put in one 4096x4096 image and run through
+ both, then the same is done through an earlier mask (the bounding box path). For a quantized table, the
+ fraction of colors it gets wrong has to be what it reports in lut_error.
+
+    python check_lab_lut.py
+'''
+
+
+def all_colors() -> np.ndarray:
+    """ A 4096x4096 BGR image with every 24-bit color in it once """
+    codes = np.arange(1 << 24, dtype=np.uint32)
+    image = np.stack([codes & 255, (codes >> 8) & 255, codes >> 16], axis=-1).astype(np.uint8)
+    return image.reshape(4096, 4096, 3)
+
+
+def check_lab_lut() -> bool:
+    from processing_steps import LabColorSegmentationMask
+    image = all_colors()
+    exact = LabColorSegmentationMask()
+    fast = LabColorSegmentationMask(fast=True)
+    ok = True
+
+    expected = exact.process({'current_frame': image})['mask']
+    got = fast.process({'current_frame': image})['mask']
+    wrong = int(np.count_nonzero(got != expected))
+    print(f"{'ok' if wrong == 0 else 'FAILED'} (8-bit table, all colors): {wrong} colors differ")
+    ok = ok and wrong == 0
+
+    # Through an earlier mask, so only its bounding box is looked up
+    mask = np.zeros(image.shape[:2], np.uint8)
+    cv2.circle(mask, (1500, 2500), 900, 255, -1)
+    expected = exact.process({'current_frame': image, 'mask': mask})['mask']
+    got = fast.process({'current_frame': image, 'mask': mask})['mask']
+    wrong = int(np.count_nonzero(got != expected))
+    print(f"{'ok' if wrong == 0 else 'FAILED'} (8-bit table, with a mask): {wrong} pixels differ")
+    ok = ok and wrong == 0
+
+    quantized = LabColorSegmentationMask(fast=True, lut_bits=5)
+    got = quantized.process({'current_frame': image})['mask']
+    expected = exact.process({'current_frame': image})['mask']
+    error = np.count_nonzero(got != expected) / float(1 << 24)
+    close = abs(error - quantized.lut_error) < 1e-9
+    print(f"{'ok' if close else 'FAILED'} (5-bit table): {error:.4%} of colors differ, "
+          f"lut_error says {quantized.lut_error:.4%}")
+    return ok and close
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_lab_lut() else 1)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+import subprocess
+import sys
+
+'''
+ REGISTRY CHECK: makes sure `from processing_steps import ...` always gives the step classes, whichever way
+ and in whatever order they were imported. Importing a submodule sets it on the package under its file name,
+ so a file named after its class (like the old CircleCrop.py/GraphData.py) would leave the module where the
+ class should be. Each import order runs in a fresh Python, since the problem depends on what was imported
+ first, and every name in the registry is checked against the file names.
+
+    python check_registry.py
+'''
+
+IMPORTS = {
+    'submodules, then *': "from processing_steps.circle_crop import CircleCrop\n"
+                          "from processing_steps.graph_data import GraphData\n"
+                          "from processing_steps import *",
+    '*, then submodules': "from processing_steps import *\n"
+                          "from processing_steps.circle_crop import CircleCrop\n"
+                          "from processing_steps.graph_data import GraphData",
+    'import submodules, then names': "import processing_steps.circle_crop, processing_steps.graph_data\n"
+                                     "from processing_steps import CircleCrop, GraphData",
+    'names, then import submodules': "from processing_steps import CircleCrop, GraphData\n"
+                                     "import processing_steps.circle_crop, processing_steps.graph_data",
+    'config, then submodules': "from processing_steps import build_steps\n"
+                               "CircleCrop, GraphData = map(type, build_steps(['CircleCrop', ['GraphData', "
+                               "{'outfile': 'x.csv', 'fps': 30, 'windowSize': 20}]]))\n"
+                               "from processing_steps.graph_data import GraphData",
+}
+
+CHECK = """
+import processing_steps
+assert isinstance(CircleCrop, type) and isinstance(GraphData, type), (CircleCrop, GraphData)
+assert processing_steps.CircleCrop is CircleCrop and processing_steps.GraphData is GraphData
+"""
+
+
+def check_names() -> bool:
+    """ No name the package hands out may also be the name of one of its files """
+    import processing_steps
+    names = {**processing_steps._STEP_MODULES, **processing_steps._OTHER_MODULES}
+    clashes = sorted(name for name in names if name in set(names.values()))
+    for name in clashes:
+        print(f"FAILED: {name} is defined in a file called {name}.py, importing it would hide the class")
+    return not clashes
+
+
+def check_registry() -> bool:
+    ok = check_names()
+    for name, code in IMPORTS.items():
+        result = subprocess.run([sys.executable, '-c', code + CHECK], capture_output=True, text=True)
+        if result.returncode != 0:
+            ok = False
+            print(f"FAILED ({name}):\n{result.stderr.strip()}")
+        else:
+            print(f"ok ({name})")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_registry() else 1)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+import os
+import sys
+import tempfile
+import numpy as np
+
+'''
+ SEEK INDEX CHECK: makes sure the seek points in a seek index really land on the right frame, and that
+ RandomAccessVideo gives exactly the frame a front to back decode gives, for frames asked for in any order.
+ Runs on a synthetic video (synthetic_video.py) as .avi and as .mp4.
+
+    python check_seek_index.py
+'''
+
+
+def check_video(path: str, interval: int = 10, samples: int = 25) -> bool:
+    import cv2
+    from seek_index import RandomAccessVideo, build_seek_index
+    from synthetic_video import read_all
+    name = os.path.basename(path)
+    frames = read_all(path)
+    index = build_seek_index(path, interval)
+    ok = len(index['timestamps']) == len(frames)
+    if not ok:
+        print(f"FAILED ({name}): index has {len(index['timestamps'])} frames, the video {len(frames)}")
+
+    # Every seek point has to give the frame the linear decode gave
+    cap = cv2.VideoCapture(path)
+    bad_points = []
+    for point in index['seek_points'].tolist():
+        cap.set(cv2.CAP_PROP_POS_FRAMES, point)
+        ret, frame = cap.read()
+        if not ret or not np.array_equal(frame, frames[point]):
+            bad_points.append(point)
+    cap.release()
+    if bad_points:
+        ok = False
+        print(f"FAILED ({name}): seek points {bad_points} land on the wrong frame")
+
+    # Random frames, asked for one at a time in random order (so it seeks back and forth)
+    video = RandomAccessVideo(path, interval)
+    wanted = np.random.default_rng(0).choice(len(frames), size=min(samples, len(frames)), replace=False).tolist()
+    wrong = [n for n in wanted if not np.array_equal(video.get(n), frames[n])]
+    video.release()
+    if wrong:
+        ok = False
+        print(f"FAILED ({name}): frames {wrong} came back different")
+    if ok:
+        print(f"ok ({name}): {len(index['seek_points'])} seek points, {len(wanted)} random frames")
+    return ok
+
+
+def check_seek_index() -> bool:
+    from synthetic_video import make_video
+    with tempfile.TemporaryDirectory() as folder:
+        results = [check_video(make_video(os.path.join(folder, name), frames=90))
+                   for name in ('synthetic.avi', 'synthetic.mp4')]
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_seek_index() else 1)
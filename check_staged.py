@@ -0,0 +1,88 @@
+from __future__ import annotations
+import os
+import sys
+import tempfile
+import numpy as np
+
+'''
+ STAGED PIPELINE CHECK: makes sure running the steps as an assembly line (StagedPipeline) gives exactly the
+ same results as Pipeline.run: the same GraphData file byte for byte, and the same tracks for every frame,
+ in the same order. Runs on a synthetic video (synthetic_video.py) with a few different stage splits.
+
+    python check_staged.py
+'''
+
+SPLITS = (2, 3, [1, 1, 3], [4, 1])
+
+
+def _steps(folder: str, name: str, seen: list) -> list:
+    from processing_steps import GraphData, GrayscaleConverter, LinearContrastAdjuster, OpticalFlowCalculator
+    from processing_steps.pipeline import ProcessingStep
+
+    class Record(ProcessingStep):
+        """ Keeps a copy of every frame's tracks """
+        inputs = ('frame_number',)
+        optional_inputs = ('tracks',)
+        outputs = ()
+        is_sink = True
+
+        def process(self, context: dict) -> dict:
+            tracks = context.get('tracks')
+            seen.append((context['frame_number'], None if tracks is None else [np.array(t) for t in tracks]))
+            return context
+
+    return [GrayscaleConverter(), LinearContrastAdjuster(1.4), OpticalFlowCalculator(0.2),
+            GraphData(os.path.join(folder, f'{name}.csv'), 30, 5), Record()]
+
+
+def _run(video_path: str, folder: str, name: str, stages=None) -> tuple:
+    import cv2
+    from frame_loop import run_frames
+    from processing_steps import Pipeline, StagedPipeline
+    seen = []
+    cv_pipeline = Pipeline(_steps(folder, name, seen))
+    staged = StagedPipeline(cv_pipeline, stages) if stages is not None else None
+    cap = cv2.VideoCapture(video_path)
+    run_frames(cv_pipeline, cap, stride=2, staged=staged)
+    cap.release()
+    if staged is not None:
+        staged.finish()
+    cv_pipeline.close()
+    with open(os.path.join(folder, f'{name}.csv'), 'rb') as f:
+        return f.read(), seen
+
+
+def _same_tracks(a: list, b: list) -> bool:
+    if [frame for frame, _ in a] != [frame for frame, _ in b]:
+        return False
+    for (_, x), (_, y) in zip(a, b):
+        if (x is None) != (y is None):
+            return False
+        if x is not None and not all(np.array_equal(p, q) for p, q in zip(x, y)):
+            return False
+    return True
+
+
+def check_staged() -> bool:
+    from synthetic_video import make_video
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        video_path = make_video(os.path.join(folder, 'synthetic.avi'), frames=120)
+        expected_file, expected_tracks = _run(video_path, folder, 'plain')
+        for k, stages in enumerate(SPLITS):
+            graph_file, tracks = _run(video_path, folder, f'staged_{k}', stages)
+            problems = []
+            if graph_file != expected_file:
+                problems.append("GraphData file differs")
+            if not _same_tracks(expected_tracks, tracks):
+                problems.append("tracks differ")
+            if problems:
+                ok = False
+                print(f"FAILED (stages={stages}): {', '.join(problems)}")
+            else:
+                print(f"ok (stages={stages}): {len(tracks)} frames identical")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_staged() else 1)
@@ -6,7 +6,7 @@ import os
 def crop_center_circle(frame, center=None, r=0):
     """ Applies circular mask to frame """
 
-    hh, ww, ch = frame.shape
+    hh, ww = frame.shape[:2]
 
     # Center points
     if center is None:
@@ -18,18 +18,18 @@ def crop_center_circle(frame, center=None, r=0):
     if r == 0:
         r = yc
 
-    # Create a mask with a filled white circle
-    mask = np.zeros((hh, ww), dtype=np.uint8)
-    cv2.circle(mask, (xc, yc), r, 255, thickness=-1)
+    # Crop to the square area of the circle first (the part of it that is inside the frame), so only
+    # that square has to be masked
+    top, bottom = max(yc - r, 0), min(yc + r, hh)
+    left, right = max(xc - r, 0), min(xc + r, ww)
+    cropped_frame = frame[top:bottom, left:right]
 
-    if ch > 1:
-        mask = cv2.merge([mask] * ch)
+    # Create a mask with a filled white circle, in the coordinates of the cropped square
+    mask = np.zeros(cropped_frame.shape[:2], dtype=np.uint8)
+    cv2.circle(mask, (xc - left, yc - top), r, 255, thickness=-1)
 
     # Apply mask
-    masked_frame = cv2.bitwise_and(frame, mask=mask)
-
-    # Crop to the square area of the circle
-    cropped_frame = masked_frame[yc - r:yc + r, xc - r:xc + r]
+    cropped_frame = cv2.bitwise_and(cropped_frame, cropped_frame, mask=mask)
 
     return cropped_frame
 
@@ -0,0 +1,235 @@
+from __future__ import annotations
+import argparse
+import time
+import cv2
+import numpy as np
+from frame_cache import open_video
+
+'''
+ EQUIVALENCE CHECKS: proves a faster version of the pipeline gives the same results as the original.
+ Both pipelines get the same frames. After every step (if both have the same number of steps, otherwise
+ after the whole pipeline) every context item is compared:
+    masks (any key with 'mask' in it, or bool arrays)  -> must be bit-exact
+    other images                                      -> max pixel difference <= frame_tolerance
+    tracks                                            -> same number of points, max difference <= track_tolerance pixels
+    numbers                                           -> difference <= value_tolerance
+ At the end, the files written by matching GraphData steps are compared row by row (<= graph_tolerance).
+ The report has the first frame/step/key that differed and the speedup (steps only, comparisons not counted).
+
+    reference = [CircleCrop(center=(-50, -30), r=470), LabColorSegmentationMask(), ...,
+                 GraphData("reference.csv", 30, 20)]
+    fast = [CircleCrop(center=(-50, -30), r=470), LabColorSegmentationMask(fast=True), ...,
+            GraphData("fast.csv", 30, 20)]
+    check_equivalence(reference, fast, 'data/11_18-Vid11.mov', max_frames=300)
+'''
+
+
+def _is_mask(key, value) -> bool:
+    return 'mask' in key or (isinstance(value, np.ndarray) and value.dtype == bool)
+
+
+def compare_values(key, reference, fast, frame_tolerance=0, track_tolerance=1e-3, value_tolerance=1e-6):
+    """ None if the two values match (within tolerance), otherwise a description of the difference """
+    if reference is None or fast is None:
+        return None if reference is fast else "only one is None"
+    if key == 'tracks':
+        ref_old, ref_new = (np.asarray(points, np.float32).reshape(-1, 2) for points in reference)
+        fast_old, fast_new = (np.asarray(points, np.float32).reshape(-1, 2) for points in fast)
+        if len(ref_old) != len(fast_old):
+            return f"{len(ref_old)} tracks vs {len(fast_old)}"
+        if len(ref_old) == 0:
+            return None
+        error = max(np.abs(ref_old - fast_old).max(), np.abs(ref_new - fast_new).max())
+        return None if error <= track_tolerance else f"tracks differ by up to {error:.4g} px"
+    if isinstance(reference, np.ndarray) or isinstance(fast, np.ndarray):
+        reference, fast = np.asarray(reference), np.asarray(fast)
+        if reference.shape != fast.shape:
+            return f"shape {reference.shape} vs {fast.shape}"
+        if _is_mask(key, reference):
+            different = np.count_nonzero(reference != fast)
+            return None if different == 0 else f"{different} pixels differ ({different / reference.size:.3%})"
+        if reference.size == 0:
+            return None
+        error = np.abs(reference.astype(np.float64) - fast.astype(np.float64)).max()
+        return None if error <= frame_tolerance else f"differs by up to {error:.4g}"
+    if isinstance(reference, (int, float, np.number)) and isinstance(fast, (int, float, np.number)):
+        error = abs(float(reference) - float(fast))
+        return None if error <= value_tolerance else f"{reference} vs {fast}"
+    try:
+        return None if reference == fast else f"{reference!r} vs {fast!r}"
+    except ValueError:
+        return f"can't compare {type(reference).__name__} values"
+
+
+def compare_contexts(reference: dict, fast: dict, ignore=(), **tolerances) -> dict:
+    """ {key: difference} for every context item that doesn't match (empty if they all do) """
+    differences = {}
+    for key in sorted(set(reference) | set(fast)):
+        if key in ignore:
+            continue
+        if key not in fast or key not in reference:
+            differences[key] = "only in the " + ("reference" if key in reference else "fast") + " pipeline"
+            continue
+        difference = compare_values(key, reference[key], fast[key], **tolerances)
+        if difference is not None:
+            differences[key] = difference
+    return differences
+
+
+def _read_rows(path):
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                rows.append(np.array([float(value) for value in line.split(',')]))
+    return rows
+
+
+def compare_graph_files(reference_path, fast_path, graph_tolerance=1e-6):
+    """ None if the two GraphData files match row by row, otherwise the first row that doesn't """
+    reference, fast = _read_rows(reference_path), _read_rows(fast_path)
+    for row, (ref_row, fast_row) in enumerate(zip(reference, fast)):
+        if ref_row.shape != fast_row.shape or np.abs(ref_row - fast_row).max() > graph_tolerance:
+            return f"row {row}: {ref_row.tolist()} vs {fast_row.tolist()}"
+    if len(reference) != len(fast):
+        return f"{len(reference)} rows vs {len(fast)}"
+    return None
+
+
+def _timed_step(step, context):
+    start = time.perf_counter()
+    context = step.process(context)
+    return context, time.perf_counter() - start
+
+
+def check_equivalence(reference_steps, fast_steps, video_path='data/11_18-Vid11.mov', stride=10, max_frames=None,
+                      stop_at_first=False, ignore=(), frame_tolerance=0, track_tolerance=1e-3,
+                      value_tolerance=1e-6, graph_tolerance=1e-6, verbose=True) -> dict:
+    """
+    Runs both lists of steps on every stride-th frame of the video (up to max_frames processed frames) and
+    compares them (see the top of this file). ignore -> context keys not to compare (e.g. debug outputs that
+    only the fast version writes). stop_at_first -> stop at the first difference instead of running to the end.
+    Returns a report dict: 'equivalent', 'first_difference' (frame, step, differences), 'frames',
+    'frames_different', 'reference_seconds', 'fast_seconds', 'speedup' and, when the steps line up,
+    'step_speedups'.
+    """
+    from processing_steps import GraphData
+    reference_graphs = [step for step in reference_steps if isinstance(step, GraphData)]
+    fast_graphs = [step for step in fast_steps if isinstance(step, GraphData)]
+    for ref_graph, fast_graph in zip(reference_graphs, fast_graphs):
+        if ref_graph.outfile == fast_graph.outfile:
+            raise ValueError("The reference and fast GraphData steps need different outfiles.")
+        # GraphData appends, so start both from empty files
+        for step in (ref_graph, fast_graph):
+            open(step.outfile, 'w').close()
+
+    tolerances = dict(frame_tolerance=frame_tolerance, track_tolerance=track_tolerance,
+                      value_tolerance=value_tolerance)
+    aligned = len(reference_steps) == len(fast_steps)
+    reference_times = np.zeros(len(reference_steps))
+    fast_times = np.zeros(len(fast_steps))
+    first_difference = None
+    frames = 0
+    frames_different = 0
+
+    cap = open_video(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+    frame_num = 0
+    while max_frames is None or frames < max_frames:
+        if not cap.grab():
+            break
+        if frame_num % stride != 0:
+            frame_num += 1
+            continue
+        ret, frame = cap.retrieve()
+        if not ret:
+            frame_num += 1
+            continue
+        reference = {'original_frame': frame.copy(), 'current_frame': frame.copy(), 'frame_number': frame_num}
+        fast = {'original_frame': frame.copy(), 'current_frame': frame, 'frame_number': frame_num}
+        differences = {}
+        if aligned:
+            for i, (ref_step, fast_step) in enumerate(zip(reference_steps, fast_steps)):
+                # Whichever runs second finds the frame already in the CPU cache, so take turns going first
+                if frames % 2 == 0:
+                    reference, ref_seconds = _timed_step(ref_step, reference)
+                    fast, fast_seconds = _timed_step(fast_step, fast)
+                else:
+                    fast, fast_seconds = _timed_step(fast_step, fast)
+                    reference, ref_seconds = _timed_step(ref_step, reference)
+                reference_times[i] += ref_seconds
+                fast_times[i] += fast_seconds
+                if not differences:
+                    # Only the first step that differs is interesting, after that everything downstream will
+                    differences = compare_contexts(reference, fast, ignore, **tolerances)
+                    step_name = f"step {i} ({type(ref_step).__name__} / {type(fast_step).__name__})"
+        else:
+            for i, step in enumerate(reference_steps):
+                reference, seconds = _timed_step(step, reference)
+                reference_times[i] += seconds
+            for i, step in enumerate(fast_steps):
+                fast, seconds = _timed_step(step, fast)
+                fast_times[i] += seconds
+            differences = compare_contexts(reference, fast, ignore, **tolerances)
+            step_name = "end of the pipeline"
+        frames += 1
+        if differences:
+            frames_different += 1
+            if first_difference is None:
+                first_difference = {'frame': frame_num, 'step': step_name, 'differences': differences}
+                if verbose:
+                    print(f"First difference at frame {frame_num}, {step_name}:")
+                    for key, difference in differences.items():
+                        print(f"    {key}: {difference}")
+                if stop_at_first:
+                    break
+        frame_num += 1
+    cap.release()
+
+    for step in list(reference_steps) + list(fast_steps):
+        step.close()
+    graph_differences = {}
+    for ref_graph, fast_graph in zip(reference_graphs, fast_graphs):
+        difference = compare_graph_files(ref_graph.outfile, fast_graph.outfile, graph_tolerance)
+        if difference is not None:
+            graph_differences[f"{ref_graph.outfile} vs {fast_graph.outfile}"] = difference
+
+    report = {
+        'equivalent': first_difference is None and not graph_differences,
+        'first_difference': first_difference,
+        'graph_differences': graph_differences,
+        'frames': frames,
+        'frames_different': frames_different,
+        'reference_seconds': float(reference_times.sum()),
+        'fast_seconds': float(fast_times.sum()),
+        'speedup': float(reference_times.sum() / fast_times.sum()) if fast_times.sum() > 0 else float('inf'),
+    }
+    if aligned:
+        report['step_speedups'] = {f"{i} {type(step).__name__}": float(ref / fast) if fast > 0 else float('inf')
+                                   for i, (step, ref, fast) in enumerate(zip(reference_steps, reference_times, fast_times))}
+    if verbose:
+        for files, difference in graph_differences.items():
+            print(f"GraphData {files}: {difference}")
+        print(f"{'Equivalent' if report['equivalent'] else 'NOT equivalent'} over {frames} frames "
+              f"({frames_different} different), speedup {report['speedup']:.2f}x "
+              f"({report['reference_seconds']:.2f}s -> {report['fast_seconds']:.2f}s)")
+        for name, speedup in report.get('step_speedups', {}).items():
+            print(f"    {name}: {speedup:.2f}x")
+    return report
+
+
+if __name__ == "__main__":
+    from processing_steps import *
+    parser = argparse.ArgumentParser(description="Check that the fast LAB segmentation gives the same results.")
+    parser.add_argument('video', nargs='?', default='data/11_18-Vid11.mov')
+    parser.add_argument('--stride', type=int, default=10)
+    parser.add_argument('--frames', type=int, default=200, help="number of frames to compare")
+    args = parser.parse_args()
+
+    def steps(fast, outfile):
+        # The standard pipeline (pipeline.json), with or without the fast segmentation
+        config = set_kwargs(default_config(), 'LabColorSegmentationMask', fast=fast)
+        return build_steps(set_kwargs(config, 'GraphData', outfile=outfile))
+    check_equivalence(steps(False, 'data/reference.csv'), steps(True, 'data/fast.csv'),
+                      args.video, args.stride, args.frames)
@@ -0,0 +1,203 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import cv2
+import numpy as np
+
+'''
+ FRAME CACHE: decode a video once into one big uint8 array on disk, then read frames straight out of it
+ (memory-mapped, so nothing is copied or decoded) in every later run.
+
+ File layout: a 4096 byte header (MAGIC, then JSON metadata padded with spaces), followed by the frames
+ back to back. The metadata holds the fps, the shape of one frame, how many frames are cached, the stride
+ (cached frame i is frame number i * stride of the video), the frame count of the video, the ROI and
+ whether the frames are grayscale.
+
+ Making a cache:
+    python frame_cache.py data/11_18-Vid11.mov data/11_18-Vid11.fcache --stride 10
+ Using it: pass the .fcache path to main.run_main instead of the video.
+'''
+
+MAGIC = b'FISHCACHE1\n'
+HEADER_SIZE = 4096
+
+
+def build_cache(video_path: str, cache_path: str, stride: int = 1, roi=None, grayscale: bool = False) -> dict:
+    """
+    Decodes the video once and writes every stride-th frame to cache_path.
+    roi -> optional (x, y, w, h) to only keep that part of each frame
+    grayscale -> store single channel gray frames instead of BGR
+    Returns the metadata that was written in the header.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+
+    count = 0
+    frame_num = 0
+    frame_shape = None
+    with open(cache_path, 'wb') as f:
+        # Placeholder, the real header is written once we know how many frames there are
+        f.write(b'\0' * HEADER_SIZE)
+        while cap.grab():
+            if frame_num % stride == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                if roi is not None:
+                    x, y, w, h = roi
+                    frame = frame[y:y + h, x:x + w]
+                if grayscale:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                frame = np.ascontiguousarray(frame)
+                if frame_shape is None:
+                    frame_shape = frame.shape
+                f.write(frame.data)
+                count += 1
+            frame_num += 1
+
+        metadata = {
+            'source': os.path.basename(video_path),
+            'fps': cap.get(cv2.CAP_PROP_FPS),
+            'frame_shape': list(frame_shape or ()),
+            'count': count,
+            'stride': stride,
+            'video_frame_count': frame_num,
+            'roi': list(roi) if roi is not None else None,
+            'grayscale': grayscale,
+        }
+        header = MAGIC + json.dumps(metadata).encode()
+        if len(header) > HEADER_SIZE:
+            raise ValueError("Frame cache metadata doesn't fit in the header.")
+        f.seek(0)
+        f.write(header.ljust(HEADER_SIZE, b' '))
+    cap.release()
+    return metadata
+
+
+def is_cache(path) -> bool:
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class FrameCache:
+    """
+    Reads a cache made by build_cache. Frames come back as read-only views into the memory-mapped file,
+    so getting any frame is O(1) and nothing is copied until something writes to it.
+
+    cache[i] -> the i-th cached frame, cache.frame_number(i) -> its frame number in the video,
+    cache.get_frame(n) -> the frame with video frame number n (None if it wasn't cached)
+
+    It also acts like a cv2.VideoCapture of the original video (grab/retrieve/read/get/set/release),
+    so it can be used in place of one: grab() moves on one video frame, and retrieve() returns that
+    frame if it was cached (frames skipped by the cache stride give (False, None)).
+    """
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if not header.startswith(MAGIC):
+            raise ValueError(f"{path} is not a frame cache")
+        self.metadata = json.loads(header[len(MAGIC):].decode().strip())
+        self.fps = self.metadata['fps']
+        self.stride = self.metadata['stride']
+        self.frame_shape = tuple(self.metadata['frame_shape'])
+        count = self.metadata['count']
+        if count:
+            self.frames = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_SIZE,
+                                    shape=(count,) + self.frame_shape)
+        else:
+            self.frames = np.empty((0,) + self.frame_shape, dtype=np.uint8)
+        # Position in the original video, as with cv2.CAP_PROP_POS_FRAMES (the next frame to grab)
+        self.position = 0
+        self._grabbed = None
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    def frame_number(self, i: int) -> int:
+        return i * self.stride
+
+    def get_frame(self, frame_number: int):
+        i, rest = divmod(frame_number, self.stride)
+        if rest or not 0 <= i < len(self.frames):
+            return None
+        return self.frames[i]
+
+    # --- cv2.VideoCapture look-alike ---
+    def isOpened(self) -> bool:
+        return True
+
+    def grab(self) -> bool:
+        if self.position >= self.metadata['video_frame_count']:
+            self._grabbed = None
+            return False
+        self._grabbed = self.position
+        self.position += 1
+        return True
+
+    def retrieve(self, image=None):
+        """ Like cv2's: with image (an array of the frame's shape), the frame is copied into it and it's returned """
+        frame = None if self._grabbed is None else self.get_frame(self._grabbed)
+        if frame is None:
+            return False, None
+        if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop) -> float:
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.position
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.metadata['video_frame_count']
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.frame_shape[1]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.frame_shape[0]
+        return 0.0
+
+    def set(self, prop, value) -> bool:
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.position = int(value)
+        self._grabbed = None
+        return True
+
+    def release(self):
+        self._grabbed = None
+
+
+def open_video(path):
+    """
+    Opens a video for reading: a FrameCache if path is a frame cache file, otherwise a cv2.VideoCapture
+    (so a camera index like 0 works too).
+    """
+    if is_cache(path):
+        return FrameCache(path)
+    return cv2.VideoCapture(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode a video once into a memory-mapped frame cache.")
+    parser.add_argument('video')
+    parser.add_argument('cache')
+    parser.add_argument('--stride', type=int, default=1, help="only keep every n-th frame")
+    parser.add_argument('--roi', help="only keep this part of the frame, as x,y,w,h")
+    parser.add_argument('--gray', action='store_true', help="store grayscale frames")
+    args = parser.parse_args()
+    roi = tuple(int(v) for v in args.roi.split(',')) if args.roi else None
+    info = build_cache(args.video, args.cache, args.stride, roi, args.gray)
+    print(f"Cached {info['count']} frames of {info['video_frame_count']} to {args.cache}")
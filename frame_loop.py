@@ -0,0 +1,79 @@
+from __future__ import annotations
+import time
+
+'''
+ FRAME LOOP: the loop that feeds a video's frames into a Pipeline, shared by main.run_main and batch.py so
+ both skip, decode and run frames the same way. It only needs an opened capture (cv2.VideoCapture, or a
+ frame cache from frame_cache.open_video) and the Pipeline, so it doesn't import any steps, OpenCV or the
+ realtime/metrics modules itself. Everything else is optional:
+    sampler -> an AdaptiveFrameSampler picks the frames instead of the stride
+    metrics -> a PipelineMetrics, told about every processed/skipped/dropped frame
+    staged -> a StagedPipeline (made from the same Pipeline) to put the frames through instead
+
+    cap = open_video('data/11_18-Vid11.mov')
+    run_frames(Pipeline(steps), cap, stride=10)
+    cap.release()
+'''
+
+
+def run_frames(cv_pipeline, cap, stride: int = 10, sampler=None, first_frame: int = 0, metrics=None,
+               staged=None) -> int:
+    """
+    Runs the pipeline on every stride-th frame of cap (or the frames the sampler picks) until the video ends.
+    first_frame -> the frame number cap is at (e.g. after seeking to a checkpoint), the stride counts from 0
+    regardless. With staged, the frames still in its stages are left there (call staged.finish() after).
+    Returns the number of frames read from cap.
+    """
+    # only keep an untouched copy of the frame around if a step (e.g. Visualize) draws on it
+    keep_original = cv_pipeline.needs('original_frame')
+    frame_num = first_frame
+    while True:
+        # grab() just advances the video, retrieve() does the work of turning it into an image,
+        # so frames we skip are cheaper
+        if not cap.grab():
+            break
+        # skips frames and reads only 0, 10, 20, etc (or whatever the sampler allows)
+        if sampler is None:
+            skip = (frame_num % stride) != 0
+        else:
+            skip = sampler.too_soon(frame_num)
+        if skip:
+            if metrics is not None:
+                metrics.frame_skipped()
+            frame_num += 1
+            continue
+        ret, frame = cap.retrieve()
+        if not ret:
+            # (e.g. a frame that a strided frame cache doesn't have)
+            if metrics is not None:
+                metrics.frame_dropped()
+            frame_num += 1
+            continue
+        if sampler is not None and not sampler.should_process(frame, frame_num):
+            if metrics is not None:
+                metrics.frame_skipped()
+            frame_num += 1
+            continue
+        # Prepare the context for this frame
+        process_context = {
+            'current_frame': frame,
+            'frame_number': frame_num
+        }
+        if keep_original:
+            process_context['original_frame'] = frame.copy()
+        # Run the pipeline
+        if staged is not None:
+            # The frame comes out a few frames later, meanwhile the next ones can start
+            staged.put(process_context)
+            finished = staged.done()
+        else:
+            start = time.perf_counter()
+            finished = [cv_pipeline.run(process_context)]
+            if metrics is not None:
+                metrics.frame_processed(time.perf_counter() - start)
+        # Once we know where the tank is, only look for motion inside it
+        for context in finished:
+            if sampler is not None and sampler.small_mask is None and context.get('mask') is not None:
+                sampler.set_mask(context['mask'])
+        frame_num += 1
+    return frame_num - first_frame
@@ -0,0 +1,260 @@
+from __future__ import annotations
+import argparse
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from frame_cache import open_video
+
+'''
+ FRAME RING: passes frames between processes without pickling them. One block of shared memory holds a
+ fixed number of slots, each the size of one frame. The decoder process decodes straight into a free slot
+ and only sends (slot, frame number) to the workers, which read the frame through a NumPy view of the same
+ memory (no copy). A slot is only reused once every worker that was sent it has released it, so a frame is
+ never overwritten while it's still being read. If every slot is in use, the decoder waits.
+
+    ring = FrameRing.for_video('data/11_18-Vid11.mov', slots=8)
+    decoder = mp.Process(target=decode_into_ring, args=('data/11_18-Vid11.mov', ring, 10, None, 2))
+    workers = [mp.Process(target=my_worker, args=(ring,)) for _ in range(2)]
+    ...
+    def my_worker(ring):
+        while (item := ring.get()) is not None:
+            slot, frame_num, frame = item
+            ...  # frame is read only and only valid until ring.release(slot), copy it to keep it
+            ring.release(slot)
+
+ The ring has to be given to the processes when they're started (like a multiprocessing.Queue), and
+ ring.close() then ring.unlink() in the process that made it once everyone is done.
+ Running this file compares it with sending the frames through a multiprocessing.Queue.
+'''
+
+
+class FrameRing:
+    """
+    frame_shape -> shape of one frame, e.g. (1080, 1920, 3)
+    slots -> number of frames that can be in flight at once (decoded but not released yet)
+    dtype -> type of the frame pixels
+    """
+    def __init__(self, frame_shape, slots: int = 8, dtype=np.uint8):
+        if slots < 1:
+            raise ValueError("A frame ring needs at least one slot.")
+        self.frame_shape = tuple(int(n) for n in frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, slots * frame_bytes))
+        self.owner = True
+        # How many readers still hold each slot, the slot goes back to the free queue when it hits 0
+        self.holders = mp.Array('i', slots)
+        self.free = mp.Queue()
+        self.frames = mp.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self._attach()
+
+    @classmethod
+    def for_video(cls, video_path, slots: int = 8):
+        """ A ring with slots the size of the video's frames """
+        cap = open_video(video_path)
+        ret, frame = cap.read()
+        cap.release()
+        if not ret:
+            raise IOError(f"Could not read a frame from {video_path}")
+        return cls(frame.shape, slots, frame.dtype)
+
+    def _attach(self):
+        self.buffer = np.ndarray((self.slots,) + self.frame_shape, self.dtype, self.shm.buf)
+        # Readers get read only views, so a worker can't scribble on a frame another worker is reading
+        self.readonly = self.buffer.view()
+        self.readonly.flags.writeable = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('shm', 'buffer', 'readonly'):
+            del state[key]
+        state['name'] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('name')
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.owner = False
+        self._attach()
+
+    # Decoder side
+
+    def acquire(self, timeout=None) -> int:
+        """ Waits for a free slot and returns its index (raises queue.Empty after timeout seconds) """
+        return self.free.get(timeout=timeout)
+
+    def slot(self, slot: int) -> np.ndarray:
+        """ Writable view of a slot, to decode into """
+        return self.buffer[slot]
+
+    def publish(self, slot: int, frame_number: int, readers: int = 1):
+        """ Hands a filled slot to the workers. It's reused after readers calls to release(slot). """
+        with self.holders.get_lock():
+            self.holders[slot] = readers
+        self.frames.put((slot, frame_number))
+
+    def finish(self, workers: int = 1):
+        """ Tells the workers there are no more frames (one None each) """
+        for _ in range(workers):
+            self.frames.put(None)
+
+    # Worker side
+
+    def get(self, timeout=None):
+        """
+        Waits for the next frame and returns (slot, frame number, read only view of the frame), or None
+        once the decoder is done. The view is only valid until release(slot).
+        """
+        item = self.frames.get(timeout=timeout)
+        if item is None:
+            return None
+        slot, frame_number = item
+        return slot, frame_number, self.readonly[slot]
+
+    def release(self, slot: int):
+        with self.holders.get_lock():
+            if self.holders[slot] <= 0:
+                raise ValueError(f"Slot {slot} was released more times than it was published for.")
+            self.holders[slot] -= 1
+            done = self.holders[slot] == 0
+        if done:
+            self.free.put(slot)
+
+    def close(self):
+        # The views have to go before the shared memory can be closed
+        self.buffer = self.readonly = None
+        self.shm.close()
+
+    def unlink(self):
+        """ Frees the shared memory, call once (in the process that made the ring) after everyone closed it """
+        if self.owner:
+            self.shm.unlink()
+
+
+def decode_into_ring(video_path, ring: FrameRing, stride: int = 1, max_frames=None, workers: int = 1):
+    """
+    Decoder process: decodes every stride-th frame straight into a free slot of the ring and sends it to the
+    workers (each frame goes to one of them). Sends the workers a None each at the end (also when a frame
+    doesn't fit the slots, which raises a ValueError).
+    """
+    cap = open_video(video_path)
+    frame_num = 0
+    sent = 0
+    try:
+        while max_frames is None or sent < max_frames:
+            if not cap.grab():
+                break
+            if frame_num % stride == 0:
+                slot = ring.acquire()
+                view = ring.slot(slot)
+                ret, frame = cap.retrieve(view)
+                if not ret:
+                    # (e.g. a frame that a strided frame cache doesn't have)
+                    ring.free.put(slot)
+                    frame_num += 1
+                    continue
+                if frame.shape != view.shape or frame.dtype != view.dtype:
+                    # The slots are all the size of the first frame, a video that changes size can't go in them
+                    ring.free.put(slot)
+                    raise ValueError(f"Frame {frame_num} of {video_path} is {frame.shape} {frame.dtype}, but the "
+                                     f"ring's slots are {view.shape} {view.dtype}.")
+                if frame.ctypes.data != view.ctypes.data:
+                    # The decoder made its own array instead of decoding into the slot, so copy it in
+                    np.copyto(view, frame)
+                ring.publish(slot, frame_num)
+                sent += 1
+            frame_num += 1
+    finally:
+        cap.release()
+        ring.finish(workers)
+        ring.close()
+
+
+def _ring_worker(ring: FrameRing, results):
+    count = 0
+    total = 0.0
+    while (item := ring.get()) is not None:
+        slot, frame_num, frame = item
+        total += float(cv2.mean(frame)[0])
+        ring.release(slot)
+        count += 1
+    ring.close()
+    results.put((count, total))
+
+
+def _decode_into_queue(video_path, frames, stride, max_frames, workers):
+    cap = open_video(video_path)
+    frame_num = 0
+    sent = 0
+    while max_frames is None or sent < max_frames:
+        if not cap.grab():
+            break
+        if frame_num % stride == 0:
+            ret, frame = cap.retrieve()
+            if not ret:
+                frame_num += 1
+                continue
+            frames.put((frame_num, frame))
+            sent += 1
+        frame_num += 1
+    cap.release()
+    for _ in range(workers):
+        frames.put(None)
+
+
+def _queue_worker(frames, results):
+    count = 0
+    total = 0.0
+    while (item := frames.get()) is not None:
+        frame_num, frame = item
+        total += float(cv2.mean(frame)[0])
+        count += 1
+    results.put((count, total))
+
+
+def compare_transports(video_path, stride: int = 1, max_frames=None, workers: int = 2, slots: int = 8) -> dict:
+    """ Frames/second through the ring and through a plain multiprocessing.Queue (which pickles every frame) """
+    rates = {}
+    for name in ('queue', 'ring'):
+        results = mp.Queue()
+        start = time.perf_counter()
+        if name == 'ring':
+            ring = FrameRing.for_video(video_path, slots)
+            decoder = mp.Process(target=decode_into_ring, args=(video_path, ring, stride, max_frames, workers))
+            readers = [mp.Process(target=_ring_worker, args=(ring, results)) for _ in range(workers)]
+        else:
+            # Bounded like the ring, so neither side can get ahead by buffering the whole video
+            frames = mp.Queue(maxsize=slots)
+            decoder = mp.Process(target=_decode_into_queue, args=(video_path, frames, stride, max_frames, workers))
+            readers = [mp.Process(target=_queue_worker, args=(frames, results)) for _ in range(workers)]
+        for process in [decoder] + readers:
+            process.start()
+        counts = [results.get() for _ in readers]
+        for process in [decoder] + readers:
+            process.join()
+        seconds = time.perf_counter() - start
+        if name == 'ring':
+            ring.close()
+            ring.unlink()
+        count = sum(c for c, _ in counts)
+        rates[name] = count / seconds if seconds > 0 else 0.0
+        print(f"{name:>5}: {count} frames in {seconds:.2f}s ({rates[name]:.1f} frames/s)")
+    return rates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare passing frames between processes through shared memory "
+                                                 "with pickling them through a queue.")
+    parser.add_argument('video', nargs='?', default='data/11_18-Vid11.mov')
+    parser.add_argument('--stride', type=int, default=1)
+    parser.add_argument('--frames', type=int, default=500, help="number of frames to send")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--slots', type=int, default=8)
+    args = parser.parse_args()
+    compare_transports(args.video, args.stride, args.frames, args.workers, args.slots)
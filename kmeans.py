@@ -32,10 +32,11 @@ def kmeans_partition(image, k):
     segmented_image = segmented_data.reshape(image.shape)
     return segmented_image
 
-# load image from images directory
-img = cv2.imread('cropped_frames/cropped_frame_1.jpg')
-simg = kmeans_partition(img, 5)
-cv2.namedWindow("Image")
-cv2.imwrite("kmeans.jpg", simg)
-cv2.imshow('Image',simg)
-cv2.waitKey(0)
+if __name__ == "__main__":
+    # load image from images directory
+    img = cv2.imread('cropped_frames/cropped_frame_1.jpg')
+    simg = kmeans_partition(img, 5)
+    cv2.namedWindow("Image")
+    cv2.imwrite("kmeans.jpg", simg)
+    cv2.imshow('Image',simg)
+    cv2.waitKey(0)
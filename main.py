@@ -3,50 +3,92 @@ from __future__ import annotations
 from processing_steps import *
 import cv2
 from processing_steps import grayscale
+import realtime
+from metrics import PipelineMetrics
+from frame_cache import open_video
+from frame_loop import run_frames
+from seek_index import RandomAccessVideo
 
-def run_main(pipeline_steps):
-    # load in the pipeline/analysis steps
-    cv_pipeline = Pipeline(pipeline_steps)
-    # load in the video you want to analyze
-    cap = cv2.VideoCapture('data/11_18-Vid11.mov')  # Or 0 for webcam
+def run_main(pipeline_steps, video_path='data/11_18-Vid11.mov', stride=10, sampler=None,
+             checkpoint_path=None, checkpoint_every=100, resume=False, metrics_port=None, stages=None):
+    """
+    Runs the pipeline on every stride-th frame of the video, or, if an AdaptiveFrameSampler is given,
+    on the frames the sampler picks (more often when the fish are moving).
+    With a checkpoint_path, the pipeline state is saved every checkpoint_every processed frames, and
+    resume=True carries on from the last checkpoint (if there is one) instead of from frame 0.
+    With a metrics_port, live stats (frames done, time per step, ...) are served at
+    http://localhost:<metrics_port>/metrics while it runs (see metrics.py).
+    With stages (a number of stages, or the number of steps in each, e.g. [6, 2]) the steps run as an assembly
+    line, each stage in its own thread working on a different frame (see processing_steps/staged.py). It prints
+    how busy each stage was at the end. Can't be used with checkpoints.
+    Returns the number of frames that were run through the pipeline.
+    """
+    # load in the pipeline/analysis steps (the sampler wants the tank mask back out of the pipeline)
+    cv_pipeline = Pipeline(pipeline_steps, keep=('mask',) if sampler is not None else (),
+                           checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every)
+    if sampler is not None:
+        cv_pipeline.also_checkpoint.append(sampler)
+    metrics = None
+    if metrics_port is not None:
+        metrics = PipelineMetrics()
+        metrics.attach(cv_pipeline)
+        metrics.serve(metrics_port)
+    staged = None
+    if stages is not None:
+        staged = StagedPipeline(cv_pipeline, stages)
+        if metrics is not None:
+            staged.frame_timer = metrics.frame_processed
+            # Frames that were decoded but the first stage hasn't started on yet
+            metrics.decode_queue = staged.queues[0].qsize
+    # load in the video you want to analyze (or a frame cache made with frame_cache.py)
+    cap = open_video(video_path)  # Or 0 for webcam
     if not cap.isOpened():
         print("Error: Could not open video.")
         return
     print(cap.get(cv2.CAP_PROP_FPS))
     frame_num = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        # skips frames and reads only 0, 10, 20, etc 
-        if (frame_num % 10) != 0:
-            frame_num += 1
-            continue
-        # Prepare the context for this frame
-        process_context = {
-            'original_frame': frame.copy(),
-            'current_frame': frame.copy(),
-            'frame_number': frame_num
-        }
-        # Run the pipeline
-        context = cv_pipeline.run(process_context)
-        frame_num += 1
+    if resume:
+        last_frame = cv_pipeline.load_checkpoint()
+        if last_frame is not None:
+            frame_num = last_frame + 1
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+            print(f"Resuming from frame {frame_num}")
+    run_frames(cv_pipeline, cap, stride, sampler, frame_num, metrics, staged)
     cap.release()
+    if staged is not None:
+        staged.finish()
+        staged.print_report()
+    cv_pipeline.close()
     cv2.destroyAllWindows()
+    if metrics is not None:
+        metrics.stop()
+    if sampler is not None:
+        print(f"Processed {sampler.processed} frames, skipped {sampler.skipped}")
+    return cv_pipeline.frames_run
 
 
-def test_one_image(pipeline_steps):
-    frames = [cv2.imread('data/frames/frame_ 000.jpg'), cv2.imread('data/frames/frame_ 005.jpg')]
+def test_one_image(pipeline_steps, frame_numbers=None, video_path='data/11_18-Vid11.mov'):
+    """
+    Runs the pipeline on a couple of single frames: the saved frames in data/frames, or, if frame_numbers
+    are given, those frames pulled straight out of the video (see seek_index.py, no decoding from the start).
+    """
+    if frame_numbers is None:
+        frames = [(0, cv2.imread('data/frames/frame_ 000.jpg')), (0, cv2.imread('data/frames/frame_ 005.jpg'))]
+    else:
+        video = RandomAccessVideo(video_path)
+        frames = list(video.read_frames(frame_numbers))
+        video.release()
     cv_pipeline = Pipeline(pipeline_steps)
-    for frame in frames:
+    for frame_num, frame in frames:
         # 1. Prepare the context for this frame
         process_context = {
             'original_frame': frame.copy(),
             'current_frame': frame.copy(),
-            'frame_number': 0
+            'frame_number': frame_num
         }
         # 2. Run the pipeline
         context = cv_pipeline.run(process_context)
+    cv_pipeline.close()
 
 '''
  RUNNING THE ANALYSIS ALGORITHMS: 
@@ -54,20 +96,45 @@ def test_one_image(pipeline_steps):
 if __name__ == "__main__":
     pipeline_steps = [
         # MedianFilter(),
+        # TiledStep(MedianFilter(), bands=4),  # same result, split into bands that run on several cores
         CircleCrop(center=(-50, -30), r=470),
+        # CircleCrop(calibration="calibration/tank1.json", recheck_every=500),  # tank found by calibrate_tank.py
         LabColorSegmentationMask(),
         ApplyMaskDenoised((7,7)),
         # ShowCurrentImage(),
         GrayscaleConverter(),
         LinearContrastAdjuster(1.4),
+        # SmoothedHistogramEqualizer(),  # equalizes using only the tank, without flickering between frames
         # MidToneThresholdMask(20, 190),
         # ApplyMaskDenoised((7, 7)),
         CropLine(-0.5, 1250, reverse=True),
         # MidToneThresholdDenoised(10, 200, 7),
         # BrightnessAdjuster(30),
+        # BackgroundMotionMask(),  # only track features where something is moving
         OpticalFlowCalculator(0.2),
+        # OpticalFlowCalculator(0.2, detector="fast", grid=(8, 8)),  # quicker detector, points spread over the tank
         # Visualize(1),
-        GraphData("output.csv", 30, 20)
+        # Visualize(1, outfile="data/output/flow.mp4"),  # headless, saves the drawn vectors to a video
+        GraphData("output.csv", 30, 20),
+        # Much cheaper activity curve (no optical flow needed, same CSV format), see activity_calibration.py:
+        # ActivityIndex("activity.csv", 30, 20),
+        # ActivityHeatmap("heatmap.bin", grid=(16, 16)),  # where in the tank the movement is
+        # With the adaptive sampler below, use a time based window instead:
+        # GraphData("output.csv", 30, 20, window_seconds=6.67, per_frame=True)
     ]
     run_main(pipeline_steps)
+    # The same pipeline, from a config file (only imports the steps it uses):
+    # run_main(build_steps(load_config("pipeline.json")))
+    # A config with the stride/resolution/feature budget picked by autotune.py (use the "stride" in it):
+    # run_main(build_steps(load_config("pipeline_tuned.json")), stride=5)
+    # Long runs: save progress every 100 processed frames, and pick up from there after a crash
+    # run_main(pipeline_steps, checkpoint_path="output.ckpt", resume=True)
+    # Watch a long run live at http://localhost:9100/metrics (Prometheus format):
+    # run_main(pipeline_steps, metrics_port=9100)
+    # Assembly line: the first 6 steps work on the next frame while the optical flow + graph do this one
+    # run_main(pipeline_steps, stages=[6, 2])
+    # run_main(pipeline_steps, sampler=AdaptiveFrameSampler(min_stride=2, max_stride=30, motion_threshold=2.0))
+    # Live webcam (or a file played back at its own speed), always on the newest frame:
+    # realtime.run_realtime(pipeline_steps, source=0, budget_ms=100)
     # test_one_image(pipeline_steps)
+    # test_one_image(pipeline_steps, frame_numbers=[3000, 3005])
@@ -0,0 +1,187 @@
+from __future__ import annotations
+import bisect
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+ LIVE METRICS: while run_main is going, http://localhost:<port>/metrics shows how it's doing in the
+ Prometheus text format (so Prometheus/Grafana can scrape it, or just open it in a browser):
+    fishovision_frames_processed_total       frames that went through the pipeline
+    fishovision_frames_skipped_total         frames skipped by the stride or the sampler
+    fishovision_frames_dropped_total         frames that couldn't be decoded (or that a live reader dropped)
+    fishovision_step_seconds                 histogram of how long each step takes, per step
+    fishovision_frame_seconds                histogram of how long the whole pipeline takes per frame
+    fishovision_tracked_features             points OpticalFlowCalculator is currently tracking
+    fishovision_decode_queue_depth           decoded frames waiting to be processed (only with stages=)
+    process_resident_memory_bytes            memory used by the process (RSS)
+
+    run_main(pipeline_steps, metrics_port=9100)
+
+ Only the frame loop writes to the metrics (plain ints and lists, no locks), and the server thread only
+ reads them, so a scrape never makes the frame loop wait. A scrape can see a histogram half way through
+ an update (e.g. the count already bumped but not the sum), which is off by one frame at most.
+'''
+
+# Bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """ Latency histogram with fixed buckets, in the shape Prometheus wants """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # counts[i] is the number of observations in bucket i only (the last one is +Inf), made cumulative
+        # when rendered, so observe() touches one slot
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name: str, labels: str = '') -> list:
+        counts = list(self.counts)  # copy first, so the cumulative sums are consistent
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            total += count
+            le = bound if bound == '+Inf' else repr(float(bound))
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {total}')
+        braces = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{braces} {self.sum}')
+        lines.append(f'{name}_count{braces} {total}')
+        return lines
+
+
+def resident_memory_bytes():
+    """ Current RSS of this process, or the peak RSS where the current one can't be read (None on Windows) """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PipelineMetrics:
+    """
+    Collects the metrics of one run. Hook it up with attach(pipeline), then the runner calls
+    frame_processed / frame_skipped / frame_dropped from its loop.
+    decode_queue -> function returning how many decoded frames are waiting, e.g. the first queue of a
+        StagedPipeline. Without one (decoding isn't queued) the decode queue gauge isn't reported at all.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS, decode_queue=None):
+        self.buckets = buckets
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.frames_dropped = 0
+        self.frame_seconds = Histogram(buckets)
+        self.step_seconds = []
+        self.step_names = []
+        self.flow_steps = []
+        self.decode_queue = decode_queue
+        self.started = time.time()
+        self.server = None
+
+    def attach(self, pipeline):
+        """ Times every step of the pipeline, and finds the OpticalFlowCalculators to read the feature count from """
+        from processing_steps.optical_flow import OpticalFlowCalculator
+        self.step_names = [type(step).__name__ for step in pipeline.steps]
+        self.step_seconds = [Histogram(self.buckets) for _ in pipeline.steps]
+        self.flow_steps = [step for step in pipeline.steps if isinstance(getattr(step, 'step', step), OpticalFlowCalculator)]
+        pipeline.step_timer = self._step_done
+
+    def _step_done(self, index: int, seconds: float):
+        self.step_seconds[index].observe(seconds)
+
+    def frame_processed(self, seconds: float):
+        self.frames_processed += 1
+        self.frame_seconds.observe(seconds)
+
+    def frame_skipped(self):
+        self.frames_skipped += 1
+
+    def frame_dropped(self, count: int = 1):
+        self.frames_dropped += count
+
+    def tracked_features(self) -> int:
+        total = 0
+        for step in self.flow_steps:
+            features = getattr(step, 'step', step).prev_features
+            total += 0 if features is None else len(features)
+        return total
+
+    def render(self) -> str:
+        """ All the metrics in the Prometheus text format """
+        lines = []
+
+        def metric(name, kind, help_text, value=None):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if value is not None:
+                lines.append(f'{name} {value}')
+
+        metric('fishovision_frames_processed_total', 'counter', 'Frames run through the pipeline.',
+               self.frames_processed)
+        metric('fishovision_frames_skipped_total', 'counter', 'Frames skipped by the stride or sampler.',
+               self.frames_skipped)
+        metric('fishovision_frames_dropped_total', 'counter', 'Frames that were lost (failed decode or dropped).',
+               self.frames_dropped)
+        metric('fishovision_frame_seconds', 'histogram', 'Time to run the whole pipeline on one frame.')
+        lines += self.frame_seconds.render('fishovision_frame_seconds')
+        metric('fishovision_step_seconds', 'histogram', 'Time each pipeline step takes per frame.')
+        for i, (name, histogram) in enumerate(zip(self.step_names, self.step_seconds)):
+            lines += histogram.render('fishovision_step_seconds', f'index="{i}",step="{name}"')
+        metric('fishovision_tracked_features', 'gauge', 'Points OpticalFlowCalculator is currently tracking.',
+               self.tracked_features())
+        if self.decode_queue is not None:
+            metric('fishovision_decode_queue_depth', 'gauge', 'Decoded frames waiting to be processed.',
+                   self.decode_queue())
+        rss = resident_memory_bytes()
+        if rss is not None:
+            metric('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.', rss)
+        metric('process_start_time_seconds', 'gauge', 'Start time of the run since the epoch.', self.started)
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9100, host: str = '127.0.0.1'):
+        """ Starts the HTTP server in a background thread (it stops when the program does, or on stop()) """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # Don't print a line for every scrape
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Metrics at http://{host}:{self.server.server_address[1]}/metrics")
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -1,3 +1,4 @@
+import threading
 import cv2
 import numpy as np
 from .pipeline import ProcessingStep
@@ -12,33 +13,168 @@ class LabColorSegmentationMask(ProcessingStep):
     Parameters:
     - lower_bound (np.ndarray): The lower L*a*b* threshold.
     - upper_bound (np.ndarray): The upper L*a*b* threshold.
+    - fast (bool): If True, the BGR -> L*a*b* -> inRange test is precomputed once into a
+                   lookup table indexed by the BGR value, so no color conversion runs per frame
+                   (about 2x quicker than the exact path on 1080p tank footage. Neighbouring pixels
+                   have similar colors, so the lookups mostly hit the cache, on random noise it's slower).
+                   Only pixels inside the bounding box of context['mask'] (if there is one) are looked up.
+    - lut_bits (int): Bits per channel kept by the lookup table. 8 is the exact, full 24-bit
+                      table (16 MB, one byte per color so a lookup is a single gather). Fewer bits
+                      give a smaller table (2^(16 + lut_bits) bytes) that is close but not exact
+                      (the fraction of colors it gets wrong is printed and saved as self.lut_error),
+                      and a bit slower than 8 since the pixels have to be quantized first.
+    - check (bool): If True (and fast is True), also runs the exact cvtColor path and compares the
+                    two masks. The total number of pixels where they disagree and the first few
+                    of them (saved as self.mismatch_samples) are printed once, when the step is closed.
+    - check_samples (int): How many disagreeing pixels to keep as (frame_number, x, y) in check mode.
 
     Inputs (from context):
-    - 'image' (np.ndarray): The BGR image to segment.
+    - 'current_frame' (np.ndarray): The BGR image to segment.
+    - 'mask' (np.ndarray, optional): Earlier mask to combine with.
 
     Outputs (to context):
     - 'mask' (np.ndarray): A new binary mask where white pixels correspond
                            to the segmented region.
+    - 'lab_lut_mismatches' (int): Only in check mode, the number of disagreeing pixels in this frame.
     """
-    def __init__(self, lower_bound=np.array([0, 120, 120]), upper_bound=np.array([220, 138, 138])):
+    inputs = ('current_frame',)
+    optional_inputs = ('mask', 'frame_number')
+    outputs = ('mask', 'lab_lut_mismatches')
+    tile_halo = 0
+
+    def __init__(self, lower_bound=np.array([0, 120, 120]), upper_bound=np.array([220, 138, 138]),
+                 fast: bool = False, lut_bits: int = 8, check: bool = False,
+                 check_samples: int = 10):
+        if not 1 <= lut_bits <= 8:
+            raise ValueError("lut_bits must be between 1 and 8.")
         self.lower_bound = lower_bound
         self.upper_bound = upper_bound
+        self.fast = fast
+        self.lut_bits = lut_bits
+        self.check = check
+        self.check_samples = check_samples
+        self.checked_pixels = 0
+        self.mismatch_total = 0
+        self.mismatch_samples = []
+        # (TiledStep runs the bands of a frame at the same time, all through this one step)
+        self._check_lock = threading.Lock()
+        self.lut = None
+        self.quantize = None
+        self.lut_error = 0.0
+        if fast:
+            self._build_lut()
 
-    def process(self, context: dict) -> dict:
-        image = context.get('current_frame')
-        if image is None:
-            raise KeyError("'current_image' not found in context. Cannot perform segmentation.")
+    def _build_lut(self):
+        """
+        Runs every one of the 2^24 BGR colors through the exact path once, 256x256 colors at a time
+        (one red value per chunk) so the temporary images stay small.
+
+        The table is indexed by r << 16 | g << 8 | b, which is what a BGRA pixel read as a little endian
+        uint32 gives once the alpha byte is masked off (see _lookup). Entries are 0/255, the mask values.
+        """
+        green, blue = np.mgrid[0:256, 0:256].astype(np.uint8)
+        chunk = np.empty((256, 256, 3), dtype=np.uint8)
+        chunk[:, :, 0] = blue
+        chunk[:, :, 1] = green
+        exact = np.empty((256, 256, 256), dtype=bool)  # indexed [r, g, b]
+        for red in range(256):
+            chunk[:, :, 2] = red
+            lab_chunk = cv2.cvtColor(chunk, cv2.COLOR_BGR2LAB)
+            exact[red] = cv2.inRange(lab_chunk, self.lower_bound, self.upper_bound) > 0
+
+        self.quantize = None
+        if self.lut_bits == 8:
+            self.lut = exact.ravel().view(np.uint8) * np.uint8(255)
+            self.lut_error = 0.0
+            return
+
+        # Quantized table: each cell covers a (2^s)^3 block of colors and takes the majority answer
+        n = 1 << self.lut_bits
+        s = 8 - self.lut_bits
+        blocks = exact.reshape(n, 1 << s, n, 1 << s, n, 1 << s)
+        inside = blocks.sum(axis=(1, 3, 5), dtype=np.uint32)
+        cell_size = 1 << (3 * s)
+        # Quantized pixels still go through the uint32 view, so the table is laid out with 256 steps per
+        # channel, only the first n of green and blue are used
+        self.quantize = (np.arange(256) >> s).astype(np.uint8)
+        lut = np.zeros((n, 256, 256), dtype=np.uint8)
+        lut[:, :n, :n] = (inside * 2 >= cell_size).view(np.uint8) * np.uint8(255)
+        self.lut = lut.ravel()
+        wrong = np.minimum(inside, cell_size - inside).sum(dtype=np.uint64)
+        self.lut_error = float(wrong) / float(1 << 24)
+        print(f"LabColorSegmentationMask: {self.lut_bits}-bit LUT disagrees with the exact "
+              f"path on {self.lut_error:.4%} of all 24-bit colors")
+
+    def _lookup(self, image: np.ndarray) -> np.ndarray:
+        """ Looks up every pixel of a BGR image, returning a 2D mask of 0/255 values. """
+        if self.quantize is not None:
+            image = cv2.LUT(image, self.quantize)
+        # Adding an alpha byte makes each pixel 4 bytes, read as one uint32 that is a << 24 | r << 16 | g << 8 | b
+        codes = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA).view('<u4')[:, :, 0]
+        np.bitwise_and(codes, 0xFFFFFF, out=codes)
+        return np.take(self.lut, codes)
 
+    def _exact_mask(self, image: np.ndarray) -> np.ndarray:
         # Convert the image from BGR to the L*a*b* color space
         lab_image = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
 
         # Create a mask by thresholding the L*a*b* image
         # Pixels within the bounds become white (255), others become black (0)
-        mask = cv2.inRange(lab_image, self.lower_bound, self.upper_bound)
+        return cv2.inRange(lab_image, self.lower_bound, self.upper_bound)
 
-        # Add the new mask to the context (combining it with earlier masks if they exist
-        if context.get('mask') is not None:
-            mask = cv2.bitwise_and(context['mask'], mask)
-        context['mask'] = mask
+    def _fast_mask(self, image: np.ndarray, previous_mask) -> np.ndarray:
+        if previous_mask is None:
+            return self._lookup(image)
+        # Only look up pixels inside the bounding box of the earlier mask, everything else stays black.
+        # (Going through the box is cheaper than gathering/scattering the exact masked pixel indices)
+        x, y, w, h = cv2.boundingRect(previous_mask)
+        mask = np.zeros(image.shape[:2], dtype=np.uint8)
+        if w == 0 or h == 0:
+            return mask
+        inside = self._lookup(image[y:y + h, x:x + w])
+        mask[y:y + h, x:x + w] = cv2.bitwise_and(previous_mask[y:y + h, x:x + w], inside)
+        return mask
+
+    def process(self, context: dict) -> dict:
+        image = context.get('current_frame')
+        if image is None:
+            raise KeyError("'current_frame' not found in context. Cannot perform segmentation.")
+        previous_mask = context.get('mask')
+
+        if not self.fast:
+            mask = self._exact_mask(image)
+            # Add the new mask to the context (combining it with earlier masks if they exist
+            if previous_mask is not None:
+                mask = cv2.bitwise_and(previous_mask, mask)
+            context['mask'] = mask
+            return context
 
+        mask = self._fast_mask(image, previous_mask)
+        if self.check:
+            exact = self._exact_mask(image)
+            if previous_mask is not None:
+                exact = cv2.bitwise_and(previous_mask, exact)
+            wrong = mask != exact
+            mismatches = int(np.count_nonzero(wrong))
+            with self._check_lock:
+                self.checked_pixels += wrong.size
+                self.mismatch_total += mismatches
+                room = self.check_samples - len(self.mismatch_samples)
+                if mismatches and room > 0:
+                    ys, xs = np.nonzero(wrong)
+                    # Under TiledStep the image is one band, tile_row is where it starts in the frame
+                    top = context.get('tile_row', 0)
+                    self.mismatch_samples += [(context.get('frame_number'), int(x), int(y) + top)
+                                              for y, x in zip(ys[:room], xs[:room])]
+            context['lab_lut_mismatches'] = mismatches
+        context['mask'] = mask
         return context
+
+    def close(self):
+        if not (self.fast and self.check) or self.checked_pixels == 0:
+            return
+        if self.mismatch_total == 0:
+            print(f"LabColorSegmentationMask check: LUT matched the exact path on all {self.checked_pixels} pixels")
+            return
+        print(f"LabColorSegmentationMask check: LUT disagreed with the exact path on {self.mismatch_total} of "
+              f"{self.checked_pixels} pixels, first ones (frame, x, y): {self.mismatch_samples}")
@@ -1,20 +1,76 @@
-from .brightness import BrightnessAdjuster
-from .grayscale import GrayscaleConverter
-from .optical_flow import OpticalFlowCalculator
-from .show_image import ShowCurrentImage
-from .visualize import Visualize
-from .pipeline import Pipeline
-from .crop_line import CropLine
-from .thresholding import MidToneThresholdMask
-from .contrast import HistogramContrastAdjuster, LinearContrastAdjuster
-from .LABcolor_segmentation import LabColorSegmentationMask
-from .median_filter import MedianFilter
-from .apply_mask import ApplyMaskDenoised
-from .CircleCrop import CircleCrop
-from .GraphData import GraphData
-
-# This defines what `from my_package import *` will import.
+# Steps are imported the first time they are used (e.g. `from processing_steps import CircleCrop`, or a
+# pipeline config that names them), so importing this package is instant and doesn't load OpenCV until
+# something needs it. To add a step, add 'YourClassName': 'your_file_name' to _STEP_MODULES below.
+# Don't name the file after the class: importing a submodule sets it on the package under its file name,
+# which would then hide the class (run check_registry.py after adding one).
+import importlib
+
+# name -> module (in this folder) that defines it
+_STEP_MODULES = {
+    'BrightnessAdjuster': 'brightness',
+    'GrayscaleConverter': 'grayscale',
+    'OpticalFlowCalculator': 'optical_flow',
+    'ShowCurrentImage': 'show_image',
+    'Visualize': 'visualize',
+    'CropLine': 'crop_line',
+    'MidToneThresholdMask': 'thresholding',
+    'HistogramContrastAdjuster': 'contrast',
+    'LinearContrastAdjuster': 'contrast',
+    'SmoothedHistogramEqualizer': 'contrast',
+    'MedianFilter': 'median_filter',
+    'LabColorSegmentationMask': 'LABcolor_segmentation',
+    'ApplyMaskDenoised': 'apply_mask',
+    'CircleCrop': 'circle_crop',
+    'GraphData': 'graph_data',
+    'TiledStep': 'tiled',
+    'ActivityHeatmap': 'heatmap',
+    'BackgroundMotionMask': 'background_motion',
+    'ActivityIndex': 'activity_index',
+    'Resize': 'resize',
+}
+
+# Everything else the package offers that isn't a step
+_OTHER_MODULES = {
+    'Pipeline': 'pipeline',
+    'StagedPipeline': 'staged',
+    'balance_stages': 'staged',
+    'AdaptiveFrameSampler': 'frame_sampler',
+    'BackgroundFrameWriter': 'frame_writer',
+    'read_heatmaps': 'heatmap',
+    'FeatureDetector': 'feature_detectors',
+    'step_class': 'registry',
+    'build_step': 'registry',
+    'build_steps': 'registry',
+    'build_pipeline': 'registry',
+    'load_config': 'registry',
+    'default_config': 'registry',
+    'preprocess_steps': 'registry',
+    'set_kwargs': 'registry',
+}
+
+
+def _load(name):
+    module = _STEP_MODULES.get(name) or _OTHER_MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    # Cache it, so the next lookup doesn't come back here
+    globals()[name] = value
+    return value
+
+
+def __getattr__(name):
+    return _load(name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+# This defines what `from my_package import *` will import (which does load every step).
 __all__ = ['Pipeline',
+           'StagedPipeline',
+           'balance_stages',
            'BrightnessAdjuster',
            'GrayscaleConverter',
            'OpticalFlowCalculator',
@@ -24,8 +80,26 @@ __all__ = ['Pipeline',
            'MidToneThresholdMask',
            'HistogramContrastAdjuster',
            'LinearContrastAdjuster',
+           'SmoothedHistogramEqualizer',
            'MedianFilter',
            'LabColorSegmentationMask',
            'ApplyMaskDenoised',
            'CircleCrop',
-           'GraphData',]
+           'GraphData',
+           'AdaptiveFrameSampler',
+           'BackgroundFrameWriter',
+           'TiledStep',
+           'ActivityHeatmap',
+           'read_heatmaps',
+           'BackgroundMotionMask',
+           'ActivityIndex',
+           'Resize',
+           'FeatureDetector',
+           'step_class',
+           'build_step',
+           'build_steps',
+           'build_pipeline',
+           'load_config',
+           'default_config',
+           'preprocess_steps',
+           'set_kwargs',]
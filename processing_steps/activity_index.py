@@ -0,0 +1,126 @@
+import os
+import cv2
+import numpy as np
+from collections import deque
+from .pipeline import ProcessingStep
+
+
+class ActivityIndex(ProcessingStep):
+    """
+    A cheap "how active are the fish" number, for when the full optical flow path (OpticalFlowCalculator +
+    GraphData) isn't needed. Each frame is shrunk and turned gray, and compared with the previous processed
+    frame (or with a running average of the frames, if background=True) inside context['mask']:
+        fraction -> fraction of the tank's pixels that changed by more than threshold gray levels
+        energy -> average change in gray levels over the tank's pixels
+    Both are put in context['activity'] as (fraction, energy). If outfile is given, a rolling average of one
+    of them is appended to it in the same "time in seconds, rolling average" rows as GraphData, so the same
+    graphs/batch summaries work on it. Check how well it follows the optical flow numbers with
+    activity_calibration.py.
+
+    Initialized Values:
+        outfile (optional, the file that rows are appended to),
+        fps (frame rate of the video, used to turn frame numbers into seconds),
+        windowSize (number of processed frames in the rolling average, the same as GraphData),
+        metric ('fraction' or 'energy', which one is written to outfile),
+        scale (how much to shrink the frame by, 0.25 = a quarter of the width and height),
+        threshold (change in gray levels that counts as a changed pixel),
+        background (if True, compare with a running average of the frames instead of the previous frame, which
+            picks up fish that are there but moving slowly),
+        learning_rate (how fast the running average follows the frames).
+
+    Context Input: context['current_frame'] (grayscale or BGR), optionally context['mask'], context['frame_number']
+    Context Output: context['activity'] (and rows in outfile)
+    """
+    inputs = ('current_frame', 'frame_number')
+    optional_inputs = ('mask',)
+    outputs = ('activity',)
+
+    def __init__(self, outfile=None, fps=30, windowSize=20, metric: str = 'fraction', scale: float = 0.25,
+                 threshold: float = 15, background: bool = False, learning_rate: float = 0.05):
+        if metric not in ('fraction', 'energy'):
+            raise ValueError("metric must be 'fraction' or 'energy'.")
+        self.outfile = outfile
+        self.is_sink = outfile is not None
+        self.fps = fps
+        self.window = windowSize
+        self.metric = metric
+        self.scale = scale
+        self.threshold = threshold
+        self.background = background
+        self.learning_rate = learning_rate
+        # The previous small frame (or the running average, as float32)
+        self.reference = None
+        # The rolling window only ever holds windowSize values, with their sum kept alongside
+        self.most_recent = deque(maxlen=windowSize)
+        self.window_sum = 0.0
+        # Shrunk mask, remade only when the mask changes
+        self.mask_source = None
+        self.small_mask = None
+        self.mask_pixels = 0
+
+    def _shrink(self, frame):
+        h, w = frame.shape[:2]
+        size = (max(1, int(w * self.scale)), max(1, int(h * self.scale)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def _update_mask(self, mask, size):
+        if mask is None:
+            self.mask_source = self.small_mask = None
+            self.mask_pixels = size[0] * size[1]
+        elif mask is not self.mask_source or self.small_mask.shape != size[::-1]:
+            self.mask_source = mask
+            self.small_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+            self.mask_pixels = max(1, cv2.countNonZero(self.small_mask))
+
+    def process(self, context: dict) -> dict:
+        frame = context.get('current_frame')
+        if frame is None:
+            return context
+        small = self._shrink(frame)
+        self._update_mask(context.get('mask'), (small.shape[1], small.shape[0]))
+
+        if self.reference is None or self.reference.shape != small.shape:
+            self.reference = small.astype(np.float32) if self.background else small
+            return context
+        if self.background:
+            difference = cv2.absdiff(small, cv2.convertScaleAbs(self.reference))
+            cv2.accumulateWeighted(small, self.reference, self.learning_rate)
+        else:
+            difference = cv2.absdiff(small, self.reference)
+            self.reference = small
+        if self.small_mask is not None:
+            difference = cv2.bitwise_and(difference, self.small_mask)
+
+        changed = cv2.countNonZero(cv2.threshold(difference, self.threshold, 255, cv2.THRESH_BINARY)[1])
+        fraction = changed / self.mask_pixels
+        energy = cv2.sumElems(difference)[0] / self.mask_pixels
+        context['activity'] = (fraction, energy)
+
+        if self.outfile is not None:
+            self._write(context['frame_number'], fraction if self.metric == 'fraction' else energy)
+        return context
+
+    def _write(self, frame_number, value):
+        if len(self.most_recent) == self.window:
+            self.window_sum -= self.most_recent[0]
+        self.most_recent.append(value)
+        self.window_sum += value
+        if len(self.most_recent) < self.window:
+            return
+        with open(self.outfile, 'a') as f:
+            f.write(f'{frame_number/float(self.fps)}, {self.window_sum/len(self.most_recent)}\n')
+
+    def get_state(self):
+        offset = os.path.getsize(self.outfile) if self.outfile and os.path.exists(self.outfile) else 0
+        return {'reference': self.reference, 'most_recent': list(self.most_recent), 'offset': offset}
+
+    def set_state(self, state):
+        self.reference = state['reference']
+        self.most_recent = deque(state['most_recent'], maxlen=self.window)
+        self.window_sum = float(sum(self.most_recent))
+        if self.outfile and os.path.exists(self.outfile):
+            with open(self.outfile, 'r+') as f:
+                f.truncate(state['offset'])
@@ -17,8 +17,13 @@ class ApplyMaskDenoised(ProcessingStep):
     Outputs (to context):
     - 'mask' (np.ndarray): The cleaned mask, which overwrites the original.
     """
+    inputs = ('mask', 'current_frame')
+    outputs = ('mask', 'current_frame')
+
     def __init__(self, kernel_size: tuple = (5, 5)):
         self.kernel_size = kernel_size
+        # Opening is an erosion followed by a dilation, each reaching half the kernel height
+        self.tile_halo = 2 * (kernel_size[1] // 2)
 
     def process(self, context: dict) -> dict:
         mask = context.get('mask')
@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+from .pipeline import ProcessingStep
+
+
+class BackgroundMotionMask(ProcessingStep):
+    """
+    Learns what the still tank looks like and marks the parts of the frame that differ from it (the fish
+    that are moving). The result goes in context['motion_mask'], which OpticalFlowCalculator uses to only
+    look for features where something is moving, instead of spending its corners on static tank texture.
+    The background model runs on a shrunk copy of the frame, so it is cheap.
+
+    Initialized parameters:
+        method -> 'mog2' (OpenCV's mixture of gaussians model) or 'average' (running average of the frames)
+        scale -> how much to shrink the frame by before modelling (0.25 = a quarter of the width and height)
+        learning_rate -> how fast the background adapts (for 'average', and for 'mog2' if not None,
+            otherwise MOG2 picks it from its history)
+        threshold -> for 'average', gray level difference that counts as motion. For 'mog2', its varThreshold.
+        grow -> pixels (at full size) to grow the moving regions by, so features on the edges of a fish count
+
+    Inputs: context['current_frame'] (grayscale or BGR), optionally context['mask'] to limit it to the tank
+    Output: context['motion_mask'], 255 where there is motion, same size as the frame
+    """
+    inputs = ('current_frame',)
+    optional_inputs = ('mask',)
+    outputs = ('motion_mask',)
+
+    def __init__(self, method: str = 'mog2', scale: float = 0.25, learning_rate: float = None,
+                 threshold: float = 16, grow: int = 15):
+        if method not in ('mog2', 'average'):
+            raise ValueError("method must be 'mog2' or 'average'.")
+        self.method = method
+        self.scale = scale
+        self.learning_rate = learning_rate
+        self.threshold = threshold
+        self.grow = grow
+        self.subtractor = None
+        self.background = None
+        # Kernel in shrunk pixels
+        size = max(1, int(round(2 * grow * scale)) | 1)
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+
+    def process(self, context: dict) -> dict:
+        frame = context.get('current_frame')
+        if frame is None:
+            return context
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (max(1, int(w * self.scale)), max(1, int(h * self.scale))),
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        if self.method == 'mog2':
+            if self.subtractor is None:
+                self.subtractor = cv2.createBackgroundSubtractorMOG2(varThreshold=self.threshold, detectShadows=False)
+            rate = -1 if self.learning_rate is None else self.learning_rate
+            motion = self.subtractor.apply(small, learningRate=rate)
+        else:
+            if self.background is None:
+                self.background = small.astype(np.float32)
+            difference = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+            motion = cv2.threshold(difference, self.threshold, 255, cv2.THRESH_BINARY)[1]
+            cv2.accumulateWeighted(small, self.background, self.learning_rate or 0.05)
+
+        if self.grow:
+            motion = cv2.dilate(motion, self.kernel)
+        motion = cv2.resize(motion, (w, h), interpolation=cv2.INTER_NEAREST)
+        if context.get('mask') is not None:
+            motion = cv2.bitwise_and(motion, context['mask'])
+        context['motion_mask'] = motion
+        return context
+
+    def get_state(self):
+        # The MOG2 model can't be pickled, so only the running average survives a checkpoint
+        return {'background': self.background}
+
+    def set_state(self, state):
+        self.background = state['background']
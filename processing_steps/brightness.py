@@ -11,6 +11,10 @@ class BrightnessAdjuster(ProcessingStep):
     Input: Grayscale image @ context['current_frame']
     Output: Image with brightness adjusted @ context['current_frame']
     """
+    inputs = ('current_frame',)
+    outputs = ('current_frame',)
+    tile_halo = 0
+
     def __init__(self, brightness: int = 0):
         """
         Initializes the step with a brightness adjustment value.
@@ -0,0 +1,124 @@
+import os
+import cv2
+import numpy as np
+from .pipeline import ProcessingStep
+from .tank_calibration import detect_tank_circle, load_calibration, rim_contrast, save_calibration, shrink_gray
+
+
+class CircleCrop(ProcessingStep):
+    """
+    Crops the image so that only a circle is visible. Can set hyperparameters to determine
+    circle location (relative to the center of the image) and the radius.
+
+    Or, with calibration set to a calibration file (one per camera, see tank_calibration.py), the circle is
+    read from that file. If the file doesn't exist yet, the tank is found in the first frame and saved there.
+    With recheck_every=N, every N frames it checks that the circle still lines up with the tank rim, and
+    finds the tank again (and updates the file) if the camera has moved.
+
+    Context Input: context['current_frame'] holding the current frame.
+    Context Output: context['mask'] holding the circle mask (combined with any previous mask steps).
+    """
+    inputs = ('current_frame',)
+    optional_inputs = ('mask',)
+    outputs = ('mask', 'current_frame')
+
+    def __init__(self, center=(0,0), r=0, calibration: str = None, recheck_every: int = 0,
+                 recheck_scale: float = 0.25):
+        self.center = center
+        self.r = r
+        self.calibration = calibration
+        self.recheck_every = recheck_every
+        self.recheck_scale = recheck_scale
+        # Circle in pixels from the top left (set from the calibration file, or from center/r on the first frame)
+        self.circle = None
+        self.rim_contrast = None
+        self.frames_seen = 0
+        # The mask only changes when the circle or the frame size does, so it's made once and reused
+        # (steps make new masks instead of changing context['mask'] in place, so it can be shared)
+        self.mask = None
+        self.mask_circle = None
+
+    def _calibrate(self, frame):
+        ww, hh = frame.shape[1], frame.shape[0]
+        if os.path.exists(self.calibration):
+            calibration = load_calibration(self.calibration, (ww, hh))
+        else:
+            result = detect_tank_circle([frame])
+            if result is None:
+                raise ValueError(f"Couldn't find the tank in the first frame to make {self.calibration}. "
+                                 f"Run calibrate_tank.py on a few frames, or give CircleCrop a center and r.")
+            center, r, contrast = result
+            calibration = save_calibration(self.calibration, center, r, (ww, hh), contrast, source='first frame')
+            print(f"Saved tank calibration to {self.calibration}: center {center}, r {r}")
+        self.circle = (tuple(calibration['center']), calibration['r'])
+        self.rim_contrast = calibration.get('rim_contrast')
+
+    def _recheck(self, frame):
+        """ Finds the tank again if the rim doesn't line up with the circle anymore """
+        (x, y), r = self.circle
+        s = self.recheck_scale
+        contrast = rim_contrast(shrink_gray(frame, s), (x * s, y * s), r * s)
+        if not self.rim_contrast or contrast >= 0.5 * self.rim_contrast:
+            return
+        result = detect_tank_circle([frame], scale=s)
+        if result is None:
+            print(f"Warning: the tank rim doesn't line up with the circle anymore (frame contrast {contrast:.1f}, "
+                  f"calibrated {self.rim_contrast:.1f}), and the tank couldn't be found again")
+            return
+        center, r, contrast = result
+        print(f"Camera seems to have moved, tank is now at {center}, r {r}")
+        self.circle = (center, r)
+        self.rim_contrast = contrast
+        if self.calibration is not None:
+            save_calibration(self.calibration, center, r, (frame.shape[1], frame.shape[0]), contrast,
+                             source='recheck')
+
+    def process(self, context: dict) -> dict:
+        frame = context.get('current_frame')
+        if frame is None:
+            return context  # Or raise an error
+
+        """ Applies circular mask to frame """
+
+        hh, ww = frame.shape[:2]
+
+        if self.circle is None:
+            if self.calibration is not None:
+                self._calibrate(frame)
+            else:
+                center = ((ww // 2) + self.center[0], (hh // 2) + self.center[1])
+                if self.r == 0:
+                    r = self.center[1]
+                else:
+                    r = self.r
+                self.circle = (center, r)
+                if self.recheck_every:
+                    # Remember what the rim looks like now, to compare the later checks against
+                    s = self.recheck_scale
+                    self.rim_contrast = rim_contrast(shrink_gray(frame, s), (center[0] * s, center[1] * s), r * s)
+        self.frames_seen += 1
+        if self.recheck_every and self.frames_seen % self.recheck_every == 0:
+            self._recheck(frame)
+
+        # Create a mask with a filled white circle
+        if self.mask is None or self.mask.shape != (hh, ww) or self.mask_circle != self.circle:
+            self.mask = np.zeros((hh, ww), dtype=np.uint8)
+            cv2.circle(self.mask, self.circle[0], self.circle[1], 255, thickness=-1)
+            self.mask_circle = self.circle
+        mask = self.mask
+
+        # Add the new mask to the context (combining it with earlier masks if they exist
+        if context.get('mask') is not None:
+            mask = cv2.bitwise_and(context['mask'], mask)
+        context['mask'] = mask
+
+        context['current_frame'] = frame
+        return context
+
+    def get_state(self):
+        return {'circle': self.circle, 'rim_contrast': self.rim_contrast, 'frames_seen': self.frames_seen}
+
+    def set_state(self, state):
+        self.circle = state['circle']
+        self.rim_contrast = state['rim_contrast']
+        self.frames_seen = state['frames_seen']
@@ -10,6 +10,9 @@ class HistogramContrastAdjuster(ProcessingStep):
     Input: Grayscale image @ context['current_frame']
     Output: Image with brightness adjusted @ context['current_frame']
     """
+    inputs = ('current_frame',)
+    outputs = ('current_frame',)
+
     def __init__(self):
         pass
 
@@ -23,6 +26,10 @@ class HistogramContrastAdjuster(ProcessingStep):
 
 
 class LinearContrastAdjuster(ProcessingStep):
+    inputs = ('current_frame',)
+    outputs = ('current_frame',)
+    tile_halo = 0
+
     def __init__(self, alpha:float):
         self.alpha = alpha
 
@@ -34,4 +41,156 @@ class LinearContrastAdjuster(ProcessingStep):
         adjusted_image = cv2.convertScaleAbs(frame, alpha=self.alpha)
 
         context['current_frame'] = adjusted_image
-        return context
\ No newline at end of file
+        return context
+
+class SmoothedHistogramEqualizer(ProcessingStep):
+    """
+    Histogram equalization that doesn't flicker. Compared to HistogramContrastAdjuster:
+        - the histogram only counts pixels inside context['mask'] (if there is one), so the black area around
+          the tank doesn't skew it,
+        - it only looks at every sample_stride-th pixel in each direction, which is plenty for a histogram,
+        - the brightness mapping (LUT) is a moving average over the frames, so the brightness doesn't jump
+          from frame to frame (which LK tracking mistakes for movement).
+
+    With method='clahe' the frame is split into tile_grid tiles and each tile gets its own mapping (with the
+    histogram clipped at clip_limit, like cv2.createCLAHE), blended smoothly between tiles. The tile mappings
+    are kept and averaged over time the same way.
+
+    Initialized Values:
+        method ('global' or 'clahe'),
+        sample_stride (use every n-th pixel in each direction for the histograms),
+        smoothing (how much of each new mapping goes into the average, 1 = no smoothing),
+        clip_limit, tile_grid (for 'clahe', same meaning as in cv2.createCLAHE).
+
+    Input: Grayscale image @ context['current_frame'], optionally the tank mask @ context['mask']
+    Output: Equalized image @ context['current_frame'] (pixels outside the mask are left as they were)
+    """
+    inputs = ('current_frame',)
+    optional_inputs = ('mask',)
+    outputs = ('current_frame',)
+
+    def __init__(self, method: str = 'global', sample_stride: int = 4, smoothing: float = 0.2,
+                 clip_limit: float = 2.0, tile_grid=(8, 8)):
+        if method not in ('global', 'clahe'):
+            raise ValueError("method must be 'global' or 'clahe'.")
+        if not 0 < smoothing <= 1:
+            raise ValueError("smoothing must be between 0 (not included) and 1.")
+        self.method = method
+        self.sample_stride = sample_stride
+        self.smoothing = smoothing
+        self.clip_limit = clip_limit
+        self.tile_grid = tile_grid
+        # Averaged mappings, float32 so small changes add up instead of rounding away.
+        # Shape (256,) for global, (tiles, 256) for clahe
+        self.luts = None
+        # For clahe: the blending weights of every tile, which only depend on the frame size
+        self.frame_shape = None
+        self.tile_weights = None
+
+    def process(self, context: dict) -> dict:
+        frame = context.get('current_frame')
+        if frame is None:
+            return context
+        mask = context.get('mask')
+        if mask is not None and mask.shape != frame.shape[:2]:
+            mask = None
+
+        s = self.sample_stride
+        sample = frame[::s, ::s]
+        keep = None if mask is None else mask[::s, ::s] > 0
+        if self.method == 'global':
+            new_luts = self._global_lut(sample, keep)
+        else:
+            new_luts = self._tile_luts(frame.shape, sample, keep)
+        if self.luts is None or self.luts.shape != new_luts.shape:
+            self.luts = new_luts
+        else:
+            self.luts += self.smoothing * (new_luts - self.luts)
+
+        if self.method == 'global':
+            equalized = cv2.LUT(frame, np.round(self.luts).astype(np.uint8))
+        else:
+            equalized = self._apply_tiles(frame)
+        if mask is not None:
+            np.copyto(equalized, frame, where=mask == 0)
+        context['current_frame'] = equalized
+        return context
+
+    @staticmethod
+    def _global_lut(sample, keep):
+        values = sample[keep] if keep is not None else sample.ravel()
+        hist = np.bincount(values, minlength=256)
+        return SmoothedHistogramEqualizer._equalizing_lut(hist[None, :].astype(np.float32))[0]
+
+    @staticmethod
+    def _equalizing_lut(hists):
+        """ The same mapping cv2.equalizeHist uses, for each row of hists. Empty rows get the identity. """
+        cdf = hists.cumsum(axis=1)
+        total = cdf[:, -1:]
+        cdf_min = np.take_along_axis(cdf, (hists > 0).argmax(axis=1)[:, None], axis=1)
+        luts = (cdf - cdf_min) * 255 / np.maximum(total - cdf_min, 1)
+        luts = np.clip(luts, 0, 255).astype(np.float32)
+        luts[total[:, 0] == 0] = np.arange(256, dtype=np.float32)
+        return luts
+
+    def _tile_luts(self, shape, sample, keep):
+        rows, cols = self.tile_grid
+        h, w = shape[:2]
+        s = self.sample_stride
+        tile_row = (np.arange(0, h, s) * rows // h)[:, None]
+        tile_col = (np.arange(0, w, s) * cols // w)[None, :]
+        tiles = (tile_row * cols + tile_col)
+        values = sample.astype(np.int64)
+        if keep is not None:
+            tiles, values = np.broadcast_to(tiles, sample.shape)[keep], values[keep]
+        else:
+            tiles, values = np.broadcast_to(tiles, sample.shape).ravel(), values.ravel()
+        hists = np.bincount(tiles * 256 + values, minlength=rows * cols * 256).reshape(rows * cols, 256)
+        hists = hists.astype(np.float32)
+
+        # Clip each histogram and spread what was cut off evenly over all levels (like CLAHE)
+        counts = hists.sum(axis=1, keepdims=True)
+        limit = np.maximum(self.clip_limit * counts / 256, 1)
+        excess = np.maximum(hists - limit, 0).sum(axis=1, keepdims=True)
+        hists = np.minimum(hists, limit) + excess / 256
+        luts = (hists.cumsum(axis=1) * 255 / np.maximum(counts, 1)).astype(np.float32)
+        # Tiles with (almost) nothing of the tank in them are left alone
+        luts[counts[:, 0] < 16] = np.arange(256, dtype=np.float32)
+        return np.clip(luts, 0, 255)
+
+    def _make_tile_weights(self, shape):
+        """
+        For every tile: the part of the frame it affects and its blending weights there. Each pixel's
+        value is a mix of the mappings of the (up to) 4 tiles whose centers are nearest, weighted by distance.
+        """
+        rows, cols = self.tile_grid
+        h, w = shape[:2]
+        row_centers = (np.arange(rows) + 0.5) * h / rows
+        col_centers = (np.arange(cols) + 0.5) * w / cols
+        y, x = np.arange(h), np.arange(w)
+        # np.interp keeps the end values past the first/last center, so edge tiles cover the frame borders
+        row_weights = [np.interp(y, row_centers, np.eye(rows)[i]).astype(np.float32) for i in range(rows)]
+        col_weights = [np.interp(x, col_centers, np.eye(cols)[j]).astype(np.float32) for j in range(cols)]
+        self.tile_weights = []
+        for i in range(rows):
+            r = np.flatnonzero(row_weights[i])
+            for j in range(cols):
+                c = np.flatnonzero(col_weights[j])
+                weights = np.outer(row_weights[i][r[0]:r[-1] + 1], col_weights[j][c[0]:c[-1] + 1])
+                self.tile_weights.append((slice(r[0], r[-1] + 1), slice(c[0], c[-1] + 1), weights))
+        self.frame_shape = shape[:2]
+
+    def _apply_tiles(self, frame):
+        if self.frame_shape != frame.shape[:2]:
+            self._make_tile_weights(frame.shape)
+        result = np.zeros(frame.shape[:2], dtype=np.float32)
+        for lut, (rows, cols, weights) in zip(self.luts, self.tile_weights):
+            mapped = cv2.LUT(frame[rows, cols], lut.reshape(1, 256))
+            cv2.accumulateProduct(mapped, weights, result[rows, cols])
+        return cv2.convertScaleAbs(result)
+
+    def get_state(self):
+        return {'luts': None if self.luts is None else self.luts.copy()}
+
+    def set_state(self, state):
+        self.luts = state['luts']
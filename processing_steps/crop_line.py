@@ -14,10 +14,17 @@ class CropLine(ProcessingStep):
 
     Inputs:
         The current frame (grayscaled or not) @ context['current_frame']
+        Optionally, the row of the full frame that the current frame starts at @ context['tile_row']
+            (set by TiledStep, since the line is in full frame coordinates)
 
     Outputs:
         The current frame with the cropping applied (with black pixels in the cropped area)
     """
+    inputs = ('current_frame',)
+    optional_inputs = ('tile_row',)
+    outputs = ('current_frame',)
+    tile_halo = 0
+
     def __init__(self, slope: float, intercept: float, reverse: bool=False):
         self.normal = np.array([-slope, 1])
         self.reverse = reverse
@@ -28,9 +35,10 @@ class CropLine(ProcessingStep):
         c = self.bias
         image = context['current_frame']
         h, w = image.shape[:2]
+        top = context.get('tile_row', 0)
 
         # Create a grid of (x, y) coordinates for every pixel
-        y_coords, x_coords = np.mgrid[0:h, 0:w]
+        y_coords, x_coords = np.mgrid[top:top + h, 0:w]
 
         # Calculate the line equation for all pixels at once (vectorized)
         side_check = a * x_coords + b * y_coords + c
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+
+'''
+ FEATURE DETECTORS for OpticalFlowCalculator. Every detector returns the points to track as a float32
+ array of shape (N, 1, 2) (what calcOpticalFlowPyrLK wants), strongest first, or None if nothing was found.
+ With grid=(rows, columns) the frame is split into cells and at most per_cell points are kept in each
+ cell, so a few very contrasty places (like the tank rim) can't use up the whole budget.
+'''
+
+DETECTORS = ('shi-tomasi', 'fast', 'agast', 'orb')
+
+
+def bucket_points(points: np.ndarray, shape, grid, per_cell: int) -> np.ndarray:
+    """
+    Keeps at most per_cell points in each grid cell. points -> (N, 2) array ordered strongest first,
+    shape -> (height, width) of the frame, grid -> (rows, columns). Returns the kept points, still in order.
+    """
+    if len(points) == 0:
+        return points
+    rows, cols = grid
+    h, w = shape[:2]
+    row = np.clip((points[:, 1] * (rows / h)).astype(np.int64), 0, rows - 1)
+    col = np.clip((points[:, 0] * (cols / w)).astype(np.int64), 0, cols - 1)
+    cells = row * cols + col
+    # Stable sort by cell keeps the strongest-first order inside each cell, then rank = position in the cell
+    order = np.argsort(cells, kind='stable')
+    sorted_cells = cells[order]
+    starts = np.searchsorted(sorted_cells, sorted_cells, side='left')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order)) - starts
+    return points[rank < per_cell]
+
+
+class FeatureDetector:
+    """
+    Finds points to track with one of DETECTORS:
+        'shi-tomasi' -> cv2.goodFeaturesToTrack (the original detector, best corners but the slowest),
+        'fast' / 'agast' -> FAST or AGAST keypoints (much quicker, more points on weak texture),
+        'orb' -> ORB keypoints (FAST corners ranked by Harris score, over an image pyramid).
+
+    Initialized Values:
+        method (one of DETECTORS),
+        max_features (total number of points to return),
+        quality (for shi-tomasi, the qualityLevel (default 0.2). For fast/agast, the corner threshold
+            (0-255, default 20). Not used by orb),
+        min_distance (for shi-tomasi, minimum distance between points),
+        grid (optional (rows, columns), caps the points per cell for an even spread),
+        per_cell (points allowed per cell, default is an even share of max_features).
+    """
+    def __init__(self, method: str = 'shi-tomasi', max_features: int = 500, quality: float = None,
+                 min_distance: int = 15, grid=None, per_cell: int = None):
+        if method not in DETECTORS:
+            raise ValueError(f"method must be one of {DETECTORS}.")
+        self.method = method
+        self.max_features = max_features
+        if quality is None:
+            quality = 0.2 if method == 'shi-tomasi' else 20
+        self.quality = quality
+        self.min_distance = min_distance
+        self.grid = grid
+        if grid is not None and per_cell is None:
+            per_cell = max(1, -(-max_features // (grid[0] * grid[1])))
+        self.per_cell = per_cell
+
+        if method == 'fast':
+            self.keypoint_detector = cv2.FastFeatureDetector_create(threshold=int(quality))
+        elif method == 'agast':
+            # AGAST is in the main module up to OpenCV 4, newer versions moved it to the contrib modules
+            create = getattr(cv2, 'AgastFeatureDetector_create', None)
+            if create is None and hasattr(cv2, 'xfeatures2d'):
+                create = getattr(cv2.xfeatures2d, 'AgastFeatureDetector_create', None)
+            if create is None:
+                raise ValueError("This OpenCV build has no AGAST detector (install opencv-contrib-python).")
+            self.keypoint_detector = create(threshold=int(quality))
+        elif method == 'orb':
+            # ORB keeps its own cap, ask for extra so bucketing has some to choose from
+            self.keypoint_detector = cv2.ORB_create(nfeatures=max_features * (4 if grid else 1))
+        else:
+            self.keypoint_detector = None
+
+    def detect(self, gray: np.ndarray, mask: np.ndarray = None):
+        if self.keypoint_detector is None:
+            # goodFeaturesToTrack already returns its corners strongest first
+            budget = self.max_features * 4 if self.grid else self.max_features
+            corners = cv2.goodFeaturesToTrack(gray, maxCorners=budget, qualityLevel=self.quality,
+                                              minDistance=self.min_distance, mask=mask)
+            if corners is None:
+                return None
+            points = corners.reshape(-1, 2)
+        else:
+            keypoints = self.keypoint_detector.detect(gray, mask)
+            if not keypoints:
+                return None
+            points = np.array([kp.pt for kp in keypoints], dtype=np.float32)
+            responses = np.array([kp.response for kp in keypoints], dtype=np.float32)
+            points = points[np.argsort(-responses, kind='stable')]
+
+        if self.grid is not None:
+            points = bucket_points(points, gray.shape, self.grid, self.per_cell)
+        points = points[:self.max_features]
+        if len(points) == 0:
+            return None
+        return np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 1, 2)
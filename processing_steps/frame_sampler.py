@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+
+class AdaptiveFrameSampler:
+    """
+    Decides which frames of a video are worth running the full pipeline on, instead of a fixed
+    "every 10th frame" stride. A cheap pre-check shrinks the (masked) tank down to a tiny grayscale
+    image and compares it to the tiny image of the last processed frame. If the mean absolute
+    difference is above motion_threshold the frame gets processed, so calm stretches are sampled
+    sparsely and feeding bursts densely.
+
+    Initialized parameters:
+        min_stride -> never process two frames closer than this many frames apart
+        max_stride -> always process a frame once this many frames have passed since the last one
+        motion_threshold -> mean absolute gray level difference (0-255) inside the mask that counts as motion
+        size -> width of the tiny pre-check image (height follows the aspect ratio)
+        mask -> optional tank mask, only the pixels inside it are compared. Can also be set later with
+            set_mask() (main.run_main uses context['mask'] of the first processed frame)
+
+    Usage (see main.run_main):
+        if sampler.should_process(frame, frame_num): ... run the pipeline ...
+    Frames closer than min_stride can be skipped before they are even decoded, using
+    sampler.too_soon(frame_num).
+
+    Note: the processed frames end up irregularly spaced, so use GraphData with window_seconds and
+    per_frame=True to get a time based window and displacements that don't depend on the gap.
+    """
+    def __init__(self, min_stride: int = 2, max_stride: int = 30, motion_threshold: float = 2.0, size: int = 64,
+                 mask=None):
+        if not 1 <= min_stride <= max_stride:
+            raise ValueError("Strides must satisfy 1 <= min_stride <= max_stride.")
+        self.min_stride = min_stride
+        self.max_stride = max_stride
+        self.motion_threshold = motion_threshold
+        self.size = size
+        self.roi = None
+        self.small_mask = None
+        if mask is not None:
+            self.set_mask(mask)
+
+        self.last_frame_number = None
+        self.last_small = None
+        self.last_motion = 0.0
+        self.processed = 0
+        self.skipped = 0
+
+    def too_soon(self, frame_number: int) -> bool:
+        """ True if the frame is within min_stride of the last processed frame (no need to look at it) """
+        return self.last_frame_number is not None and frame_number - self.last_frame_number < self.min_stride
+
+    def set_mask(self, mask: np.ndarray):
+        """ Restricts the pre-check to the pixels inside mask (the mask's bounding box is cropped first) """
+        x, y, w, h = cv2.boundingRect(mask)
+        if w == 0 or h == 0:
+            return
+        self.roi = (x, y, w, h)
+        self.small_mask = cv2.resize(mask[y:y + h, x:x + w], self._small_size(w, h), interpolation=cv2.INTER_NEAREST)
+        # Comparing against a frame that was shrunk without the mask would be meaningless
+        self.last_small = None
+
+    def _small_size(self, w: int, h: int) -> tuple:
+        return self.size, max(1, round(h * self.size / w))
+
+    def _small_gray(self, frame: np.ndarray) -> np.ndarray:
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            frame = frame[y:y + h, x:x + w]
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, self._small_size(w, h), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def should_process(self, frame: np.ndarray, frame_number: int) -> bool:
+        """
+        Returns True if the pipeline should run on this frame (and remembers it as the last processed
+        frame), False if it can be skipped. frame can be BGR or grayscale.
+        """
+        if self.too_soon(frame_number):
+            self.skipped += 1
+            return False
+
+        small = self._small_gray(frame)
+        if self.last_small is None:
+            process = True
+            self.last_motion = 0.0
+        else:
+            self.last_motion = cv2.mean(cv2.absdiff(small, self.last_small), mask=self.small_mask)[0]
+            process = (self.last_motion >= self.motion_threshold
+                       or frame_number - self.last_frame_number >= self.max_stride)
+
+        if process:
+            self.last_small = small
+            self.last_frame_number = frame_number
+            self.processed += 1
+        else:
+            self.skipped += 1
+        return process
+
+    def get_state(self):
+        return dict(self.__dict__)
+
+    def set_state(self, state):
+        self.__dict__.update(state)
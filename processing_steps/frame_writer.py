@@ -0,0 +1,70 @@
+import os
+import queue
+import threading
+import cv2
+
+
+class BackgroundFrameWriter:
+    """
+    Writes frames to a video file or a folder of images on a background thread, so that saving
+    debug/overlay images never slows the analysis down. The queue between the pipeline and the
+    writer is bounded: if the writer can't keep up, new frames are dropped (counted in self.dropped)
+    instead of making the pipeline wait.
+
+    outfile -> a video file (.mp4, .avi, .mov, .mkv) or a folder to save numbered .jpg/.png images in
+    fps -> frame rate of the output video
+    queue_size -> how many frames can wait to be written before frames get dropped
+    image_ext -> file extension of the images when writing to a folder
+    """
+    VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+    def __init__(self, outfile: str, fps: float = 30, queue_size: int = 8, image_ext: str = '.jpg'):
+        self.outfile = outfile
+        self.fps = fps
+        self.image_ext = image_ext
+        self.is_video = os.path.splitext(outfile)[1].lower() in self.VIDEO_EXTENSIONS
+        if not self.is_video:
+            os.makedirs(outfile, exist_ok=True)
+
+        self.written = 0
+        self.dropped = 0
+        self._writer = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, frame, frame_number: int) -> bool:
+        """ Queues a frame for writing. Returns False (and drops the frame) if the queue is full. """
+        try:
+            self._queue.put_nowait((frame, frame_number))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            frame, frame_number = item
+            if self.is_video:
+                if self._writer is None:
+                    # The size is only known once the first frame arrives
+                    h, w = frame.shape[:2]
+                    fourcc = cv2.VideoWriter_fourcc(*('MJPG' if self.outfile.lower().endswith('.avi') else 'mp4v'))
+                    self._writer = cv2.VideoWriter(self.outfile, fourcc, self.fps, (w, h), frame.ndim == 3)
+                self._writer.write(frame)
+            else:
+                cv2.imwrite(os.path.join(self.outfile, f"frame_{frame_number:06d}{self.image_ext}"), frame)
+            self.written += 1
+
+    def close(self):
+        """ Writes out whatever is still queued and closes the file. """
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        if self._writer is not None:
+            self._writer.release()
+        print(f"Wrote {self.written} frames to {self.outfile} ({self.dropped} dropped)")
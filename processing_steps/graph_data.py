@@ -0,0 +1,109 @@
+import os
+import cv2
+import numpy as np
+from .pipeline import ProcessingStep
+from collections import deque
+
+
+class GraphData(ProcessingStep):
+    """
+    Saves the average length of a vector in context['tracks'] to a text file, as
+    "time in seconds, rolling average" rows.
+
+    Initialized Values:
+        outfile (the file that rows are appended to),
+        fps (frame rate of the video, used to turn frame numbers into seconds),
+        windowSize (number of processed frames in the rolling average),
+        window_seconds (optional. If given, the rolling window covers this many seconds of video instead of
+            windowSize samples, and each sample is weighted by the time since the previous processed frame.
+            Use this when frames are not evenly spaced, e.g. with AdaptiveFrameSampler),
+        per_frame (optional. If True, each average length is divided by the number of video frames between
+            the two tracked frames, so the values don't depend on how far apart the processed frames are).
+
+    Context Input: context['tracks'] from OpticalFlowCalculator, context['frame_number'], optionally context['scale']
+        (from Resize, lengths are divided by it so they stay in full size pixels)
+    Context Output: None (writes to outfile)
+    """
+    inputs = ('frame_number',)
+    optional_inputs = ('tracks', 'scale')
+    outputs = ()
+    is_sink = True
+
+    def __init__(self, outfile, fps, windowSize, window_seconds: float = None, per_frame: bool = False):
+        self.most_recent = deque()
+        self.fps = fps
+        self.outfile = outfile
+        self.window = windowSize
+        self.window_seconds = window_seconds
+        self.per_frame = per_frame
+        # Frame number of the previous processed frame (what the tracks are measured against)
+        self.prev_frame_number = None
+        # Time of the first sample, used to know when the time window has filled up
+        self.start_time = None
+
+    def process(self, context: dict) -> dict:
+        frame_number = context['frame_number']
+        gap = 1 if self.prev_frame_number is None else max(1, frame_number - self.prev_frame_number)
+        self.prev_frame_number = frame_number
+
+        tracks = context.get('tracks')
+        if tracks is None or tracks == []:
+            return context  # Or raise an error
+        avg_len = 0.0
+        count = 0
+        scale = context.get('scale', 1.0)
+        for old_point, new_point in zip(tracks[0], tracks[1]):
+            l = cv2.norm(new_point - old_point, normType=cv2.NORM_L2) / scale
+            if l <= 130:
+                avg_len += l
+                count += 1
+        # No tracked points (e.g. nothing moving inside a motion mask) counts as no movement
+        avg_len = avg_len / count if count else 0.0
+        if self.per_frame:
+            avg_len /= gap
+
+        if self.window_seconds is not None:
+            return self._time_window(context, avg_len, gap)
+
+        if len(self.most_recent) < (self.window - 1):
+            self.most_recent.append(avg_len)
+            return context
+        else:
+            self.most_recent.append(avg_len)
+            with open(self.outfile, 'a') as f:
+                f.write(f'{context["frame_number"]/float(self.fps)}, {sum(self.most_recent)/len(self.most_recent)}\n')
+            self.most_recent.popleft()
+        return context
+
+    def _time_window(self, context: dict, avg_len: float, gap: int) -> dict:
+        """
+        Rolling average over the last window_seconds of video. Each sample stands for the time since the
+        previous processed frame, so a burst of densely sampled frames doesn't outweigh a long calm stretch.
+        """
+        now = context['frame_number'] / float(self.fps)
+        if self.start_time is None:
+            self.start_time = now
+        self.most_recent.append((now, gap / float(self.fps), avg_len))
+        while self.most_recent[0][0] <= now - self.window_seconds:
+            self.most_recent.popleft()
+        if now - self.start_time < self.window_seconds:
+            return context
+        total_weight = sum(weight for _, weight, _ in self.most_recent)
+        average = sum(weight * value for _, weight, value in self.most_recent) / total_weight
+        with open(self.outfile, 'a') as f:
+            f.write(f'{now}, {average}\n')
+        return context
+
+    def get_state(self):
+        # Remember how much of the output file was written, so resuming can cut off rows written after this
+        offset = os.path.getsize(self.outfile) if os.path.exists(self.outfile) else 0
+        return {'most_recent': list(self.most_recent), 'prev_frame_number': self.prev_frame_number,
+                'start_time': self.start_time, 'offset': offset}
+
+    def set_state(self, state):
+        self.most_recent = deque(state['most_recent'])
+        self.prev_frame_number = state['prev_frame_number']
+        self.start_time = state['start_time']
+        if os.path.exists(self.outfile):
+            with open(self.outfile, 'r+') as f:
+                f.truncate(state['offset'])
@@ -9,6 +9,10 @@ class GrayscaleConverter(ProcessingStep):
     Input: Any image @ context['current_frame']
     Output: Grayscaled image @ context['current_frame']
     """
+    inputs = ('current_frame',)
+    outputs = ('current_frame',)
+    tile_halo = 0
+
     def process(self, context: dict) -> dict:
         frame = context.get('current_frame')
         if frame is None:
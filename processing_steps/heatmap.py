@@ -0,0 +1,127 @@
+import os
+import cv2
+import numpy as np
+from .pipeline import ProcessingStep
+
+HEATMAP_MAGIC = b'FISHHEAT'
+
+
+class ActivityHeatmap(ProcessingStep):
+    """
+    Keeps track of where in the tank the movement happens. The tank is split into a grid of cells, and
+    every tracked vector from OpticalFlowCalculator adds its length to the cell its new point lands in.
+    Only the running totals per cell are kept (sum of lengths and number of vectors), so the memory used
+    doesn't grow with the length of the video. Every flush_every frames a snapshot of the totals is
+    appended to a binary file (read it back with read_heatmaps), so heatmaps for any stretch of the video
+    can be made by subtracting two snapshots.
+
+    Initialized Values:
+        outfile (binary file the snapshots are appended to),
+        grid (number of (rows, columns) of cells),
+        roi (optional (x, y, w, h) of the tank in the frame. If not given, the bounding box of
+            context['mask'] in the first frame is used, or the whole frame if there is no mask),
+        flush_every (number of processed frames between snapshots),
+        max_length (vectors longer than this are ignored, the same as in GraphData).
+
+    Context Input: context['tracks'] from OpticalFlowCalculator, context['frame_number']
+    Context Output: None (writes to outfile)
+
+    File format: HEATMAP_MAGIC, then int32 rows, columns, x, y, w, h, then one record per snapshot of
+    int64 frame number, rows*columns uint32 counts and rows*columns float32 sums of lengths.
+    """
+    inputs = ('frame_number',)
+    outputs = ()
+    is_sink = True
+
+    def __init__(self, outfile, grid=(16, 16), roi=None, flush_every: int = 100, max_length: float = 130):
+        self.outfile = outfile
+        self.rows, self.cols = grid
+        self.roi = roi
+        self.flush_every = flush_every
+        self.max_length = max_length
+        # Only look at the mask/frame if we still have to find the ROI
+        self.optional_inputs = ('tracks',) if roi is not None else ('tracks', 'mask', 'current_frame')
+
+        self.counts = np.zeros(self.rows * self.cols, dtype=np.int64)
+        self.sums = np.zeros(self.rows * self.cols, dtype=np.float64)
+        self.frames_seen = 0
+        self.last_frame_number = None
+
+    def _find_roi(self, context: dict):
+        mask = context.get('mask')
+        if mask is not None:
+            x, y, w, h = cv2.boundingRect(mask)
+            if w > 0 and h > 0:
+                self.roi = (x, y, w, h)
+                return
+        frame = context.get('current_frame')
+        if frame is not None:
+            self.roi = (0, 0, frame.shape[1], frame.shape[0])
+
+    def process(self, context: dict) -> dict:
+        if self.roi is None:
+            self._find_roi(context)
+        self.last_frame_number = context['frame_number']
+        self.frames_seen += 1
+
+        tracks = context.get('tracks')
+        if tracks is not None and self.roi is not None and len(tracks[0]) > 0:
+            old, new = (np.asarray(points, dtype=np.float32).reshape(-1, 2) for points in tracks)
+            lengths = np.hypot(*(new - old).T)
+            x, y, w, h = self.roi
+            # floor, not a plain cast, so points just left of/above the ROI (-1 < cell < 0) aren't put in cell 0
+            col = np.floor((new[:, 0] - x) * (self.cols / w)).astype(np.int64)
+            row = np.floor((new[:, 1] - y) * (self.rows / h)).astype(np.int64)
+            keep = (lengths <= self.max_length) & (col >= 0) & (col < self.cols) & (row >= 0) & (row < self.rows)
+            cells = row[keep] * self.cols + col[keep]
+            self.counts += np.bincount(cells, minlength=self.counts.size)
+            self.sums += np.bincount(cells, weights=lengths[keep], minlength=self.sums.size)
+
+        if self.frames_seen % self.flush_every == 0:
+            self.flush()
+        return context
+
+    def flush(self):
+        """ Appends a snapshot of the totals so far to the output file """
+        if self.roi is None or self.last_frame_number is None:
+            return
+        with open(self.outfile, 'ab') as f:
+            if f.tell() == 0:
+                f.write(HEATMAP_MAGIC + np.array([self.rows, self.cols, *self.roi], dtype='<i4').tobytes())
+            f.write(np.array(self.last_frame_number, dtype='<i8').tobytes())
+            f.write(self.counts.astype('<u4').tobytes())
+            f.write(self.sums.astype('<f4').tobytes())
+
+    def close(self):
+        if self.frames_seen % self.flush_every != 0:
+            self.flush()
+
+    def get_state(self):
+        offset = os.path.getsize(self.outfile) if os.path.exists(self.outfile) else 0
+        return {'counts': self.counts.copy(), 'sums': self.sums.copy(), 'roi': self.roi,
+                'frames_seen': self.frames_seen, 'last_frame_number': self.last_frame_number, 'offset': offset}
+
+    def set_state(self, state):
+        self.counts = state['counts'].copy()
+        self.sums = state['sums'].copy()
+        self.roi = state['roi']
+        self.frames_seen = state['frames_seen']
+        self.last_frame_number = state['last_frame_number']
+        if os.path.exists(self.outfile):
+            with open(self.outfile, 'r+b') as f:
+                f.truncate(state['offset'])
+
+
+def read_heatmaps(path: str):
+    """
+    Reads a file written by ActivityHeatmap.
+    Returns (frame numbers (N,), counts (N, rows, cols), sums of lengths (N, rows, cols), roi).
+    The average movement per vector in a cell is sums / counts.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(HEATMAP_MAGIC)) != HEATMAP_MAGIC:
+            raise ValueError(f"{path} is not a heatmap file")
+        rows, cols, x, y, w, h = np.frombuffer(f.read(6 * 4), dtype='<i4')
+        record = np.dtype([('frame_number', '<i8'), ('counts', '<u4', (rows, cols)), ('sums', '<f4', (rows, cols))])
+        data = np.frombuffer(f.read(), dtype=record)
+    return data['frame_number'], data['counts'], data['sums'], (int(x), int(y), int(w), int(h))
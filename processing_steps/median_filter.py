@@ -19,11 +19,16 @@ class MedianFilter(ProcessingStep):
     - 'current_image': The filtered image, which overwrites the current
                             in the context.
     """
+    inputs = ('current_frame',)
+    outputs = ('current_frame',)
+
     def __init__(self, kernel_size: int = 5):
         # Ensure the kernel size is an odd number
         if kernel_size % 2 == 0:
             raise ValueError("kernel_size must be an odd integer.")
         self.kernel_size = kernel_size
+        # The filter looks kernel_size // 2 rows up and down, which is what a tile needs around it
+        self.tile_halo = kernel_size // 2
 
     def process(self, context: dict) -> dict:
         print("Applying Median Filter...")
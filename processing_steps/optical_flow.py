@@ -1,4 +1,5 @@
 from .pipeline import ProcessingStep
+from .feature_detectors import FeatureDetector
 import numpy as np
 import cv2
 
@@ -9,21 +10,39 @@ class OpticalFlowCalculator(ProcessingStep):
 
     Initialized Values:
         minimum feature quality (defines the minimum acceptable quality of feature matches),
-        feature_threshold (the number of features that we want. The algorithm will try to continue tracking the same
-            features throughout the process, but gets rid of bad ones. If the total number of tracked features falls
-            below this value, it will trigger another full feature search).
+        feature_threshold (None (default) -> a full feature search every frame, like it always did. Set it to
+            carry the tracked points over to the next frame instead, with a new search only once fewer than this
+            many are left (0 -> only once every point is lost). Carrying points over is quicker but changes the
+            tracks, so it's only on when a config (or autotune.py) asks for it),
+        detector (which detector finds the points: 'shi-tomasi' (default), 'fast', 'agast' or 'orb', or a
+            FeatureDetector for full control. See feature_detectors.py),
+        grid (optional (rows, columns). Caps the points per cell so they are spread over the whole tank
+            instead of bunching up on the rim),
+        max_features (total number of points to look for).
 
     Input: Previous image @ self.prev_gray, current image @ context['current_frame'], previous points @ self.prev_points,
+        optionally a mask of where things are moving @ context['motion_mask'] (from BackgroundMotionMask). If it is
+        there, features are only looked for inside it, so LK only tracks points on moving fish.
     Output: (Old, New) lists of matching point pairs. (Old[i], New[i]) are matched point pairs.
         Found @ context['tracks']
     """
-    def __init__(self, min_feature_quality: float, feature_threshold: int = 100):
+    inputs = ('current_frame',)
+    optional_inputs = ('motion_mask',)
+    outputs = ('tracks',)
+
+    def __init__(self, min_feature_quality: float, feature_threshold=None, detector='shi-tomasi',
+                 grid=None, max_features: int = 500):
         self.prev_gray = None
         self.prev_features = None  # <-- RENAMED for clarity
 
         # Hyperparameters
         self.min_feature_quality = min_feature_quality
         self.feature_threshold = feature_threshold  # <-- NEW: Min points before re-detection
+        if isinstance(detector, str):
+            # min_feature_quality is the Shi-Tomasi quality level, the other detectors use their own default
+            detector = FeatureDetector(detector, max_features=max_features, min_distance=15, grid=grid,
+                                       quality=min_feature_quality if detector == 'shi-tomasi' else None)
+        self.detector = detector
 
         # LK parameters, most of these should stay at these values (but we can think about changing them if necessary)
         self.lk_params = dict(winSize=(15, 15),
@@ -34,19 +53,16 @@ class OpticalFlowCalculator(ProcessingStep):
         current_gray = context.get('current_frame')
         if current_gray is None:
             return context
+        motion_mask = context.get('motion_mask')
         if self.prev_gray is None:
             # Find initial features in the first frame
-            self.prev_features = cv2.goodFeaturesToTrack(
-                current_gray,
-                maxCorners=500,
-                qualityLevel=self.min_feature_quality,
-                minDistance=15
-            )
+            self.prev_features = self._detect(current_gray, motion_mask)
             # Store the current frame as the 'previous' for the next iteration
             self.prev_gray = current_gray
             return context
 
         # SUBSEQUENT FRAMES: We have a previous frame and points, so we can track.
+        good_new = None
         if self.prev_features is not None:
             # Ensure points are float32, a common requirement for this function
             p0 = self.prev_features.astype(np.float32)
@@ -65,16 +81,31 @@ class OpticalFlowCalculator(ProcessingStep):
                 good_new = new_points[status == 1]
                 good_old = p0[status == 1]  # <-- CORRECTED: Use the points we tracked FROM
                 context['tracks'] = (good_old, good_new)
+        elif motion_mask is not None:
+            # Nothing was moving in the previous frame, which means no movement (rather than no data)
+            context['tracks'] = (np.empty((0, 2), np.float32), np.empty((0, 2), np.float32))
 
-        self.prev_features = cv2.goodFeaturesToTrack(
-            current_gray,
-            maxCorners=500,
-            qualityLevel=self.min_feature_quality,
-            minDistance=15
-        )
+        # With a feature_threshold, keep following the same points while there are enough of them, and only
+        # look for new ones once fewer are left. With a motion mask, the points are looked for again every
+        # frame, since they should be on whatever is moving now.
+        carry_over = self.feature_threshold is not None and motion_mask is None
+        if carry_over and good_new is not None and len(good_new) > 0 and len(good_new) >= self.feature_threshold:
+            self.prev_features = good_new.reshape(-1, 1, 2)
+        else:
+            self.prev_features = self._detect(current_gray, motion_mask)
 
         # Remember the current frame for the next iteration
         self.prev_gray = current_gray
 
         return context
 
+    def _detect(self, gray, mask=None):
+        """ Finds the features to track in the next frame (None if there aren't any) """
+        return self.detector.detect(gray, mask)
+
+    def get_state(self):
+        return {'prev_gray': self.prev_gray, 'prev_features': self.prev_features}
+
+    def set_state(self, state):
+        self.prev_gray = state['prev_gray']
+        self.prev_features = state['prev_features']
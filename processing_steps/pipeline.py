@@ -1,11 +1,38 @@
+import os
+import pickle
+import time
 from abc import abstractmethod, ABC
 
+# The context items that the runners (main.run_main etc.) put in for every frame
+FRAME_KEYS = ('original_frame', 'current_frame', 'frame_number')
+
 
 class ProcessingStep(ABC):
     """
     Inherit from the class, such as MyClass(ProcessingStep) and then override the process(self, context)
     method to be able to add your class to the pipeline.
+
+    Steps can also declare which context items they use, which lets the Pipeline check that every step
+    gets what it needs, skip steps whose results nobody uses, and drop big arrays as soon as they aren't
+    needed anymore:
+        inputs -> context keys the step needs
+        optional_inputs -> context keys the step uses if they are there
+        outputs -> context keys the step (may) write
+        is_sink -> True if the step does something outside the context (writes a file, shows a window),
+            so it always has to run
+    Leave inputs/outputs as None if you don't want to declare them (the pipeline then just runs everything).
+
+    tile_halo -> set this if the step works pixel by pixel, so TiledStep can split the frame into horizontal
+        bands and run them in parallel: 0 if each output pixel only depends on the same input pixel, or the
+        number of extra rows above/below a pixel it looks at (e.g. kernel_size // 2 for a median filter).
+        None (the default) means the step can't be split.
     """
+    inputs = None
+    optional_inputs = ()
+    outputs = None
+    is_sink = False
+    tile_halo = None
+
     @abstractmethod
     def process(self, context: dict) -> dict:
         """
@@ -16,6 +43,29 @@ class ProcessingStep(ABC):
         """
         pass
 
+    def close(self):
+        """
+        Called once after the last frame (by Pipeline.close()). Override this if the step needs to
+        flush or close something, like an output file or a background thread.
+        """
+        pass
+
+    def get_state(self):
+        """
+        Returns whatever the step needs to carry on where it left off (saved in checkpoints, so it has to
+        be picklable), or None if the step doesn't keep anything between frames.
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        Restores the state returned by get_state() when resuming from a checkpoint.
+        """
+        pass
+
+    def declared(self) -> bool:
+        return self.inputs is not None and self.outputs is not None
+
 
 class Pipeline:
     """
@@ -24,17 +74,165 @@ class Pipeline:
     pass it into the pipeline.run(context) method. Each input context should correspond to one
     frame/image, and then the pipeline will run the entire pipeline on the one image (before
     continuing to the next image).
+
+    If every step declares its inputs/outputs, the pipeline also:
+        - raises a ValueError right away if a step needs a context item that nothing provides
+        - skips steps whose outputs are never used by a sink step (or listed in keep)
+        - removes context items once the last step that uses them has run, so e.g. the original
+          frame is freed straight away when there is no Visualize step
+    keep -> context items that should still be in the context returned by run()
+    prune -> set to False to always run every step and keep every context item
+    initial_keys -> context items that the caller puts in before running
+
+    Checkpoints: with checkpoint_path and checkpoint_every=N, run() saves the state of every step (see
+    ProcessingStep.get_state) plus the frame number every N frames, so a crashed run can be picked up with
+    load_checkpoint(). Steps that write files save how far into the file they got, and cut it back to that
+    on resume, so no rows are written twice or missed. Other objects with get_state/set_state (e.g. an
+    AdaptiveFrameSampler) can be added to self.also_checkpoint.
+
+    Timing: if self.step_timer is set to a function, run() calls it with (step index, seconds) after every
+    step (see metrics.py).
     """
-    def __init__(self, steps: list[ProcessingStep]):
+    def __init__(self, steps: list[ProcessingStep], keep=(), prune: bool = True, initial_keys=FRAME_KEYS,
+                 checkpoint_path: str = None, checkpoint_every: int = 0):
         """
         Saves the input list of processing steps.
         """
         self.steps = steps
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.also_checkpoint = []
+        self.frames_run = 0
+        # Steps in here are skipped by run() (e.g. expensive steps turned off when running behind)
+        self.disabled = set()
+        self.step_timer = None
+        self.keep = set(keep)
+        self.initial_keys = set(initial_keys)
+        self._validate()
 
-    def run(self, context: dict) -> dict:
+        # Indexes of steps that don't need to run, and context keys to delete after each step index
+        # (index -1 means before the first step)
+        self.unused = set()
+        self.release_after = {}
+        self.planned = prune and all(step.declared() for step in self.steps)
+        if self.planned:
+            self._plan()
+
+    def _validate(self):
         """
-        Runs the data through all registered steps.
+        Checks that each step's inputs are either given by the caller or written by an earlier step.
         """
+        available = set(self.initial_keys)
         for step in self.steps:
-            context = step.process(context)
+            if not step.declared():
+                # This step could write anything, so we can't say what's missing after it
+                return
+            missing = [key for key in step.inputs if key not in available]
+            if missing:
+                raise ValueError(f"{type(step).__name__} needs {missing} in the context, "
+                                 f"but no earlier step provides it (have {sorted(available)})")
+            available.update(step.outputs)
+
+    def _plan(self):
+        """
+        Walks backwards from the sinks to find which steps are needed and when each context item is last used.
+        """
+        needed = set(self.keep)
+        for i in reversed(range(len(self.steps))):
+            step = self.steps[i]
+            if step.is_sink or needed.intersection(step.outputs):
+                needed.update(step.inputs)
+                needed.update(step.optional_inputs)
+            else:
+                self.unused.add(i)
+
+        last_use = {key: -1 for key in self.initial_keys}
+        for i, step in enumerate(self.steps):
+            if i in self.unused:
+                continue
+            for key in (*step.inputs, *step.optional_inputs, *step.outputs):
+                last_use[key] = i
+        for key, i in last_use.items():
+            if key not in self.keep:
+                self.release_after.setdefault(i, []).append(key)
+
+    def needs(self, key: str) -> bool:
+        """
+        Whether any step that will run uses this context item (True if we can't tell).
+        """
+        if not self.planned or key in self.keep:
+            return True
+        return any(key in step.inputs or key in step.optional_inputs
+                   for i, step in enumerate(self.steps) if i not in self.unused)
+
+    def save_checkpoint(self, frame_number: int, path: str = None):
+        """
+        Saves the state of the steps after frame_number. Written to a temporary file first, so a crash
+        while saving leaves the previous checkpoint intact.
+        """
+        path = path or self.checkpoint_path
+        state = {
+            'frame_number': frame_number,
+            'steps': [step.get_state() for step in self.steps],
+            'also': [thing.get_state() for thing in self.also_checkpoint],
+        }
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    def load_checkpoint(self, path: str = None):
+        """
+        Restores the steps from a checkpoint. Returns the frame number the checkpoint was saved after
+        (the run should carry on from the next frame), or None if there is no checkpoint.
+        """
+        path = path or self.checkpoint_path
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if len(state['steps']) != len(self.steps) or len(state['also']) != len(self.also_checkpoint):
+            raise ValueError(f"Checkpoint {path} was made with a different pipeline.")
+        for thing, thing_state in zip([*self.steps, *self.also_checkpoint], [*state['steps'], *state['also']]):
+            if thing_state is not None:
+                thing.set_state(thing_state)
+        return state['frame_number']
+
+    def run(self, context: dict) -> dict:
+        """
+        Runs the data through all registered steps (except disabled/unused ones).
+        """
+        frame_number = context.get('frame_number')
+        context = self.run_steps(context)
+        self.frames_run += 1
+        if self.checkpoint_path and self.checkpoint_every and self.frames_run % self.checkpoint_every == 0:
+            self.save_checkpoint(frame_number)
         return context
+
+    def run_steps(self, context: dict, first: int = 0, last: int = None) -> dict:
+        """
+        Runs only steps first to last - 1 (all of them by default), without counting the frame or saving
+        checkpoints. StagedPipeline uses this to run one stage.
+        """
+        if first == 0:
+            for key in self.release_after.get(-1, ()):
+                context.pop(key, None)
+        for i in range(first, len(self.steps) if last is None else last):
+            step = self.steps[i]
+            if i not in self.unused and step not in self.disabled:
+                if self.step_timer is None:
+                    context = step.process(context)
+                else:
+                    start = time.perf_counter()
+                    context = step.process(context)
+                    self.step_timer(i, time.perf_counter() - start)
+            # Released even if the step is disabled, it may have been the last one to use them
+            for key in self.release_after.get(i, ()):
+                context.pop(key, None)
+        return context
+
+    def close(self):
+        """
+        Lets every step clean up after the last frame.
+        """
+        for step in self.steps:
+            step.close()
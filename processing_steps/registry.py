@@ -0,0 +1,111 @@
+import json
+import os
+
+'''
+ PIPELINES FROM CONFIGS: build a pipeline from plain data (e.g. a JSON file) instead of Python code, so
+ batch runners and worker processes only import the steps they actually use.
+
+ A config is a list of steps. Each step is either
+    {"step": "CircleCrop", "center": [-50, -30], "r": 470}   (name plus its keyword arguments), or
+    ["CircleCrop", {"center": [-50, -30], "r": 470}]           (the same, as a [name, kwargs] pair), or
+    "GrayscaleConverter"                                       (no arguments).
+ A keyword argument that is itself a step (like TiledStep's step) is written as a {"step": ...} object or
+ a [name, kwargs] pair, e.g.  ["TiledStep", {"step": {"step": "MedianFilter"}, "bands": 4}]
+
+    steps = build_steps(load_config('pipeline.json'))
+    run_main(steps)
+
+ Tools that need the standard pipeline (or just its preprocessing) use default_config() instead of keeping
+ their own copy of it, e.g.  build_steps(default_config(until='OpticalFlowCalculator'))
+'''
+
+# The standard pipeline (the same as main.py's), next to the processing_steps folder
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pipeline.json')
+
+
+def step_class(name: str):
+    """ The class registered under name, importing its module if this is the first time it's used """
+    from . import _STEP_MODULES, _load
+    if name not in _STEP_MODULES:
+        raise ValueError(f"Unknown step {name!r}. Known steps: {', '.join(sorted(_STEP_MODULES))}")
+    return _load(name)
+
+
+def split_spec(spec):
+    """ Returns (name, kwargs) for any of the ways a step can be written in a config """
+    if isinstance(spec, str):
+        return spec, {}
+    if isinstance(spec, dict):
+        kwargs = dict(spec)
+        if 'step' not in kwargs or not isinstance(kwargs['step'], str):
+            raise ValueError(f"Step config {spec!r} needs a 'step' name.")
+        return kwargs.pop('step'), kwargs
+    if isinstance(spec, (list, tuple)) and len(spec) == 2 and isinstance(spec[0], str):
+        return spec[0], dict(spec[1])
+    raise ValueError(f"Can't read step config {spec!r}.")
+
+
+def is_step_spec(value) -> bool:
+    from . import _STEP_MODULES
+    if isinstance(value, dict):
+        return isinstance(value.get('step'), str)
+    return isinstance(value, (list, tuple)) and len(value) == 2 and value[0] in _STEP_MODULES \
+        and isinstance(value[1], dict)
+
+
+def build_step(spec):
+    """ Makes one step object from its config """
+    name, kwargs = split_spec(spec)
+    kwargs = {key: build_step(value) if is_step_spec(value) else value for key, value in kwargs.items()}
+    return step_class(name)(**kwargs)
+
+
+def build_steps(config) -> list:
+    """ Makes the list of step objects described by config (a list of step configs) """
+    return [build_step(spec) for spec in config]
+
+
+def build_pipeline(config, **pipeline_kwargs):
+    """ build_steps, wrapped in a Pipeline (pipeline_kwargs go to Pipeline, e.g. keep=('mask',)) """
+    from .pipeline import Pipeline
+    return Pipeline(build_steps(config), **pipeline_kwargs)
+
+
+def load_config(path: str) -> list:
+    """
+    Reads a pipeline config from a JSON file. The file is either the list of steps, or an object with the
+    list under "steps" (so other settings, like the stride, can live in the same file).
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if isinstance(config, dict):
+        if 'steps' not in config:
+            raise ValueError(f"{path} has no 'steps' list.")
+        config = config['steps']
+    return config
+
+
+def default_config(until: str = None, start: str = None) -> list:
+    """
+    The steps of pipeline.json, as {"step": name, ...} dicts. With until (a step name), only the steps
+    before the first one with that name, e.g. until='OpticalFlowCalculator' for just the preprocessing.
+    With start, only the steps from the first one with that name on (start='OpticalFlowCalculator' -> the rest).
+    """
+    config = [dict(step=name, **kwargs) for name, kwargs in map(split_spec, load_config(DEFAULT_CONFIG))]
+    names = [spec['step'] for spec in config]
+    if until is not None and until in names:
+        config, names = config[:names.index(until)], names[:names.index(until)]
+    if start is not None and start in names:
+        config = config[names.index(start):]
+    return config
+
+
+def preprocess_steps() -> list:
+    """ The steps of pipeline.json before the optical flow, built (the preprocessing the tools run first) """
+    return build_steps(default_config(until='OpticalFlowCalculator'))
+
+
+def set_kwargs(config, name: str, **kwargs) -> list:
+    """ A copy of config with kwargs set on every step called name (e.g. a different GraphData outfile) """
+    return [dict(spec, **kwargs) if spec['step'] == name else spec
+            for spec in (dict(step=step, **step_kwargs) for step, step_kwargs in map(split_spec, config))]
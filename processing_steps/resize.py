@@ -0,0 +1,42 @@
+import cv2
+from .pipeline import ProcessingStep
+
+
+class Resize(ProcessingStep):
+    """
+    Shrinks (or grows) the frame and mask so the steps after it work at a lower resolution. Steps that take
+    positions in pixels (CircleCrop, CropLine, kernel sizes) then need them scaled by the same amount, which
+    autotune.py does for the configs it writes. context['scale'] says how much smaller things are than the
+    original frame, so GraphData can still report vector lengths in full size pixels.
+
+    Initialized Values:
+        scale (0.5 = half the width and height).
+
+    Context Input: context['current_frame'], optionally context['mask'] and context['scale'] (from an earlier Resize)
+    Context Output: context['current_frame'], context['mask'] (if there was one), context['scale']
+    """
+    inputs = ('current_frame',)
+    optional_inputs = ('mask', 'scale')
+    outputs = ('current_frame', 'mask', 'scale')
+
+    def __init__(self, scale: float = 0.5):
+        if scale <= 0:
+            raise ValueError("Resize scale has to be more than 0.")
+        self.scale = scale
+
+    def process(self, context: dict) -> dict:
+        frame = context.get('current_frame')
+        if frame is None:
+            return context
+        context['scale'] = context.get('scale', 1.0) * self.scale
+        if self.scale == 1:
+            return context
+        # INTER_AREA averages the pixels when shrinking (no aliasing), but is slow for growing
+        interpolation = cv2.INTER_AREA if self.scale < 1 else cv2.INTER_LINEAR
+        context['current_frame'] = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=interpolation)
+        mask = context.get('mask')
+        if mask is not None:
+            # Nearest neighbour, so the mask stays 0/255
+            context['mask'] = cv2.resize(mask, (context['current_frame'].shape[1], context['current_frame'].shape[0]),
+                                         interpolation=cv2.INTER_NEAREST)
+        return context
@@ -1,18 +1,36 @@
 from .pipeline import ProcessingStep
+from .frame_writer import BackgroundFrameWriter
 import cv2
 import sys
-# Masking B/W image! 
+# Masking B/W image!
 class ShowCurrentImage(ProcessingStep):
     """
     Just shows what the "current_image" context item looks like when this gets
     executed. Press any key to close the window and continue execution.
+
+    If an outfile (video file or folder) is given, nothing is shown: the frames are
+    saved there by a background thread instead (see BackgroundFrameWriter).
     """
+    inputs = ('current_frame',)
+    optional_inputs = ('frame_number',)
+    outputs = ()
+    is_sink = True
+
+    def __init__(self, outfile=None, fps: float = 30, queue_size: int = 8):
+        self.writer = None
+        if outfile is not None:
+            self.writer = BackgroundFrameWriter(outfile, fps, queue_size)
+
     def process(self, context: dict) -> dict:
-        print("In Current Image")
         frame = context.get('current_frame')
         if frame is None:
             return context
+        if self.writer is not None:
+            # The writer thread holds on to the frame, so give it a copy that later steps can't change
+            self.writer.write(frame.copy(), context.get('frame_number', 0))
+            return context
 
+        print("In Current Image")
         # --- 2. Display, wait, and destroy ---
         window_name = 'Debug Show'
 
@@ -27,3 +45,7 @@ class ShowCurrentImage(ProcessingStep):
         if key == ord('q') or key == 27:  # 27 = ESC
             sys.exit()
         return context
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
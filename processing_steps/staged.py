@@ -0,0 +1,238 @@
+import queue
+import threading
+import time
+from collections import deque
+from .pipeline import Pipeline
+
+# Put through the queues after the last frame
+_DONE = object()
+
+
+def balance_stages(step_seconds, stages: int) -> list:
+    """
+    Splits steps that took step_seconds (per step, e.g. StagedPipeline.step_seconds) into at most `stages`
+    groups of neighbouring steps so the slowest group is as fast as possible. Returns the number of steps
+    in each group.
+    """
+    n = len(step_seconds)
+    stages = max(1, min(stages, n))
+    prefix = [0.0]
+    for seconds in step_seconds:
+        prefix.append(prefix[-1] + seconds)
+    # best[k][i] -> slowest group when the first i steps are split into k groups, cut[k][i] -> where the last one starts
+    best = [[float('inf')] * (n + 1) for _ in range(stages + 1)]
+    cut = [[0] * (n + 1) for _ in range(stages + 1)]
+    best[0][0] = 0.0
+    for k in range(1, stages + 1):
+        for i in range(1, n + 1):
+            for j in range(k - 1, i):
+                slowest = max(best[k - 1][j], prefix[i] - prefix[j])
+                if slowest < best[k][i]:
+                    best[k][i], cut[k][i] = slowest, j
+    # Fewer groups can be just as good (e.g. one step takes all the time), so take the fewest that are
+    k = min(range(1, stages + 1), key=lambda k: (best[k][n], k))
+    sizes = []
+    i = n
+    while k > 0:
+        j = cut[k][i]
+        sizes.append(i - j)
+        i, k = j, k - 1
+    return sizes[::-1]
+
+
+class StagedPipeline:
+    """
+    Runs a Pipeline as an assembly line: the steps are split into stages of neighbouring steps, each stage
+    runs in its own thread, and the stages are joined by small queues. So while e.g. OpticalFlowCalculator
+    works on frame N, the crop/segmentation/grayscale steps can already be working on frame N+1.
+    OpenCV lets go of the GIL while it works, so the stages really do overlap.
+
+    Every stage is one thread taking frames from a first-in-first-out queue, so every step still sees the
+    frames one at a time and in order (steps that remember the previous frame, like OpticalFlowCalculator
+    and GraphData, work the same as in Pipeline.run). Frames also come out in the order they went in.
+
+    pipeline -> a Pipeline, or a list of steps
+    stages -> number of stages (the steps that run are split evenly by count), or a list with the number of
+        steps in each stage, e.g. [6, 2]
+    queue_size -> frames that can wait between two stages. When a stage is full, put() waits, so a slow
+        stage holds everything before it back instead of frames piling up in memory.
+
+        staged = StagedPipeline(pipeline_steps, stages=[6, 2])
+        for context in contexts:
+            staged.put(context)
+            for done in staged.done():
+                ...
+        for done in staged.finish():
+            ...
+        staged.print_report()  # how busy each stage was, and a better split
+
+    Checkpoints aren't supported (when a checkpoint is due, the early stages are already on later frames, so
+    the step states wouldn't belong to the same frame).
+    """
+    def __init__(self, pipeline, stages=2, queue_size: int = 4):
+        self.pipeline = pipeline if isinstance(pipeline, Pipeline) else Pipeline(pipeline)
+        if self.pipeline.checkpoint_path and self.pipeline.checkpoint_every:
+            raise ValueError("StagedPipeline can't save checkpoints, run it without a checkpoint_path.")
+        steps = self.pipeline.steps
+        if isinstance(stages, int):
+            running = [i for i in range(len(steps)) if i not in self.pipeline.unused]
+            groups = [running[len(running) * k // stages:len(running) * (k + 1) // stages] for k in range(stages)]
+            # Steps that don't run go along with the stage that runs the step after them
+            cuts = [0] + [group[0] for group in groups[1:] if group] + [len(steps)]
+            sizes = [b - a for a, b in zip(cuts, cuts[1:])]
+        else:
+            sizes = list(stages)
+        if sum(sizes) != len(steps) or any(size < 1 for size in sizes):
+            raise ValueError(f"Stage sizes {sizes} don't split the {len(steps)} steps.")
+        self.bounds = []
+        first = 0
+        for size in sizes:
+            self.bounds.append((first, first + size))
+            first += size
+
+        # Time spent in each step (each step is only timed by its own stage's thread), chained in front of
+        # any step_timer already set (e.g. by PipelineMetrics.attach)
+        self.step_seconds = [0.0] * len(steps)
+        self._outer_timer = self.pipeline.step_timer
+        self.pipeline.step_timer = self._step_done
+        # Called with the seconds from put() to the frame coming out, if set
+        self.frame_timer = None
+
+        n = len(self.bounds)
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(n)]
+        # Unbounded, so the last stage never waits on the caller (done() is only called between put()s)
+        self.output = queue.Queue()
+        self.busy = [0.0] * n
+        self.waiting = [0.0] * n
+        self.blocked = [0.0] * n
+        self.frames = [0] * n
+        self.error = None
+        self._put_times = deque()
+        self._started = None
+        self._finished = None
+        self._threads = [threading.Thread(target=self._stage_loop, args=(k,), daemon=True,
+                                          name=f'stage-{k}') for k in range(n)]
+        for thread in self._threads:
+            thread.start()
+
+    def _step_done(self, index: int, seconds: float):
+        self.step_seconds[index] += seconds
+        if self._outer_timer is not None:
+            self._outer_timer(index, seconds)
+
+    def _stage_loop(self, k: int):
+        first, last = self.bounds[k]
+        inbox = self.queues[k]
+        outbox = self.queues[k + 1] if k + 1 < len(self.queues) else self.output
+        while True:
+            start = time.perf_counter()
+            context = inbox.get()
+            got = time.perf_counter()
+            self.waiting[k] += got - start
+            if context is _DONE:
+                outbox.put(_DONE)
+                return
+            if self.error is not None:
+                # Something downstream (or here) failed, just keep the queues moving so put() can't hang
+                continue
+            try:
+                context = self.pipeline.run_steps(context, first, last)
+            except BaseException as error:
+                self.error = error
+                continue
+            ran = time.perf_counter()
+            self.busy[k] += ran - got
+            self.frames[k] += 1
+            if outbox is self.output:
+                self.pipeline.frames_run += 1
+            outbox.put(context)
+            self.blocked[k] += time.perf_counter() - ran
+
+    def put(self, context: dict):
+        """ Sends a frame's context into the first stage (waits if the first stage is full) """
+        if self.error is not None:
+            raise self.error
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._put_times.append(time.perf_counter())
+        self.queues[0].put(context)
+
+    def _take(self, context):
+        seconds = time.perf_counter() - self._put_times.popleft()
+        if self.frame_timer is not None:
+            self.frame_timer(seconds)
+        return context
+
+    def done(self) -> list:
+        """ The contexts of the frames that have made it through every stage since the last call, in order """
+        if self.error is not None:
+            raise self.error
+        finished = []
+        while True:
+            try:
+                context = self.output.get_nowait()
+            except queue.Empty:
+                return finished
+            if context is _DONE:
+                # (only happens if done() is called after finish())
+                return finished
+            finished.append(self._take(context))
+
+    def finish(self) -> list:
+        """ Waits for every frame that was put in to come out, stops the threads, and returns the rest of the contexts """
+        self.queues[0].put(_DONE)
+        finished = []
+        while True:
+            context = self.output.get()
+            if context is _DONE:
+                break
+            finished.append(self._take(context))
+        for thread in self._threads:
+            thread.join()
+        self._finished = time.perf_counter()
+        self.pipeline.step_timer = self._outer_timer
+        if self.error is not None:
+            raise self.error
+        return finished
+
+    def close(self):
+        """ Lets every step clean up (call after finish()) """
+        self.pipeline.close()
+
+    def report(self) -> list:
+        """
+        Per stage: its steps, frames, and the fraction of the run it spent working ('utilization'), waiting
+        for the stage before it ('starved') and waiting for room in the stage after it ('blocked').
+        The stage with the highest utilization is the bottleneck.
+        """
+        end = self._finished or time.perf_counter()
+        wall = end - self._started if self._started is not None else 0.0
+        stages = []
+        for k, (first, last) in enumerate(self.bounds):
+            names = [type(step).__name__ for i, step in enumerate(self.pipeline.steps[first:last], first)
+                     if i not in self.pipeline.unused]
+            stages.append({
+                'stage': k,
+                'steps': names,
+                'frames': self.frames[k],
+                'ms_per_frame': 1000 * self.busy[k] / self.frames[k] if self.frames[k] else 0.0,
+                'utilization': self.busy[k] / wall if wall > 0 else 0.0,
+                'starved': self.waiting[k] / wall if wall > 0 else 0.0,
+                'blocked': self.blocked[k] / wall if wall > 0 else 0.0,
+            })
+        return stages
+
+    def suggest_stages(self, stages: int = None) -> list:
+        """ Stage sizes that would even out the measured step times (same number of stages by default) """
+        return balance_stages(self.step_seconds, stages or len(self.bounds))
+
+    def print_report(self):
+        stages = self.report()
+        bottleneck = max(stages, key=lambda stage: stage['utilization'])['stage'] if stages else None
+        for stage in stages:
+            marker = '  <- bottleneck' if stage['stage'] == bottleneck else ''
+            print(f"stage {stage['stage']} ({', '.join(stage['steps']) or 'nothing to run'}): "
+                  f"{stage['frames']} frames, {stage['ms_per_frame']:.1f} ms/frame, busy {stage['utilization']:.0%}, "
+                  f"starved {stage['starved']:.0%}, blocked {stage['blocked']:.0%}{marker}")
+        print(f"Stage sizes now {[last - first for first, last in self.bounds]}, "
+              f"balanced by the measured times: {self.suggest_stages()}")
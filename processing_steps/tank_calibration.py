@@ -0,0 +1,97 @@
+import json
+import os
+import time
+import cv2
+import numpy as np
+
+'''
+ TANK CALIBRATION: finds the tank (the big circle) in the frames with a Hough transform, so CircleCrop
+ doesn't need a hand-tuned center and radius. The result is saved per camera in a small JSON file:
+    {"center": [x, y], "r": r, "frame_size": [width, height], "rim_contrast": c, ...}
+ (center in pixels from the top left corner). rim_contrast is how different the pixels just inside and
+ just outside the circle are, which is a cheap way to check later that the circle still fits (if the camera
+ gets bumped, it drops).
+ Make one with calibrate_tank.py, or let CircleCrop(calibration=...) make it from the first frame it sees.
+'''
+
+
+def shrink_gray(frame, scale):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    if scale != 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def rim_contrast(gray, center, r, band: float = 0.05, points: int = 180) -> float:
+    """
+    Average absolute difference between the pixels just inside and just outside the circle (band is the
+    distance from the rim, as a fraction of r). Only the parts of the rim that are inside the frame count.
+    """
+    h, w = gray.shape[:2]
+    angles = np.linspace(0, 2 * np.pi, points, endpoint=False)
+    cos, sin = np.cos(angles), np.sin(angles)
+    xi, yi = (center[0] + r * (1 - band) * cos).astype(int), (center[1] + r * (1 - band) * sin).astype(int)
+    xo, yo = (center[0] + r * (1 + band) * cos).astype(int), (center[1] + r * (1 + band) * sin).astype(int)
+    inside = (xi >= 0) & (xi < w) & (yi >= 0) & (yi < h) & (xo >= 0) & (xo < w) & (yo >= 0) & (yo < h)
+    if not inside.any():
+        return 0.0
+    return float(np.abs(gray[yi[inside], xi[inside]].astype(np.float32)
+                        - gray[yo[inside], xo[inside]].astype(np.float32)).mean())
+
+
+def detect_tank_circle(frames, scale: float = 0.25, min_radius: float = 0.25, max_radius: float = 0.75):
+    """
+    Finds the tank circle in a few frames (BGR or grayscale). Each frame is shrunk by scale, blurred, and
+    searched for circles with a radius between min_radius and max_radius times the smaller side of the frame.
+    The strongest circle of each frame is taken, and the median over the frames is returned as
+    (center (x, y), r, rim contrast) in full size pixels, or None if no frame had a circle.
+    """
+    found = []
+    grays = []
+    for frame in frames:
+        gray = cv2.medianBlur(shrink_gray(frame, scale), 5)
+        grays.append(gray)
+        side = min(gray.shape[:2])
+        circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, dp=1, minDist=side, param1=100, param2=30,
+                                   minRadius=int(min_radius * side), maxRadius=int(max_radius * side))
+        if circles is not None:
+            found.append(circles[0][0])
+    if not found:
+        return None
+    x, y, r = np.median(np.array(found), axis=0) / scale
+    center = (int(round(x)), int(round(y)))
+    r = int(round(r))
+    contrast = float(np.median([rim_contrast(gray, (x * scale, y * scale), r * scale) for gray in grays]))
+    return center, r, contrast
+
+
+def save_calibration(path, center, r, frame_size, contrast, source=None):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    calibration = {'center': [int(center[0]), int(center[1])], 'r': int(r),
+                   'frame_size': [int(frame_size[0]), int(frame_size[1])], 'rim_contrast': round(contrast, 3),
+                   'source': source, 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(path, 'w') as f:
+        json.dump(calibration, f, indent=2)
+    return calibration
+
+
+def load_calibration(path, frame_size=None):
+    """
+    Reads a calibration file. If frame_size (width, height) is given and differs from the one it was made
+    at (e.g. the same camera recorded at a lower resolution), the circle is scaled to match.
+    Returns the calibration dict, with 'center' as a tuple.
+    """
+    with open(path) as f:
+        calibration = json.load(f)
+    center, r = calibration['center'], calibration['r']
+    if frame_size is not None and tuple(frame_size) != tuple(calibration['frame_size']):
+        sx = frame_size[0] / calibration['frame_size'][0]
+        sy = frame_size[1] / calibration['frame_size'][1]
+        center = (center[0] * sx, center[1] * sy)
+        r = r * (sx + sy) / 2
+        calibration['frame_size'] = list(frame_size)
+    calibration['center'] = (int(round(center[0])), int(round(center[1])))
+    calibration['r'] = int(round(r))
+    return calibration
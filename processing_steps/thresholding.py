@@ -18,6 +18,10 @@ class MidToneThresholdMask(ProcessingStep):
         'current_frame' (np.ndarray): The thresholded image, with original pixel
                                    values preserved in the mid-tone range.
     """
+    inputs = ('current_frame',)
+    optional_inputs = ('mask',)
+    outputs = ('mask',)
+    tile_halo = 0
 
     def __init__(self, low_threshold: int, high_threshold: int):
         if not 0 <= low_threshold < high_threshold <= 255:
@@ -0,0 +1,141 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from .pipeline import ProcessingStep
+
+# One pool shared by every TiledStep, so several tiled steps don't each start their own threads
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+# pool -> number of TiledStep.process calls using it right now. When a bigger pool is needed, the old one is
+# only shut down once nobody is using it (TiledSteps in other threads, e.g. StagedPipeline stages, may still
+# be submitting bands to it).
+_pool_users = {}
+
+
+def _acquire_pool(workers: int) -> ThreadPoolExecutor:
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size < workers:
+            old = _pool
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tile')
+            _pool_size = workers
+            if old is not None and not _pool_users.get(old):
+                _pool_users.pop(old, None)
+                old.shutdown(wait=False)
+        _pool_users[_pool] = _pool_users.get(_pool, 0) + 1
+        return _pool
+
+
+def _release_pool(pool: ThreadPoolExecutor):
+    with _pool_lock:
+        _pool_users[pool] -= 1
+        if pool is not _pool and _pool_users[pool] == 0:
+            del _pool_users[pool]
+            pool.shutdown(wait=False)
+
+
+class TiledStep(ProcessingStep):
+    """
+    Runs a pixel-by-pixel step (one with tile_halo set, e.g. MedianFilter, LabColorSegmentationMask,
+    ApplyMaskDenoised, CropLine, LinearContrastAdjuster) on horizontal bands of the frame in parallel
+    threads. OpenCV lets go of the GIL while it works, so the bands really do run at the same time.
+    Each band gets tile_halo extra rows above and below so neighborhood operations (median, opening)
+    give exactly the same result as on the whole frame, and every band writes its rows straight into
+    one shared output array.
+
+    While the bands run, OpenCV's own threading is turned down so that (our threads) x (OpenCV threads)
+    is about the number of cores, instead of every band trying to use every core.
+
+    Initialized parameters:
+        step -> the step to run on each band
+        bands -> number of bands (default: number of cores)
+        workers -> number of threads (default: number of cores)
+
+    Inputs/Outputs: the same as the wrapped step. Array outputs with one row per frame row are stitched
+        back together (every band has to return its full rows of them, otherwise a ValueError is raised),
+        other outputs (e.g. counters) from the bands are ignored.
+    """
+    def __init__(self, step: ProcessingStep, bands: int = None, workers: int = None):
+        if step.tile_halo is None:
+            raise ValueError(f"{type(step).__name__} can't be split into tiles (its tile_halo isn't set).")
+        self.step = step
+        self.workers = workers or os.cpu_count() or 1
+        self.bands = bands or self.workers
+        self.inputs = step.inputs
+        self.optional_inputs = step.optional_inputs
+        self.outputs = step.outputs
+        self.is_sink = step.is_sink
+        # OpenCV threads per band thread, so the two together don't oversubscribe the cores
+        self.cv_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._lock = threading.Lock()
+
+    def _run_band(self, context: dict, height: int, top: int, bottom: int, outputs: dict):
+        halo = self.step.tile_halo
+        band_top = max(0, top - halo)
+        band_bottom = min(height, bottom + halo)
+
+        # The band sees views into the full frame arrays (no copying), and everything else as is
+        sub_context = {}
+        for key, value in context.items():
+            if isinstance(value, np.ndarray) and value.ndim >= 2 and value.shape[0] == height:
+                value = value[band_top:band_bottom]
+            sub_context[key] = value
+        sub_context['tile_row'] = band_top
+        sub_context = self.step.process(sub_context)
+
+        for key in self.step.outputs or sub_context.keys():
+            value = sub_context.get(key)
+            if not isinstance(value, np.ndarray) or value.shape[0] != band_bottom - band_top:
+                continue
+            with self._lock:
+                if key not in outputs:
+                    outputs[key] = [np.empty((height,) + value.shape[1:], dtype=value.dtype), 0]
+                out = outputs[key][0]
+                if out.shape[1:] != value.shape[1:] or out.dtype != value.dtype:
+                    raise ValueError(f"{type(self.step).__name__} gave {key} a different shape/type in each band.")
+                # Count the bands that wrote it, so a band that didn't can't leave uninitialized rows behind
+                outputs[key][1] += 1
+            # Leave the halo rows out, the neighboring bands own those
+            out[top:bottom] = value[top - band_top:bottom - band_top]
+
+    def get_state(self):
+        return self.step.get_state()
+
+    def set_state(self, state):
+        self.step.set_state(state)
+
+    def close(self):
+        self.step.close()
+
+    def process(self, context: dict) -> dict:
+        frame = context.get('current_frame')
+        if frame is None:
+            return self.step.process(context)
+        height = frame.shape[0]
+        bands = min(self.bands, height)
+        edges = np.linspace(0, height, bands + 1).astype(int)
+
+        outputs = {}
+        previous_threads = cv2.getNumThreads()
+        if previous_threads != self.cv_threads:
+            cv2.setNumThreads(self.cv_threads)
+        pool = _acquire_pool(self.workers)
+        try:
+            futures = [pool.submit(self._run_band, context, height, edges[i], edges[i + 1], outputs)
+                       for i in range(bands)]
+            for future in futures:
+                future.result()
+        finally:
+            _release_pool(pool)
+            if previous_threads != self.cv_threads:
+                cv2.setNumThreads(previous_threads)
+
+        for key, (out, written) in outputs.items():
+            if written != bands:
+                raise ValueError(f"{type(self.step).__name__} only returned a full band of {key} for {written} "
+                                 f"of the {bands} bands.")
+            context[key] = out
+        return context
@@ -1,17 +1,33 @@
 from .pipeline import ProcessingStep
+from .frame_writer import BackgroundFrameWriter
 import numpy as np
 import cv2
 import sys
 
-# Optical Flow Distance Moved Image 
+# Optical Flow Distance Moved Image
 class Visualize(ProcessingStep):
+    inputs = ('frame_number', 'original_frame')
+    optional_inputs = ('tracks',)
+    outputs = ('visualized',)
+    is_sink = True
 
-    def __init__(self, freq):
+    def __init__(self, freq, outfile=None, fps: float = 30, queue_size: int = 8):
         self.frequency = freq
+        # Headless mode: write to a video/image folder on a background thread instead of showing a window
+        self.writer = None
+        if outfile is not None:
+            self.writer = BackgroundFrameWriter(outfile, fps, queue_size)
 
     """
     Step to visualize the LK optical flow (to get an idea of what we need to adjust).
 
+    Initialized Values:
+        freq (only draws frames whose frame number is a multiple of this),
+        outfile (optional. If given, nothing is shown and the drawn frames are saved to this video file
+            (.mp4/.avi/...) or folder of images by a background thread. Frames are dropped rather than
+            slowing down the pipeline if the writer falls behind),
+        fps, queue_size (output video frame rate and writer queue length, only used with outfile).
+
     Input:
         The original frame (to draw on) @ context['original_frame']
         The tracked Optical Flow point pairs @ context['tracks']
@@ -30,19 +46,20 @@ class Visualize(ProcessingStep):
         output_image = frame.copy()
         tracks = context.get('tracks')
 
-        if tracks is not None:
+        if tracks is not None and len(tracks[0]) > 0:
             good_old, good_new = tracks
-            # Loop and draw logic is identical
-            for i, (new, old) in enumerate(zip(good_new, good_old)):
-                # Flattens the points into a 1D array (in case they aren't already)
-                # Then, unpacks the point coordinates into a,b,c,d and makes them all int32 typed
-                a, b = new.ravel()
-                c, d = old.ravel()
-                a, b, c, d = np.int32(a), np.int32(b), np.int32(c), np.int32(d)
-
-                # Adds a line from the old point to the new point and a red point at the new
-                cv2.line(output_image, (c, d), (a, b), (0, 255, 0), 2)
-                cv2.circle(output_image, (a, b), 4, (0, 0, 255), -1)
+            # Draws all the vectors with one call each instead of looping over them:
+            # every (old, new) pair is a 2 point polyline, and every new point is a (new, new) polyline
+            # drawn 8 thick, which gives the same dot as a filled circle of radius 4
+            old = np.int32(good_old).reshape(-1, 1, 2)
+            new = np.int32(good_new).reshape(-1, 1, 2)
+            cv2.polylines(output_image, np.concatenate((old, new), axis=1), False, (0, 255, 0), 2)
+            cv2.polylines(output_image, np.concatenate((new, new), axis=1), False, (0, 0, 255), 8)
+
+        if self.writer is not None:
+            self.writer.write(output_image, context['frame_number'])
+            context['visualized'] = output_image
+            return context
 
         # --- 2. Display, wait, and destroy ---
         window_name = 'Debug Step: Optical Flow'
@@ -59,3 +76,7 @@ class Visualize(ProcessingStep):
         # --- 3. Update the context and return ---
         context['visualized'] = output_image
         return context
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
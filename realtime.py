@@ -0,0 +1,155 @@
+from __future__ import annotations
+import threading
+import time
+import cv2
+import numpy as np
+from processing_steps import Pipeline
+
+
+class LatestFrameReader:
+    """
+    Reads frames from a video source on a background thread and only ever keeps the newest one.
+    If the pipeline is slower than the camera, old frames are thrown away (and counted in
+    self.dropped) instead of piling up, so the lag never grows.
+
+    source -> a video file path or a camera index (e.g. 0 for the webcam)
+    pace -> if True, reads a video file at its own frame rate, as if it were a live camera.
+        Defaults to True for files and False for cameras (they are already real time).
+    """
+    def __init__(self, source=0, pace=None):
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video source {source!r}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.pace = isinstance(source, str) if pace is None else pace
+
+        self.captured = 0
+        self.dropped = 0
+        self.finished = False
+        self._frame = None  # (frame, frame number, capture time)
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _read_loop(self):
+        start = time.perf_counter()
+        while not self._stopped:
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            if self.pace:
+                # Wait until this frame would have arrived from a live camera
+                delay = start + self.captured / self.fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            with self._condition:
+                if self._frame is not None:
+                    self.dropped += 1
+                self._frame = (frame, self.captured, time.perf_counter())
+                self.captured += 1
+                self._condition.notify()
+        with self._condition:
+            self.finished = True
+            self._condition.notify()
+
+    def read(self):
+        """
+        Waits for and returns the newest (frame, frame number, capture time) that hasn't been read yet,
+        or None once the source has run out.
+        """
+        with self._condition:
+            while self._frame is None and not self.finished:
+                self._condition.wait()
+            item = self._frame
+            self._frame = None
+            return item
+
+    def release(self):
+        self._stopped = True
+        self._thread.join()
+        self.cap.release()
+
+
+def run_realtime(pipeline_steps, source=0, budget_ms: float = 100.0, optional_steps=(),
+                 overload_frames: int = 10, recover_frames: int = 30, report_every: int = 0):
+    """
+    Runs the pipeline in real time: always on the newest frame, dropping frames that went stale while
+    the previous one was being processed.
+
+    budget_ms -> latency budget per frame, from the frame arriving to the pipeline finishing
+    optional_steps -> steps (that are in pipeline_steps) that can be switched off when we can't keep up,
+        e.g. a MedianFilter or Visualize. They are switched off after overload_frames frames in a row over
+        budget, and back on after recover_frames frames in a row under half the budget.
+    report_every -> print the latency report every this many processed frames (0 to only print at the end)
+
+    Returns a dict with the frame counters and latency percentiles (in ms).
+    """
+    cv_pipeline = Pipeline(pipeline_steps)
+    keep_original = cv_pipeline.needs('original_frame')
+    reader = LatestFrameReader(source)
+    print(reader.fps)
+
+    latencies = []
+    processed = 0
+    over_budget = 0
+    under_budget = 0
+    degraded = False
+    try:
+        while True:
+            item = reader.read()
+            if item is None:
+                break
+            frame, frame_num, captured_at = item
+            process_context = {
+                'current_frame': frame,
+                'frame_number': frame_num
+            }
+            if keep_original:
+                process_context['original_frame'] = frame.copy()
+            cv_pipeline.run(process_context)
+            processed += 1
+
+            latency = (time.perf_counter() - captured_at) * 1000
+            latencies.append(latency)
+
+            # Only react to sustained overload, a single slow frame is not worth dropping steps for
+            if latency > budget_ms:
+                over_budget += 1
+                under_budget = 0
+            elif latency < budget_ms / 2:
+                under_budget += 1
+                over_budget = 0
+            else:
+                over_budget = under_budget = 0
+            if optional_steps and not degraded and over_budget >= overload_frames:
+                degraded = True
+                cv_pipeline.disabled.update(optional_steps)
+                print(f"Frame {frame_num}: over the {budget_ms} ms budget, turning off optional steps")
+            elif degraded and under_budget >= recover_frames:
+                degraded = False
+                cv_pipeline.disabled.difference_update(optional_steps)
+                print(f"Frame {frame_num}: back under budget, turning optional steps back on")
+
+            if report_every and processed % report_every == 0:
+                print(_latency_report(latencies, processed, reader))
+    finally:
+        reader.release()
+        cv_pipeline.close()
+
+    report = _latency_report(latencies, processed, reader)
+    print(report)
+    stats = {'captured': reader.captured, 'processed': processed, 'dropped': reader.dropped}
+    if latencies:
+        for p in (50, 90, 99):
+            stats[f'p{p}_ms'] = float(np.percentile(latencies, p))
+        stats['max_ms'] = max(latencies)
+    return stats
+
+
+def _latency_report(latencies, processed, reader) -> str:
+    if not latencies:
+        return "No frames processed"
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return (f"{processed} processed, {reader.dropped} dropped of {reader.captured} captured | "
+            f"latency ms p50 {p50:.1f}, p90 {p90:.1f}, p99 {p99:.1f}, max {max(latencies):.1f}")
@@ -0,0 +1,166 @@
+from __future__ import annotations
+import argparse
+import os
+import zlib
+import cv2
+import numpy as np
+
+'''
+ RANDOM ACCESS INTO VIDEOS: pull out frame N of a long video without decoding everything before it.
+
+ The first time a video is opened, one pass over it records every frame's timestamp, and then checks
+ a candidate seek point every `interval` frames: we seek there and compare the decoded frame against
+ the frame from the linear pass. Only the points where seeking lands on exactly the right frame are
+ kept. The index is saved next to the video (<video>.seekidx.npz) and rebuilt if the video changes.
+ After that, fetching a frame seeks to the nearest good point before it and decodes forward from there.
+
+    video = RandomAccessVideo('data/11_18-Vid11.mov')
+    for frame_num, frame in video.read_frames([120, 5000, 5003, 90000]): ...
+    for frame_num, frame in video.sample(20, seed=0): ...
+'''
+
+
+def _frame_hash(frame) -> int:
+    return zlib.crc32(np.ascontiguousarray(frame).data)
+
+
+def _video_signature(video_path: str) -> np.ndarray:
+    stat = os.stat(video_path)
+    return np.array([stat.st_size, int(stat.st_mtime)], dtype=np.int64)
+
+
+def build_seek_index(video_path: str, interval: int = 30, index_path: str = None) -> dict:
+    """
+    Makes (and saves to index_path, default <video>.seekidx.npz) the seek index of a video.
+    interval -> how many frames apart the candidate seek points are. Smaller means less decoding per
+        fetch but a slower index build.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+
+    timestamps = []
+    hashes = {}
+    frame_num = 0
+    while cap.grab():
+        # Timestamp (in ms) of the frame we just grabbed
+        timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+        if frame_num % interval == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                hashes[frame_num] = _frame_hash(frame)
+        frame_num += 1
+
+    # Frame 0 can always be reached by reopening the video, the others have to prove that seeking works
+    seek_points = [0]
+    for candidate in sorted(hashes):
+        if candidate == 0:
+            continue
+        cap.set(cv2.CAP_PROP_POS_FRAMES, candidate)
+        ret, frame = cap.read()
+        if ret and _frame_hash(frame) == hashes[candidate]:
+            seek_points.append(candidate)
+    cap.release()
+
+    index = {
+        'timestamps': np.array(timestamps, dtype=np.float64),
+        'seek_points': np.array(seek_points, dtype=np.int64),
+        'interval': np.int64(interval),
+        'signature': _video_signature(video_path),
+    }
+    np.savez(index_path or video_path + '.seekidx.npz', **index)
+    return index
+
+
+def load_seek_index(video_path: str, interval: int = 30, index_path: str = None) -> dict:
+    """ Loads the saved seek index, or builds it if there is none or the video has changed since. """
+    index_path = index_path or video_path + '.seekidx.npz'
+    if os.path.exists(index_path):
+        with np.load(index_path) as saved:
+            index = {key: saved[key] for key in saved.files}
+        if np.array_equal(index['signature'], _video_signature(video_path)) and index['interval'] == interval:
+            return index
+    return build_seek_index(video_path, interval, index_path)
+
+
+class RandomAccessVideo:
+    """
+    Fetches arbitrary frames of a video, decoding only from the nearest verified seek point before each
+    one (see build_seek_index). Asking for frames in increasing order is cheapest, read_frames sorts them.
+    self.decoded counts how many frames had to be decoded in total.
+    """
+    def __init__(self, video_path: str, interval: int = 30, index_path: str = None):
+        self.video_path = video_path
+        index = load_seek_index(video_path, interval, index_path)
+        self.timestamps = index['timestamps']
+        self.seek_points = index['seek_points']
+        self.frame_count = len(self.timestamps)
+        self.cap = cv2.VideoCapture(video_path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        # Frame number that the next grab() will give us
+        self.next_frame = 0
+        self.decoded = 0
+        self.seeks = 0
+
+    def timestamp(self, frame_number: int) -> float:
+        """ Timestamp of a frame in seconds """
+        return self.timestamps[frame_number] / 1000.0
+
+    def _go_to(self, target: int):
+        seek_point = int(self.seek_points[np.searchsorted(self.seek_points, target, side='right') - 1])
+        # If we are already between the seek point and the target, decoding forward is never worse than seeking
+        if not seek_point <= self.next_frame <= target:
+            if seek_point == 0:
+                self.cap.release()
+                self.cap = cv2.VideoCapture(self.video_path)
+            else:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, seek_point)
+            self.next_frame = seek_point
+            self.seeks += 1
+        while self.next_frame < target:
+            self.cap.grab()
+            self.next_frame += 1
+            self.decoded += 1
+
+    def get(self, frame_number: int):
+        """ Returns frame number frame_number, or None if the video doesn't have it """
+        if not 0 <= frame_number < self.frame_count:
+            return None
+        self._go_to(frame_number)
+        ret, frame = self.cap.read()
+        self.next_frame += 1
+        self.decoded += 1
+        return frame if ret else None
+
+    def read_frames(self, frame_numbers):
+        """ Yields (frame number, frame) for each of the requested frames, in increasing order """
+        for frame_number in sorted(set(frame_numbers)):
+            frame = self.get(frame_number)
+            if frame is not None:
+                yield frame_number, frame
+
+    def sample(self, count: int, seed=None):
+        """ Yields (frame number, frame) for count random frames (e.g. for calibration) """
+        rng = np.random.default_rng(seed)
+        count = min(count, self.frame_count)
+        return self.read_frames(rng.choice(self.frame_count, size=count, replace=False).tolist())
+
+    def release(self):
+        self.cap.release()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the seek index of a video and/or save some of its frames.")
+    parser.add_argument('video')
+    parser.add_argument('--interval', type=int, default=30, help="frames between candidate seek points")
+    parser.add_argument('--frames', help="comma separated frame numbers to save as .jpg")
+    parser.add_argument('--out', default='data/frames', help="folder to save the frames in")
+    args = parser.parse_args()
+    video = RandomAccessVideo(args.video, args.interval)
+    print(f"{video.frame_count} frames, {len(video.seek_points)} seek points")
+    if args.frames:
+        os.makedirs(args.out, exist_ok=True)
+        for frame_num, frame in video.read_frames(int(n) for n in args.frames.split(',')):
+            cv2.imwrite(os.path.join(args.out, f"frame_{frame_num:06d}.jpg"), frame)
+        print(f"Decoded {video.decoded} frames with {video.seeks} seeks")
+    video.release()
@@ -0,0 +1,184 @@
+from __future__ import annotations
+import itertools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from processing_steps import *
+from frame_cache import open_video
+
+'''
+ PARAMETER SWEEPS: runs many versions of the pipeline over one video while decoding it only once.
+ Every variant is a list of (StepClass, kwargs) pairs. Variants that start with the same steps (same class
+ and same kwargs) share those steps, so e.g. the crop/segmentation work is done once for all contrast values.
+ Every step that writes a file (an 'outfile' argument, e.g. GraphData, ActivityHeatmap, Visualize) writes it to
+ <outdir>/<label>/<name of its outfile>, and <outdir>/variants.json lists what each label was.
+'''
+
+
+def expand_grid(template, grid: dict) -> dict:
+    """
+    Makes one variant per combination of the values in grid.
+    template -> list of (StepClass, kwargs) pairs, the pipeline to vary
+    grid -> {'ClassName.kwarg': [values to try]}, e.g. {'LinearContrastAdjuster.alpha': [1.2, 1.4]}
+    Returns {label: list of (StepClass, kwargs)}, with labels like "alpha=1.2,min_feature_quality=0.2".
+    """
+    keys = list(grid)
+    variants = {}
+    for values in itertools.product(*(grid[key] for key in keys)):
+        settings = dict(zip(keys, values))
+        steps = []
+        for step_class, kwargs in template:
+            kwargs = dict(kwargs)
+            for key, value in settings.items():
+                class_name, kwarg = key.split('.', 1)
+                if step_class.__name__ == class_name:
+                    kwargs[kwarg] = value
+            steps.append((step_class, kwargs))
+        label = ','.join(f"{key.split('.', 1)[1]}={value}" for key, value in settings.items()) or 'base'
+        variants[label] = steps
+    return variants
+
+
+class _Node:
+    """ A run of steps shared by every variant below it in the tree. """
+    def __init__(self, steps=None):
+        self.steps = steps or []
+        self.children = []
+
+
+def variant_outfiles(label: str, specs, outdir: str) -> list:
+    """
+    Where each step of a variant writes its file: <outdir>/<label>/<file name of its outfile> (None for steps
+    without one). If two steps of the variant have the same file name, the step index goes in front.
+    """
+    names = [os.path.basename(kwargs['outfile']) if kwargs.get('outfile') else None for _, kwargs in specs]
+    paths = []
+    for i, name in enumerate(names):
+        if name is None:
+            paths.append(None)
+            continue
+        if names.count(name) > 1:
+            name = f'{i}_{name}'
+        paths.append(os.path.join(outdir, label, name))
+    return paths
+
+
+def _spec_key(step_class, kwargs) -> tuple:
+    return step_class.__name__, repr(sorted(kwargs.items()))
+
+
+def _build_tree(variants: dict, outdir: str) -> tuple:
+    """
+    Builds a prefix tree of the variants, so identical leading steps turn into one shared step object.
+    Returns (root node, number of step objects made, number there would be without sharing).
+    """
+    root = _Node()
+    lookup = {}  # (parent node, spec key) -> child node
+    made = 0
+    naive = 0
+    for label, specs in variants.items():
+        node = root
+        for (step_class, kwargs), outfile in zip(specs, variant_outfiles(label, specs, outdir)):
+            if outfile is not None:
+                # Every variant gets its own output files (which also makes the sinks different steps)
+                kwargs = dict(kwargs, outfile=outfile)
+            naive += 1
+            key = (id(node), _spec_key(step_class, kwargs))
+            if key not in lookup:
+                child = _Node([step_class(**kwargs)])
+                node.children.append(child)
+                lookup[key] = child
+                made += 1
+            node = lookup[key]
+
+    # Merge chains without branches into one node, so each node is one task per frame
+    def compress(node):
+        while len(node.children) == 1 and node is not root:
+            only = node.children[0]
+            node.steps += only.steps
+            node.children = only.children
+        for child in node.children:
+            compress(child)
+    compress(root)
+    return root, made, naive
+
+
+def _run_node(node: _Node, context: dict) -> dict:
+    for step in node.steps:
+        context = step.process(context)
+    return context
+
+
+def _close_tree(node: _Node):
+    for step in node.steps:
+        step.close()
+    for child in node.children:
+        _close_tree(child)
+
+
+def run_sweep(variants: dict, video_path='data/11_18-Vid11.mov', outdir='data/sweep', stride=10, workers=None):
+    """
+    Runs all the variants (as returned by expand_grid, or any {label: [(StepClass, kwargs), ...]}) over
+    every stride-th frame of the video. Each frame is decoded once and handed to all variants; where the
+    variants split, the branches run in parallel on a thread pool (OpenCV releases the GIL while it works).
+    """
+    os.makedirs(outdir, exist_ok=True)
+    for label, specs in variants.items():
+        os.makedirs(os.path.join(outdir, label), exist_ok=True)
+        for path in variant_outfiles(label, specs, outdir):
+            # GraphData appends, so start from empty files
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+    with open(os.path.join(outdir, 'variants.json'), 'w') as f:
+        json.dump({label: [[step_class.__name__, {k: repr(v) for k, v in kwargs.items()}]
+                           for step_class, kwargs in specs]
+                   for label, specs in variants.items()}, f, indent=2)
+
+    root, made, naive = _build_tree(variants, outdir)
+    print(f"{len(variants)} variants: {made} steps to run per frame instead of {naive}")
+
+    cap = open_video(video_path)
+    if not cap.isOpened():
+        print("Error: Could not open video.")
+        return
+    frame_num = 0
+    with ThreadPoolExecutor(max_workers=workers or min(len(variants), os.cpu_count() or 1)) as pool:
+        while True:
+            if not cap.grab():
+                break
+            if (frame_num % stride) != 0:
+                frame_num += 1
+                continue
+            ret, frame = cap.retrieve()
+            if not ret:
+                # (e.g. a frame that a strided frame cache doesn't have)
+                frame_num += 1
+                continue
+            process_context = {
+                'original_frame': frame.copy(),
+                'current_frame': frame,
+                'frame_number': frame_num
+            }
+            # Go down the tree one level at a time, all the nodes of a level in parallel. Steps replace
+            # context items instead of changing arrays in place, so a shallow copy per branch is enough.
+            level = [(child, process_context if i == 0 else dict(process_context))
+                     for i, child in enumerate(root.children)]
+            while level:
+                results = list(pool.map(lambda item: _run_node(*item), level))
+                level = [(child, context if i == 0 else dict(context))
+                         for (node, _), context in zip(level, results)
+                         for i, child in enumerate(node.children)]
+            frame_num += 1
+    cap.release()
+    _close_tree(root)
+
+
+if __name__ == "__main__":
+    # The standard pipeline (pipeline.json), as (StepClass, kwargs) pairs
+    template = [(step_class(kwargs.pop('step')), kwargs) for kwargs in default_config()]
+    variants = expand_grid(template, {
+        'LinearContrastAdjuster.alpha': [1.2, 1.4, 1.6],
+        'OpticalFlowCalculator.min_feature_quality': [0.1, 0.2],
+    })
+    run_sweep(variants)
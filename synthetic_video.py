@@ -0,0 +1,69 @@
+from __future__ import annotations
+import argparse
+import cv2
+import numpy as np
+
+'''
+ SYNTHETIC VIDEO: a small made-up tank video for the check_*.py scripts, so they don't need the real
+ footage. A fixed textured background (so there are corners to track) with a few textured "fish" swimming
+ around on smooth paths. The same seed always gives the same video.
+
+    python synthetic_video.py data/synthetic.avi --frames 120
+'''
+
+
+def make_video(path: str, frames: int = 120, size=(320, 240), fps: float = 30, fish: int = 4, seed: int = 0) -> str:
+    """ Writes the video to path (.avi -> MJPG, anything else -> mp4v) and returns path """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (5, 5), 0)
+    background = cv2.addWeighted(background, 0.5, np.full_like(background, (90, 120, 110)), 0.5, 0)
+    skins = [cv2.GaussianBlur(rng.integers(0, 256, (41, 41, 3), dtype=np.uint8), (3, 3), 0) for _ in range(fish)]
+    # Each fish goes around an ellipse at its own speed
+    paths = [(rng.uniform(0.3, 0.7) * width, rng.uniform(0.3, 0.7) * height, rng.uniform(0.1, 0.3) * width,
+              rng.uniform(0.1, 0.3) * height, rng.uniform(0.02, 0.08), rng.uniform(0, 2 * np.pi)) for _ in range(fish)]
+
+    fourcc = cv2.VideoWriter_fourcc(*('MJPG' if path.lower().endswith('.avi') else 'mp4v'))
+    writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+    if not writer.isOpened():
+        raise IOError(f"Could not write video {path}")
+    for t in range(frames):
+        frame = background.copy()
+        for skin, (cx, cy, rx, ry, speed, phase) in zip(skins, paths):
+            x = int(cx + rx * np.cos(phase + speed * t)) - 20
+            y = int(cy + ry * np.sin(phase + speed * t)) - 20
+            body = np.zeros((41, 41), np.uint8)
+            cv2.ellipse(body, (20, 20), (18, 8), 0, 0, 360, 255, -1)
+            # Only the part of the fish inside the frame
+            x0, y0 = max(x, 0), max(y, 0)
+            x1, y1 = min(x + 41, width), min(y + 41, height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            region = frame[y0:y1, x0:x1]
+            inside = body[y0 - y:y1 - y, x0 - x:x1 - x] > 0
+            region[inside] = skin[y0 - y:y1 - y, x0 - x:x1 - x][inside]
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def read_all(path: str) -> list:
+    """ Every frame of a video, decoded front to back """
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a small synthetic tank video.")
+    parser.add_argument('path', nargs='?', default='data/synthetic.avi')
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(make_video(args.path, args.frames, seed=args.seed))